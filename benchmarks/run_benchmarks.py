@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the hot paths of svj.core, using local stand-ins for the SE
+(benchmarks/xrdfs) and without condor.
+
+Run all benchmarks and store the results under benchmarks/results/<commit>.json:
+    python benchmarks/run_benchmarks.py
+Run a subset:
+    python benchmarks/run_benchmarks.py chunkify run_command_chatty
+Compare two stored results:
+    python benchmarks/run_benchmarks.py --compare results/abc123.json results/def456.json
+"""
+from __future__ import print_function
+
+import os.path as osp
+import argparse, logging, os, sys, time, json, shutil, tempfile, subprocess, collections
+
+BENCHMARK_DIR = osp.dirname(osp.abspath(__file__))
+sys.path.insert(0, osp.dirname(BENCHMARK_DIR))
+os.environ.setdefault('USER', 'benchmark')
+import svj.core
+
+logger = logging.getLogger('root')
+
+BENCHMARKS = collections.OrderedDict()
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function takes a work directory and
+    a scale factor, does any setup, and returns the callable to be timed.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+class mock_se(object):
+    """
+    Puts the mock xrdfs on the PATH, serving files from `root` with `latency`
+    seconds per call
+    """
+    def __init__(self, root, latency=0.):
+        super(mock_se, self).__init__()
+        self.root = root
+        self.latency = latency
+
+    def __enter__(self):
+        self._backup = dict(os.environ)
+        os.environ['PATH'] = BENCHMARK_DIR + os.pathsep + os.environ['PATH']
+        os.environ['SVJ_MOCK_SE_ROOT'] = self.root
+        os.environ['SVJ_MOCK_SE_LATENCY'] = str(self.latency)
+
+    def __exit__(self, type, value, traceback):
+        os.environ.clear()
+        os.environ.update(self._backup)
+
+
+def touch_files(directory, n, ext='.root'):
+    if not osp.isdir(directory): os.makedirs(directory)
+    for i in range(n):
+        open(osp.join(directory, 'file_{0:07d}{1}'.format(i, ext)), 'w').close()
+
+
+@benchmark('chunkify')
+def bench_chunkify(workdir, scale):
+    mylist = list(range(int(20000 * scale)))
+    return lambda: svj.core.utils.chunkify(mylist, 200)
+
+
+@benchmark('get_rootfiles_for_job')
+def bench_get_rootfiles_for_job(workdir, scale):
+    directories = []
+    for i in range(4):
+        directory = osp.join(workdir, 'dataset_{0}'.format(i))
+        touch_files(directory, int(2500 * scale))
+        directories.append(directory)
+    return lambda: svj.core.utils.get_rootfiles_for_job(directories, 200, 137)
+
+
+@benchmark('smart_list_root_files_mock_se')
+def bench_smart_list_root_files(workdir, scale):
+    lfns = []
+    for i in range(4):
+        lfn = '/store/user/benchmark/dataset_{0}'.format(i)
+        touch_files(osp.join(workdir, lfn.lstrip('/')), int(1000 * scale))
+        lfns.append(svj.core.seutils.format(lfn))
+    def run():
+        with mock_se(workdir, latency=0.05):
+            svj.core.utils.smart_list_root_files(lfns)
+    return run
+
+
+@benchmark('pathstore_job_slice')
+def bench_pathstore_job_slice(workdir, scale):
+    paths = [
+        'root://cmseos.fnal.gov//store/user/benchmark/dataset_{0}/file_{1:07d}.root'.format(i % 4, i)
+        for i in range(int(200000 * scale))
+        ]
+    store_file = osp.join(workdir, 'dataset.paths')
+    svj.core.pathstore.PathStore(paths).save(store_file)
+    return lambda: list(svj.core.pathstore.PathStore.load(store_file).chunk(137, 200))
+
+
+@benchmark('run_command_chatty')
+def bench_run_command(workdir, scale):
+    cmd = [ sys.executable, '-c', 'for i in range({0}): print(i)'.format(int(100000 * scale)) ]
+    return lambda: svj.core.utils.run_command(cmd)
+
+
+@benchmark('tarball_cmssw_create_extract')
+def bench_tarball_cmssw(workdir, scale):
+    cmssw = osp.join(workdir, 'CMSSW_10_2_21')
+    for i in range(int(20 * scale)):
+        directory = osp.join(cmssw, 'src', 'Package{0}'.format(i), 'plugins')
+        os.makedirs(directory)
+        for j in range(20):
+            with open(osp.join(directory, 'file{0}.cc'.format(j)), 'w') as f:
+                f.write('// synthetic source file\n' * 200)
+    os.makedirs(osp.join(cmssw, 'lib'))
+    with open(osp.join(cmssw, 'lib', 'libSynthetic.so'), 'wb') as f:
+        f.write(os.urandom(int(5e6 * scale)))
+    outdir = osp.join(workdir, 'out')
+    os.makedirs(outdir)
+    def run():
+        svj.core.utils.tarball_cmssw(cmssw, outdir=outdir)
+        tarball = osp.join(outdir, 'CMSSW_10_2_21.tar.gz')
+        extractdir = osp.join(outdir, 'extract')
+        os.makedirs(extractdir)
+        svj.core.utils.extract_tarball(tarball, extractdir)
+        os.remove(tarball)
+        shutil.rmtree(extractdir)
+    return run
+
+
+@benchmark('jdl_generation_large_cluster')
+def bench_jdl_generation(workdir, scale):
+    python_file = osp.join(workdir, 'job.py')
+    open(python_file, 'w').close()
+    def run():
+        jdl = svj.core.condor.jobfiles.JDLProduction(
+            osp.join(workdir, 'job.sh'), python_file, int(10000 * scale)
+            )
+        for i in range(50):
+            jdl.transfer_input_files.append('tarball_{0}.tar'.format(i))
+        jdl.to_file(osp.join(workdir, 'job.jdl'))
+        sh = svj.core.condor.jobfiles.SHPython(python_file)
+        for i in range(50):
+            sh.add_code_tarball('tarball_{0}.tar'.format(i))
+        sh.to_file(osp.join(workdir, 'job.sh'))
+    return run
+
+
+@benchmark('jobfiles_parameter_scan')
+def bench_jobfiles_scan(workdir, scale):
+    python_file = osp.join(workdir, 'job.py')
+    open(python_file, 'w').close()
+    points = [ { 'mz' : mz } for mz in range(100, 100 + int(2000 * scale)) ]
+    def run():
+        jdl = svj.core.condor.jobfiles.JDLProduction('job_@{mz}.sh', python_file, 10)
+        jdl.environment['SVJ_MZ'] = '@{mz}'
+        jdl.to_files(
+            (osp.join(workdir, 'job_{0}.jdl'.format(point['mz'])), point) for point in points
+            )
+        sh = svj.core.condor.jobfiles.SHPython(python_file)
+        sh.to_files(
+            (osp.join(workdir, 'job_{0}.sh'.format(point['mz'])), point) for point in points
+            )
+    return run
+
+
+def python_startups(code, scale, **env):
+    """
+    Returns a callable that runs code in 10*scale fresh interpreters
+    """
+    cmd = [ sys.executable, '-c', code ]
+    env = dict(os.environ, PYTHONPATH=osp.dirname(BENCHMARK_DIR), **env)
+    def run():
+        for i in range(max(1, int(10 * scale))):
+            subprocess.check_call(cmd, env=env)
+    return run
+
+
+@benchmark('python_startup')
+def bench_python_startup(workdir, scale):
+    # Reference for the import benchmarks below, which include interpreter startup
+    return python_startups('pass', scale)
+
+
+@benchmark('import_svj_core')
+def bench_import(workdir, scale):
+    return python_startups('import svj.core; svj.core.seutils.format("/store/user/x")', scale)
+
+
+@benchmark('import_svj_core_eager')
+def bench_import_eager(workdir, scale):
+    return python_startups('import svj.core', scale, SVJ_EAGER_IMPORTS='1')
+
+
+def time_benchmark(name, scale, repeat):
+    workdir = tempfile.mkdtemp(prefix='svjbench_')
+    try:
+        func = BENCHMARKS[name](workdir, scale)
+        times = []
+        for i in range(repeat):
+            t0 = time.time()
+            func()
+            times.append(time.time() - t0)
+    finally:
+        shutil.rmtree(workdir)
+    times.sort()
+    return collections.OrderedDict([
+        ('min', times[0]),
+        ('median', times[len(times)//2]),
+        ('mean', sum(times) / len(times)),
+        ('repeat', repeat),
+        ('scale', scale),
+        ])
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR
+            ).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return 'unknown'
+
+
+def compare(file_a, file_b, threshold=0.10):
+    """
+    Prints the ratio of median times of two result files, flagging
+    changes larger than threshold
+    """
+    with open(file_a) as f: a = json.load(f, object_pairs_hook=collections.OrderedDict)
+    with open(file_b) as f: b = json.load(f, object_pairs_hook=collections.OrderedDict)
+    print('{0:<35} {1:>12} {2:>12} {3:>8}'.format('benchmark', a['commit'], b['commit'], 'ratio'))
+    for name in a['results']:
+        if not name in b['results']: continue
+        t_a = a['results'][name]['median']
+        t_b = b['results'][name]['median']
+        ratio = t_b / t_a if t_a > 0 else float('inf')
+        flag = ''
+        if ratio > 1. + threshold: flag = 'SLOWER'
+        elif ratio < 1. - threshold: flag = 'faster'
+        print('{0:<35} {1:>12.4f} {2:>12.4f} {3:>8.2f} {4}'.format(name, t_a, t_b, ratio, flag))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmarks', nargs='*', help='Benchmarks to run (default all)')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-s', '--scale', type=float, default=1., help='Scale factor on the problem sizes')
+    parser.add_argument('-o', '--outfile', type=str, help='Defaults to benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('A', 'B'), help='Compare two result files')
+    parser.add_argument('-l', '--list', action='store_true', help='List the available benchmarks')
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(BENCHMARKS.keys()))
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # The svj loggers are very chatty; only keep errors
+    logging.getLogger('root').setLevel(logging.ERROR)
+    logging.getLogger('subprocess').setLevel(logging.ERROR)
+
+    names = args.benchmarks if args.benchmarks else list(BENCHMARKS.keys())
+    results = collections.OrderedDict()
+    for name in names:
+        results[name] = time_benchmark(name, args.scale, args.repeat)
+        print('{0:<35} median {1:.4f}s  min {2:.4f}s'.format(
+            name, results[name]['median'], results[name]['min']
+            ))
+
+    commit = get_commit()
+    outfile = args.outfile
+    if outfile is None:
+        outfile = osp.join(BENCHMARK_DIR, 'results', commit + '.json')
+    if not osp.isdir(osp.dirname(osp.abspath(outfile))): os.makedirs(osp.dirname(osp.abspath(outfile)))
+    with open(outfile, 'w') as f:
+        json.dump({
+            'commit' : commit,
+            'date' : time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python' : sys.version.split()[0],
+            'results' : results,
+            }, f, indent=2)
+    print('Results written to {0}'.format(outfile))
+
+#____________________________________________________________________
+if __name__ == "__main__":
+    main()
@@ -13,5 +13,12 @@ setup(
     zip_safe      = False,
     scripts       = [
         'svj/bin/svj-pyjob-cmssw',
+        'svj/bin/svj-timing-summary',
+        'svj/bin/svj-blobstore-gc',
+        'svj/bin/svj-catalog',
+        'svj/bin/svj-ls',
+        'svj/bin/svj-du',
+        'svj/bin/svj-cp',
+        'svj/bin/svj-rm',
         ],
     )
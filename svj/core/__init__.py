@@ -2,17 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import os.path as osp
-import os, logging
+import os, sys, logging, importlib, types
 
-from .logger import setup_logger, setup_subprocess_logger, set_log_file
-logger = setup_logger()
-subprocess_logger = setup_subprocess_logger()
-
-
-from . import utils
 
 def tarball(outfile=None, dry=False):
     """ Wrapper function to create a tarball of svj.core """
+    from . import utils
     return utils.tarball(__file__, outfile=outfile, dry=dry)
 
 # Path to do any temporary running on
@@ -22,7 +17,65 @@ if 'SVJ_BATCH_MODE' in os.environ:
     RUNDIR = osp.join(os.environ['_CONDOR_SCRATCH_DIR'], 'svj')
     BATCH_MODE = True
 
-from . import seutils
-import condor.jobfiles
-import condor.submitters
-from cmssw_tarball import CMSSWTarball
\ No newline at end of file
+
+# Submodules are only imported on first access (e.g. svj.core.seutils.format),
+# so that batch jobs that only need a few helpers do not pay for the rest
+_SUBMODULES = [
+    'profiling', 'utils', 'sebackends', 'seutils', 'endpoints', 'timing', 'eventindex',
+    'merge', 'blobstore', 'prefetch', 'catalog', 'checkpoint', 'pathstore', 'condor', 'cmssw_tarball',
+    ]
+_ATTRIBUTES = {
+    'CMSSWTarball' : 'cmssw_tarball',
+    'setup_logger' : 'logger', 'setup_subprocess_logger' : 'logger', 'set_log_file' : 'logger',
+    }
+_LOGGERS = [ 'logger', 'subprocess_logger' ]
+_logging_is_set_up = False
+
+def _setup_logging():
+    """
+    Installs the svj log handlers on the first use of svj.core (a submodule,
+    an attribute or svj.core.logger) rather than on import
+    """
+    global _logging_is_set_up
+    if _logging_is_set_up: return
+    _logging_is_set_up = True
+    # Importing .logger sets svj.core.logger to the module; replace it by the logger
+    logger_module = importlib.import_module('.logger', __name__)
+    module = sys.modules[__name__]
+    module.logger = logger_module.setup_logger()
+    module.subprocess_logger = logger_module.setup_subprocess_logger()
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        _setup_logging()
+        return importlib.import_module('.' + name, __name__)
+    elif name in _LOGGERS:
+        _setup_logging()
+        return getattr(sys.modules[__name__], name)
+    elif name in _ATTRIBUTES:
+        _setup_logging()
+        value = getattr(importlib.import_module('.' + _ATTRIBUTES[name], __name__), name)
+        setattr(sys.modules[__name__], name, value)
+        return value
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES) | set(_LOGGERS) | set(_ATTRIBUTES))
+
+if sys.version_info < (3, 7):
+    # No module level __getattr__ before python 3.7 (PEP 562): replace this
+    # module in sys.modules by an instance of a module type with __getattr__
+    class _LazyModule(types.ModuleType):
+        def __getattr__(self, name):
+            return __getattr__(name)
+        def __dir__(self):
+            return __dir__()
+    _module = _LazyModule(__name__)
+    _module.__dict__.update(globals())
+    # Python 2 clears the globals of a module when it is garbage collected
+    _module._original_module = sys.modules[__name__]
+    sys.modules[__name__] = _module
+
+if os.environ.get('SVJ_EAGER_IMPORTS', '0') != '0':
+    for _name in _SUBMODULES + list(_ATTRIBUTES): __getattr__(_name)
+    del _name
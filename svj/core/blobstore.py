@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store for submission inputs (python files, CMSSW tarballs,
+code tarballs), so that identical files are stored once on the submit node
+and hardlinked into every rundir that uses them.
+
+Blobs are stored as <store>/blobs/<sha1[:2]>/<sha1> and made read-only, since
+every hardlink shares the same content. The sha1 of an input file is cached by
+(path, size, mtime) in <store>/hashes.json, so unchanged files are hashed once.
+A blob that is no longer hardlinked from any rundir has a link count of 1 and
+is removed by gc (see svj-blobstore-gc).
+
+The store defaults to $SVJ_BLOB_STORE, or else .svj_blobstore in the directory
+that contains the rundir (the submit directory), so that it is on the same
+filesystem as the rundirs; hardlinks cannot cross filesystems, and files are
+copied instead. Setting SVJ_BLOB_STORE=0 disables the store and falls back to
+plain copies.
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, json, shutil, tempfile, errno, stat, threading, time
+import svj.core
+
+logger = logging.getLogger('root')
+
+# Name of the default store, in the directory that contains the rundirs
+DEFAULT_STORE = '.svj_blobstore'
+
+
+class BlobStore(object):
+    """
+    Content-addressed store of files in directory root
+    """
+    def __init__(self, root=DEFAULT_STORE):
+        super(BlobStore, self).__init__()
+        self.root = osp.abspath(root)
+        self.blob_dir = osp.join(self.root, 'blobs')
+        self.hash_cache_file = osp.join(self.root, 'hashes.json')
+        self._hash_cache = None
+        self._lock = threading.Lock()
+
+    def blob_path(self, checksum):
+        return osp.join(self.blob_dir, checksum[:2], checksum)
+
+    def _load_hash_cache(self):
+        if self._hash_cache is None:
+            self._hash_cache = {}
+            if osp.isfile(self.hash_cache_file):
+                try:
+                    with open(self.hash_cache_file, 'r') as f:
+                        self._hash_cache = json.load(f)
+                except ValueError:
+                    logger.warning('Corrupt hash cache %s; rehashing', self.hash_cache_file)
+        return self._hash_cache
+
+    def _save_hash_cache(self):
+        # Atomic replace; concurrent submissions at worst lose each other's entries
+        if not osp.isdir(self.root): os.makedirs(self.root)
+        fd, tmp_file = tempfile.mkstemp(dir=self.root, prefix='.hashes_')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._hash_cache, f)
+        os.rename(tmp_file, self.hash_cache_file)
+
+    def checksum(self, path):
+        """
+        Returns the sha1 of path, from the hash cache if path did not change
+        """
+        path = osp.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            cache = self._load_hash_cache()
+            cached = cache.get(path)
+            if cached and cached[0] == st.st_size and cached[1] == st.st_mtime:
+                return cached[2]
+        checksum = svj.core.utils.sha1sum(path)
+        with self._lock:
+            self._hash_cache[path] = [ st.st_size, st.st_mtime, checksum ]
+            self._save_hash_cache()
+        return checksum
+
+    def add(self, path):
+        """
+        Adds the file path to the store if its contents are not in it yet.
+        Returns the path of the blob.
+        """
+        checksum = self.checksum(path)
+        blob = self.blob_path(checksum)
+        if not osp.isfile(blob):
+            if not osp.isdir(osp.dirname(blob)): svj.core.utils.create_directory(osp.dirname(blob))
+            # Copy to a temporary file in the store first, so a blob is never incomplete
+            fd, tmp_file = tempfile.mkstemp(dir=osp.dirname(blob), prefix='.' + checksum + '_')
+            os.close(fd)
+            logger.info('Adding %s to the blob store as %s', path, checksum)
+            shutil.copyfile(path, tmp_file)
+            os.chmod(tmp_file, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.rename(tmp_file, blob)
+        return blob
+
+    def link(self, src, dst):
+        """
+        Hardlinks the blob with the contents of src to dst. Falls back to a
+        copy if the store is on a different filesystem than dst.
+        """
+        blob = self.add(src)
+        try:
+            os.link(blob, dst)
+            logger.info('Linked %s --> %s (blob %s)', src, dst, osp.basename(blob))
+        except OSError as e:
+            if e.errno != errno.EXDEV: raise
+            logger.warning(
+                'Blob store %s is on a different filesystem than %s; copying instead',
+                self.root, dst
+                )
+            shutil.copyfile(src, dst)
+        return blob
+
+    def adopt(self, path):
+        """
+        Replaces the file path by a hardlink to its blob, e.g. for freshly
+        created tarballs that may be identical to earlier ones
+        """
+        blob = self.add(path)
+        if osp.samefile(blob, path): return blob
+        tmp_link = path + '.svjlink'
+        try:
+            os.link(blob, tmp_link)
+        except OSError as e:
+            if e.errno != errno.EXDEV: raise
+            return blob
+        os.rename(tmp_link, path)
+        return blob
+
+    def iter_blobs(self):
+        if not osp.isdir(self.blob_dir): return
+        for prefix in sorted(os.listdir(self.blob_dir)):
+            for name in sorted(os.listdir(osp.join(self.blob_dir, prefix))):
+                yield osp.join(self.blob_dir, prefix, name)
+
+    def gc(self, dry=False):
+        """
+        Removes blobs that are not hardlinked from anywhere anymore (link
+        count 1), and their entries in the hash cache.
+        Returns (number of blobs removed, bytes freed).
+        """
+        n_removed = 0
+        n_bytes = 0
+        removed = set()
+        for blob in self.iter_blobs():
+            st = os.stat(blob)
+            if osp.basename(blob).startswith('.'):
+                # Temporary file of an add; only clean up leftovers of interrupted adds
+                if time.time() - st.st_mtime < 3600: continue
+            elif st.st_nlink > 1:
+                continue
+            logger.info('%s unreferenced blob %s', 'Would remove' if dry else 'Removing', blob)
+            if not dry: os.remove(blob)
+            removed.add(osp.basename(blob))
+            n_removed += 1
+            n_bytes += st.st_size
+        with self._lock:
+            cache = self._load_hash_cache()
+            for path in [ p for p, entry in cache.items() if entry[2] in removed ]:
+                del cache[path]
+            if removed and not dry: self._save_hash_cache()
+        logger.info(
+            '%s %s blobs, %.1f MB',
+            'Would remove' if dry else 'Removed', n_removed, n_bytes / 1024.**2
+            )
+        return n_removed, n_bytes
+
+
+def get_store(path):
+    """
+    Returns the BlobStore at $SVJ_BLOB_STORE, or else the default store for
+    the file path in a rundir (DEFAULT_STORE next to the rundir), or None if
+    the store is disabled with SVJ_BLOB_STORE=0
+    """
+    root = os.environ.get('SVJ_BLOB_STORE')
+    if root is None:
+        root = osp.join(osp.dirname(osp.dirname(osp.abspath(path))), DEFAULT_STORE)
+    if root in ['', '0']: return None
+    return BlobStore(root)
+
+
+def link_file(src, dst, dry=False):
+    """
+    Like svj.core.utils.copy_file, but hardlinks src into dst through the
+    blob store, so that identical inputs are stored only once
+    """
+    store = get_store(dst)
+    if store is None or dry:
+        svj.core.utils.copy_file(src, dst, dry=dry)
+        return
+    if osp.isfile(dst):
+        raise OSError('{0} already exists, abort linking'.format(dst))
+    store.link(src, dst)
+
+
+def adopt_file(path, dry=False):
+    """
+    Replaces path by a hardlink into the blob store, if the store is enabled
+    """
+    store = get_store(path)
+    if store is None or dry: return
+    store.adopt(path)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SQLite catalog of the expected outputs of the jobs in a rundir, to find
+the jobs that did not produce (valid) output and resubmit only those.
+
+At submit time every job (condor process) registers the output files it
+should produce (see PySubmitter.expected_output). The catalog is then filled
+in from one recursive listing of the output directory (update_from_listing),
+or from records that jobs write with record_output (update_from_records).
+An output is 'done' if it exists and is at least min_size bytes, 'corrupt'
+if it is smaller, and 'missing' otherwise.
+
+    catalog = svj.core.catalog.OutputCatalog('rundir/svj_catalog.sqlite')
+    catalog.update_from_listing()
+    catalog.write_resubmission_jdl('rundir/job.jdl', 'rundir/job_resubmit.jdl')
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, json, re, sqlite3, time
+import svj.core
+
+logger = logging.getLogger('root')
+
+CATALOG_FILE = 'svj_catalog.sqlite'
+OUTPUT_RECORDS_PATTERN = 'svj_outputs_*.jsonl'
+# Condor macros are case-insensitive, and $(ProcId) is an alias of $(Process)
+PROCESS_MACRO = re.compile(r'\$\((Process|ProcId)\)', re.IGNORECASE)
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS jobs (process INTEGER PRIMARY KEY, arguments TEXT)',
+    (
+        'CREATE TABLE IF NOT EXISTS outputs ('
+        'path TEXT PRIMARY KEY, process INTEGER NOT NULL, status TEXT NOT NULL, '
+        'size INTEGER, updated REAL)'
+        ),
+    'CREATE INDEX IF NOT EXISTS outputs_status ON outputs (status, process)',
+    ]
+
+
+def _normalize(path):
+    return svj.core.seutils.format(path) if svj.core.utils._is_se_path(path) else osp.abspath(path)
+
+
+def _list_recursive(directory):
+    """
+    Returns a dict path -> size of all files under directory (local or SE)
+    """
+    if svj.core.utils._is_se_path(directory):
+        return dict(
+            (e.path, e.size) for e in svj.core.seutils.list_recursive(directory) if not e.is_dir
+            )
+    sizes = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = osp.join(root, name)
+            sizes[path] = os.stat(path).st_size
+    return sizes
+
+
+class OutputCatalog(object):
+    """
+    Expected and found outputs per job, stored in the sqlite file db_file
+    """
+    def __init__(self, db_file=CATALOG_FILE, min_size=1):
+        super(OutputCatalog, self).__init__()
+        self.db_file = db_file
+        self.min_size = min_size
+        self.connection = sqlite3.connect(db_file)
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def register_job(self, process, outputs, arguments=None):
+        """
+        Registers the outputs that condor process `process` should produce,
+        and the queue arguments it was submitted with
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO jobs (process, arguments) VALUES (?, ?)',
+                (process, arguments)
+                )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO outputs (path, process, status, size, updated) '
+                'VALUES (?, ?, \'missing\', NULL, NULL)',
+                [ (_normalize(path), process) for path in outputs ]
+                )
+
+    def register_jobs(self, jobs):
+        """
+        Takes an iterable of (process, outputs, arguments)
+        """
+        n_jobs = 0
+        for process, outputs, arguments in jobs:
+            self.register_job(process, outputs, arguments)
+            n_jobs += 1
+        logger.info('Registered the expected outputs of %s jobs in %s', n_jobs, self.db_file)
+
+    def output_directory(self):
+        """
+        Returns the deepest directory that contains all expected outputs
+        """
+        paths = [ row[0] for row in self.connection.execute('SELECT path FROM outputs') ]
+        if not paths: return None
+        if len(paths) == 1: return osp.dirname(paths[0])
+        prefix = osp.commonprefix(paths)
+        return prefix[:prefix.rfind('/')]
+
+    def set_sizes(self, sizes):
+        """
+        Updates the status of the expected outputs from a dict path -> size;
+        expected outputs not in sizes become 'missing'
+        """
+        now = time.time()
+        rows = []
+        for path, in self.connection.execute('SELECT path FROM outputs'):
+            size = sizes.get(path)
+            if size is None:
+                status = 'missing'
+            elif size < self.min_size:
+                status = 'corrupt'
+            else:
+                status = 'done'
+            rows.append((status, size, now, path))
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE outputs SET status=?, size=?, updated=? WHERE path=?', rows
+                )
+
+    def update_from_listing(self, directory=None):
+        """
+        Fills in the catalog from one recursive listing of directory, by default
+        the directory containing all expected outputs
+        """
+        if directory is None: directory = self.output_directory()
+        if directory is None:
+            logger.warning('No expected outputs in %s', self.db_file)
+            return
+        logger.info('Listing %s', directory)
+        sizes = dict((_normalize(path), size) for path, size in _list_recursive(directory).items())
+        self.set_sizes(sizes)
+        self.log_summary()
+
+    def update_from_records(self, paths):
+        """
+        Fills in the catalog from output records written by record_output;
+        paths can be record files or directories containing them (e.g. the
+        rundir, whose output directory is searched as well, since production
+        jobs write their records there).
+        Outputs without a record are left as they are.
+        """
+        if not isinstance(paths, (list, tuple)): paths = [paths]
+        paths = list(paths) + [
+            osp.join(p, 'output') for p in paths if osp.isdir(osp.join(p, 'output'))
+            ]
+        now = time.time()
+        rows = []
+        for record_file in svj.core.timing.iter_timing_files(paths, OUTPUT_RECORDS_PATTERN):
+            with open(record_file, 'r') as f:
+                for line in f:
+                    if not line.strip(): continue
+                    record = json.loads(line)
+                    size = record.get('size')
+                    status = 'corrupt' if size is not None and size < self.min_size else 'done'
+                    rows.append((status, size, now, _normalize(record['path'])))
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE outputs SET status=?, size=?, updated=? WHERE path=?', rows
+                )
+        self.log_summary()
+
+    def counts(self):
+        """
+        Returns a dict status -> number of outputs
+        """
+        return dict(self.connection.execute('SELECT status, COUNT(*) FROM outputs GROUP BY status'))
+
+    def log_summary(self):
+        counts = self.counts()
+        logger.info(
+            'Outputs: %s done, %s missing, %s corrupt',
+            counts.get('done', 0), counts.get('missing', 0), counts.get('corrupt', 0)
+            )
+
+    def incomplete_jobs(self):
+        """
+        Returns the sorted list of processes with at least one missing or corrupt output
+        """
+        return [ row[0] for row in self.connection.execute(
+            'SELECT DISTINCT process FROM outputs WHERE status IN (\'missing\', \'corrupt\') '
+            'ORDER BY process'
+            )]
+
+    def bad_outputs(self):
+        """
+        Returns a list of (process, path, status) of the missing and corrupt outputs
+        """
+        return list(self.connection.execute(
+            'SELECT process, path, status FROM outputs WHERE status IN (\'missing\', \'corrupt\') '
+            'ORDER BY process, path'
+            ))
+
+    def write_resubmission_jdl(self, jdl_file, out_file=None, dry=False):
+        """
+        Writes a copy of jdl_file that only queues the incomplete jobs, with the
+        same $(Process) and arguments as in the original submission.
+        Returns the path of the new .jdl, or None if all jobs are complete.
+        """
+        processes = self.incomplete_jobs()
+        if not processes:
+            logger.info('All jobs in %s are complete', self.db_file)
+            return None
+        if out_file is None:
+            out_file = jdl_file.replace('.jdl', '') + '_resubmit.jdl'
+        arguments = dict(self.connection.execute('SELECT process, arguments FROM jobs'))
+        with open(jdl_file, 'r') as f:
+            lines = f.read().split('\n')
+        # The original process id is passed as a queue variable, and replaces
+        # $(Process) everywhere (CONDOR_PROCESS_ID, timing and log file names, ...)
+        lines = [
+            PROCESS_MACRO.sub('$(SVJ_PROCESS)', l)
+            for l in lines if not re.match(r'\s*queue\b', l)
+            ]
+        # A resubmitted job must see its original process id, or it writes its
+        # outputs (e.g. svj_timing_<cluster>_<process>.jsonl) under another name
+        # than transfer_output_files expects, and condor holds it
+        text = '\n'.join(lines)
+        if not 'CONDOR_PROCESS_ID=\'$(SVJ_PROCESS)\'' in text:
+            raise ValueError(
+                'Cannot pass the original process ids to the jobs of {0}'.format(jdl_file)
+                )
+        if any(arguments.get(p) for p in processes):
+            lines.append('queue SVJ_PROCESS,arguments from (')
+            lines.extend('    {0}, {1}'.format(p, arguments[p]) for p in processes)
+        else:
+            lines.append('queue SVJ_PROCESS from (')
+            lines.extend('    {0}'.format(p) for p in processes)
+        lines.append(')')
+        logger.info('Writing %s to resubmit %s jobs: %s', out_file, len(processes), processes)
+        if not dry:
+            with open(out_file, 'w') as f:
+                f.write('\n'.join(lines))
+        return out_file
+
+
+def record_output(path, size=None, records_file=None):
+    """
+    To be called in a job after staging out an output file; appends a record
+    to $SVJ_OUTPUT_RECORDS (default svj_outputs_<cluster>_<process>.jsonl)
+    for OutputCatalog.update_from_records. Production jobs set
+    SVJ_OUTPUT_RECORDS to a file in output, which is transferred back.
+    """
+    if records_file is None:
+        records_file = os.environ.get('SVJ_OUTPUT_RECORDS', 'svj_outputs_{0}_{1}.jsonl'.format(
+            os.environ.get('CONDOR_CLUSTER_NUMBER', 0), os.environ.get('CONDOR_PROCESS_ID', 0)
+            ))
+    if size is None and not svj.core.utils._is_se_path(path) and osp.isfile(path):
+        size = os.stat(path).st_size
+    with open(records_file, 'a') as f:
+        f.write(json.dumps({
+            'path' : path, 'size' : size, 'time' : time.time(),
+            'process' : os.environ.get('CONDOR_PROCESS_ID'),
+            }) + '\n')
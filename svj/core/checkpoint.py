@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Step-level checkpoints for multi-step payloads (e.g. gen, sim, reco, nano),
+so that a resubmitted job resumes at the first step that did not finish.
+
+    steps = [
+        ('gen',  run_gen,  ['gen.root']),
+        ('sim',  run_sim,  ['sim.root']),
+        ('reco', run_reco, ['reco.root']),
+        ('nano', run_nano, ['nano.root']),
+        ]
+    svj.core.checkpoint.Checkpoint().run(steps)
+
+After a step succeeds, its outputs are staged to
+<directory>/<key>/<step>/<file>, followed by a small marker file
+<directory>/<key>/<step>.done; a step counts as done only if its marker
+exists. On restart the steps before the first unfinished one are skipped,
+and only the outputs of the last finished step are copied back.
+
+The directory defaults to $SVJ_CHECKPOINT_DIR (set by the submitter from the
+checkpoint_dir directive), and the key to the seed of the payload, or else
+its job index; resubmitted jobs get the same seed and job index. Without a
+directory, nothing is checkpointed and all steps simply run.
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, json, shutil, tempfile, time
+import svj.core
+
+logger = logging.getLogger('root')
+
+MARKER_EXTENSION = '.done'
+
+
+def default_key():
+    """
+    Identifies the payload: seed<SVJ_SEED> if there is a seed, else job<index>
+    """
+    if os.environ.get('SVJ_SEED'):
+        return 'seed{0}'.format(os.environ['SVJ_SEED'])
+    return 'job{0}'.format(os.environ.get('SVJ_JOB_INDEX', os.environ.get('CONDOR_PROCESS_ID', 0)))
+
+
+def _is_file(path):
+    return svj.core.seutils.is_file(path) if svj.core.utils._is_se_path(path) else osp.isfile(path)
+
+
+def _list_directory(directory):
+    if svj.core.utils._is_se_path(directory):
+        if not svj.core.seutils.is_directory(directory): return []
+        return svj.core.seutils.list_directory(directory)
+    if not osp.isdir(directory): return []
+    return [ osp.join(directory, name) for name in os.listdir(directory) ]
+
+
+def _stage_out(src, dst):
+    if svj.core.utils._is_se_path(dst):
+        # xrdcp does not overwrite; remove a leftover of an interrupted attempt first
+        if svj.core.seutils.is_file(dst): svj.core.seutils.remove(dst)
+        svj.core.seutils.copy_to_se(src, dst)
+    else:
+        if not osp.isdir(osp.dirname(dst)): os.makedirs(osp.dirname(dst))
+        shutil.copyfile(src, dst)
+
+
+def _stage_in(src, dst):
+    if svj.core.utils._is_se_path(src):
+        svj.core.seutils.copy_from_se(src, dst)
+    else:
+        shutil.copyfile(src, dst)
+
+
+def _remove(path):
+    if svj.core.utils._is_se_path(path):
+        svj.core.seutils.remove(path)
+    elif osp.isfile(path):
+        os.remove(path)
+
+
+def _remove_directory(directory):
+    """
+    Removes an empty directory, if it exists
+    """
+    if svj.core.utils._is_se_path(directory):
+        if svj.core.seutils.is_directory(directory): svj.core.seutils.remove_directory(directory)
+    elif osp.isdir(directory):
+        os.rmdir(directory)
+
+
+class Checkpoint(object):
+    """
+    Markers and intermediate outputs of the steps of one payload;
+    see the module docstring
+    """
+    def __init__(self, directory=None, key=None):
+        super(Checkpoint, self).__init__()
+        if directory is None: directory = os.environ.get('SVJ_CHECKPOINT_DIR') or None
+        self.directory = directory.rstrip('/') if directory else None
+        self.key = key or default_key()
+        self._done = None
+
+    @property
+    def enabled(self):
+        return not(self.directory is None)
+
+    def step_directory(self, step):
+        return '{0}/{1}/{2}'.format(self.directory, self.key, step)
+
+    def marker(self, step):
+        return '{0}/{1}/{2}{3}'.format(self.directory, self.key, step, MARKER_EXTENSION)
+
+    def done_steps(self, refresh=False):
+        """
+        Returns the set of steps with a marker, from one listing of the key directory
+        """
+        if not self.enabled: return set()
+        if self._done is None or refresh:
+            self._done = set(
+                osp.basename(p)[:-len(MARKER_EXTENSION)]
+                for p in _list_directory('{0}/{1}'.format(self.directory, self.key))
+                if p.endswith(MARKER_EXTENSION)
+                )
+        return self._done
+
+    def is_done(self, step):
+        return step in self.done_steps()
+
+    def mark_done(self, step, outputs=()):
+        """
+        Stages the outputs of step, then writes its marker
+        """
+        if not self.enabled: return
+        with svj.core.profiling.timer('checkpoint.mark_done'):
+            files = []
+            for output in outputs:
+                dst = self.step_directory(step) + '/' + osp.basename(output)
+                _stage_out(output, dst)
+                files.append({ 'name' : osp.basename(output), 'size' : os.stat(output).st_size })
+            fd, marker_file = tempfile.mkstemp(prefix='svjcheckpoint_', suffix=MARKER_EXTENSION)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'step' : step, 'key' : self.key, 'time' : time.time(), 'files' : files,
+                    'host' : os.environ.get('HOSTNAME'),
+                    'cluster' : os.environ.get('CONDOR_CLUSTER_NUMBER'),
+                    }, f)
+            try:
+                _stage_out(marker_file, self.marker(step))
+            finally:
+                os.remove(marker_file)
+        self.done_steps().add(step)
+        logger.info('Checkpointed step %s of %s (%s files)', step, self.key, len(files))
+
+    def restore(self, step, dst_dir='.'):
+        """
+        Copies the outputs of a finished step back into dst_dir, and checks their sizes
+        """
+        with svj.core.profiling.timer('checkpoint.restore'):
+            marker_file = osp.join(dst_dir, '.svjcheckpoint_{0}{1}'.format(step, MARKER_EXTENSION))
+            _stage_in(self.marker(step), marker_file)
+            with open(marker_file, 'r') as f:
+                marker = json.load(f)
+            os.remove(marker_file)
+            for entry in marker['files']:
+                dst = osp.join(dst_dir, entry['name'])
+                _stage_in(self.step_directory(step) + '/' + entry['name'], dst)
+                if os.stat(dst).st_size != entry['size']:
+                    raise IOError(
+                        'Restored {0} of step {1} has size {2}, expected {3}'
+                        .format(dst, step, os.stat(dst).st_size, entry['size'])
+                        )
+        logger.info('Restored the outputs of step %s of %s', step, self.key)
+
+    def first_unfinished(self, steps):
+        """
+        Returns the index of the first step name in steps without a marker
+        (len(steps) if all are done)
+        """
+        done = self.done_steps()
+        for i, step in enumerate(steps):
+            if not step in done: return i
+        return len(steps)
+
+    def run(self, steps, dst_dir='.'):
+        """
+        Runs a list of (name, func, outputs) from the first unfinished step,
+        checkpointing every step after it succeeds. The outputs of the last
+        finished step are restored first, since the next step (or the final
+        stageout) needs them.
+        """
+        names = [ s[0] for s in steps ]
+        i_start = self.first_unfinished(names)
+        if i_start > 0:
+            logger.info('Steps %s of %s are done; resuming at %s', names[:i_start], self.key,
+                names[i_start] if i_start < len(names) else '<end>')
+            self.restore(names[i_start-1], dst_dir)
+        for name, func, outputs in steps[i_start:]:
+            logger.info('Running step %s of %s', name, self.key)
+            with svj.core.profiling.timer('checkpoint.step.' + name):
+                func()
+            self.mark_done(name, outputs)
+
+    def clear(self):
+        """
+        Removes all markers and intermediate outputs, and their directories,
+        e.g. after the final stageout
+        """
+        if not self.enabled: return
+        key_directory = '{0}/{1}'.format(self.directory, self.key)
+        for path in _list_directory(key_directory):
+            if path.endswith(MARKER_EXTENSION):
+                _remove(path)
+            else:
+                for output in _list_directory(path): _remove(output)
+                _remove_directory(path)
+        _remove_directory(key_directory)
+        self._done = set()
+        logger.info('Cleared the checkpoints of %s', self.key)
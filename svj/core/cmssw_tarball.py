@@ -1,6 +1,10 @@
 import os.path as osp
+import os, hashlib, shutil, tempfile
 import svj.core
 
+# Node-wide; not under the rundir, which is per-job scratch in batch mode ($TMPDIR too)
+CMSDRIVER_CACHE_DIR = '/tmp/svj_cmsdriver_cache_{0}'.format(os.getuid())
+
 class CMSSWTarball(object):
     """docstring for CMSSWTarball"""
     def __init__(self, tarball, scram_arch, rundir=None):
@@ -9,6 +13,7 @@ class CMSSWTarball(object):
         self.scram_arch = scram_arch
         self.rundir = svj.core.RUNDIR if rundir is None else rundir
         self._is_renamed = False
+        self._checksum = None
 
     def extract(self):
         svj.core.utils.create_directory(self.rundir, force=True)
@@ -39,3 +44,106 @@ class CMSSWTarball(object):
                 cmd
                 ]
             svj.core.utils.run_multiple_commands(cmds, env=svj.core.utils.get_clean_env())
+
+    @property
+    def release(self):
+        return osp.basename(osp.dirname(self.cmssw_src))
+
+    @property
+    def checksum(self):
+        """
+        sha1 of the tarball, computed once
+        """
+        if self._checksum is None:
+            self._checksum = svj.core.utils.sha1sum(self.tarball)
+        return self._checksum
+
+    def cmsdriver_cache_key(self, args):
+        """
+        Key of the config generated by cmsDriver.py with args in this release;
+        includes the checksum of the tarball, since its python configs may change
+        """
+        key = ' '.join([ self.release, self.scram_arch, self.checksum ] + args.split())
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def cmsdriver_config(self, args, cache_dir=None):
+        """
+        Returns the path to the config generated by `cmsDriver.py <args> --no_exec`.
+        cmsDriver.py only runs if the config is not in the cache yet: either in
+        ./cmsdriver_cache (filled at submit time by the '#$ cmsdriver' directive,
+        see PyCMSSWSubmitter, and transferred with the job), or in cache_dir,
+        default $SVJ_CMSDRIVER_CACHE or else CMSDRIVER_CACHE_DIR, which is shared
+        by the jobs on a node. Args should not contain per-job values like the
+        seed or file names; those are set with cmsdriver_patch.
+        """
+        key = self.cmsdriver_cache_key(args)
+        shipped = osp.abspath(osp.join('cmsdriver_cache', key + '_cfg.py'))
+        if osp.isfile(shipped): return shipped
+        if cache_dir is None:
+            cache_dir = os.environ.get('SVJ_CMSDRIVER_CACHE', CMSDRIVER_CACHE_DIR)
+        # Absolute, since cmsDriver.py runs in cmssw_src
+        cache_dir = osp.abspath(cache_dir)
+        cached = osp.join(cache_dir, key + '_cfg.py')
+        if osp.isfile(cached):
+            svj.core.logger.info('Using cached cmsDriver config %s', cached)
+            return cached
+        if not osp.isdir(cache_dir): svj.core.utils.create_directory(cache_dir, force=True)
+        # Jobs on the same node may fill the cache at the same time; one generates
+        with svj.core.utils.flock(cached + '.lock'):
+            if not osp.isfile(cached):
+                with svj.core.profiling.timer('cmssw_tarball.cmsdriver'):
+                    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.cmsdriver_')
+                    try:
+                        tmp_cfg = osp.join(tmp_dir, 'cfg.py')
+                        self.run_command_cmssw_env(
+                            'cmsDriver.py {0} --no_exec --python_filename {1}'.format(args, tmp_cfg)
+                            )
+                        os.rename(tmp_cfg, cached)
+                    finally:
+                        shutil.rmtree(tmp_dir, ignore_errors=True)
+                svj.core.logger.info('Cached cmsDriver config %s', cached)
+        return cached
+
+    def cmsdriver(self, args, cfg_file, cache_dir=None, **patch):
+        """
+        Writes the config of `cmsDriver.py <args>` to cfg_file, customized for
+        this job with cmsdriver_patch(**patch), without running cmsDriver.py if
+        the config is cached
+        """
+        with open(self.cmsdriver_config(args, cache_dir), 'r') as f:
+            cfg = f.read()
+        with open(cfg_file, 'w') as f:
+            f.write(cfg)
+            f.write('\n'.join([''] + cmsdriver_patch(**patch)) + '\n')
+        return cfg_file
+
+
+def cmsdriver_patch(seed=None, n_events=None, input_files=None, output_files=None, extra_lines=None):
+    """
+    Returns the python lines to append to a cmsDriver config to set the per-job
+    values: the seed (of the generator; every other random engine gets a
+    distinct seed derived from it), the number of events, the input files,
+    and the file names of output modules (dict module name -> file name)
+    """
+    lines = [ '', '# Per-job customization by svj.core.cmssw_tarball' ]
+    if not(seed is None):
+        # Like RandomNumberServiceHelper.populate(), but reproducible, so that a
+        # resubmitted or resumed job (see svj.core.checkpoint) gets the same events
+        lines.extend([
+            'import hashlib as _svj_hashlib',
+            'for _svj_engine in process.RandomNumberGeneratorService.parameterNames_():',
+            '    _svj_pset = getattr(process.RandomNumberGeneratorService, _svj_engine)',
+            '    if not hasattr(_svj_pset, \'initialSeed\'): continue',
+            '    _svj_digest = _svj_hashlib.sha1(\'{0} {{0}}\'.format(_svj_engine).encode()).hexdigest()'.format(int(seed)),
+            '    _svj_pset.initialSeed = {0} if _svj_engine == \'generator\' else int(1 + int(_svj_digest, 16) % 900000000)'.format(int(seed)),
+            ])
+    if not(n_events is None):
+        lines.append('process.maxEvents.input = {0}'.format(int(n_events)))
+    if not(input_files is None):
+        lines.append('process.source.fileNames = cms.untracked.vstring({0})'.format(
+            ', '.join(repr(str(f)) for f in input_files)
+            ))
+    for module, file_name in sorted((output_files or {}).items()):
+        lines.append('process.{0}.fileName = {1}'.format(module, repr(str(file_name))))
+    lines.extend(extra_lines or [])
+    return lines
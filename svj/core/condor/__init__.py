@@ -0,0 +1,27 @@
+import os, sys, importlib, types
+
+# Imported on first access; see svj/core/__init__.py
+_SUBMODULES = [ 'jobfiles', 'backends', 'submitters' ]
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
+
+if sys.version_info < (3, 7):
+    class _LazyModule(types.ModuleType):
+        def __getattr__(self, name):
+            return __getattr__(name)
+        def __dir__(self):
+            return __dir__()
+    _module = _LazyModule(__name__)
+    _module.__dict__.update(globals())
+    _module._original_module = sys.modules[__name__]
+    sys.modules[__name__] = _module
+
+if os.environ.get('SVJ_EAGER_IMPORTS', '0') != '0':
+    for _name in _SUBMODULES: __getattr__(_name)
+    del _name
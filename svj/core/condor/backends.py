@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batch system backends used by svj.core.condor.submitters.submit_jdl.
+
+The backend in use is chosen with set_backend, or with the environment
+variable SVJ_BATCH_BACKEND:
+    SVJ_BATCH_BACKEND=condor       (default) cjm or condor_submit
+    SVJ_BATCH_BACKEND=local        run the jobs as local processes
+    SVJ_BATCH_BACKEND=local:8      idem, with 8 jobs at the same time
+    SVJ_BATCH_BACKEND=local:8:dry  only parse and queue the jobs, do not run them
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, subprocess, os, re, itertools, threading
+from multiprocessing.pool import ThreadPool
+import svj.core
+
+logger = logging.getLogger('root')
+
+
+class BatchBackend(object):
+    """
+    Interface of a batch system backend
+    """
+    name = 'base'
+
+    def submit(self, jdl_file, dry=False):
+        raise NotImplementedError('Should be subclassed')
+
+
+class CondorBackend(BatchBackend):
+    """
+    Submits to HTCondor, through cjm if it is installed
+    """
+    name = 'condor'
+
+    def submit(self, jdl_file, dry=False):
+        try:
+            from cjm import TodoList
+            logger.info('Found installation of cjm')
+            if not dry: TodoList().submit(jdl_file)
+        except ImportError:
+            logger.info('Submitting using plain condor_submit')
+            cmd = ['condor_submit', jdl_file]
+            svj.core.utils.run_command(cmd, dry=dry)
+
+
+def parse_jdl(jdl_file):
+    """
+    Parses the subset of the JDL language that svj.core.condor.jobfiles
+    generates. Returns a dict of options (with 'environment' parsed into
+    a dict) and the queue statement.
+    """
+    options = {}
+    queue = 'queue'
+    with open(jdl_file, 'r') as f:
+        for line in svj.core.utils.decomment(f):
+            if line.lower().startswith('queue'):
+                queue = line
+                continue
+            if not '=' in line: continue
+            key, value = [ c.strip() for c in line.split('=', 1) ]
+            options[key.lower()] = value
+    if 'environment' in options:
+        options['environment'] = dict(re.findall(r'(\w+)=\'([^\']*)\'', options['environment']))
+    return options, queue
+
+
+def expand_queue(queue):
+    """
+    Expands a queue statement into a list of dicts of per-job macros.
+    Supports 'queue', 'queue N', and 'queue [N] <var> in a, b, c'.
+    """
+    match = re.match(r'queue\s*(\d*)\s*(\w+)\s+in\s+\(?(.*?)\)?\s*$', queue, re.IGNORECASE)
+    if match:
+        n_per_item = int(match.group(1)) if match.group(1) else 1
+        var = match.group(2)
+        items = [ item.strip() for item in match.group(3).split(',') if item.strip() ]
+        return [ { var : item } for item in items for i in range(n_per_item) ]
+    match = re.match(r'queue\s*(\d*)\s*$', queue, re.IGNORECASE)
+    if match:
+        return [ {} for i in range(int(match.group(1)) if match.group(1) else 1) ]
+    raise ValueError('Unsupported queue statement: {0}'.format(queue))
+
+
+def substitute_macros(value, macros):
+    """
+    Replaces $(Macro) occurrences in value
+    """
+    for key, macro_value in macros.items():
+        value = value.replace('$({0})'.format(key), str(macro_value))
+    return value
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Fake scheduler that runs the jobs of a JDL as local processes, at most
+    n_workers at the same time. Every job runs in its own directory
+    <jdl dir>/local_<cluster>/<process>, with the input files symlinked in.
+    With run=False jobs are only parsed and queued, which is useful to
+    measure the submission side without running anything.
+    """
+    name = 'local'
+
+    _cluster_counter = itertools.count(1)
+    _lock = threading.Lock()
+
+    def __init__(self, n_workers=4, run=True):
+        super(LocalBatchBackend, self).__init__()
+        self.n_workers = n_workers
+        self.run = run
+        self.jobs = []
+
+    def submit(self, jdl_file, dry=False):
+        jdl_file = osp.abspath(jdl_file)
+        options, queue = parse_jdl(jdl_file)
+        with self._lock:
+            cluster = next(self._cluster_counter)
+        jobs = []
+        for process, macros in enumerate(expand_queue(queue)):
+            macros.update({ 'Cluster' : cluster, 'Process' : process })
+            jobs.append(self.make_job(jdl_file, options, macros))
+        logger.info('Queued %s jobs in local cluster %s', len(jobs), cluster)
+        self.jobs.extend(jobs)
+        if dry or not self.run: return jobs
+        pool = ThreadPool(self.n_workers)
+        try:
+            returncodes = pool.map(self.run_job, jobs)
+        finally:
+            pool.close()
+        n_failed = sum(1 for returncode in returncodes if returncode != 0)
+        logger.info(
+            'Local cluster %s finished: %s jobs, %s failed',
+            cluster, len(jobs), n_failed
+            )
+        return jobs
+
+    def make_job(self, jdl_file, options, macros):
+        jdl_dir = osp.dirname(jdl_file)
+        # 'queue arguments in ...' sets the arguments submit variable directly
+        arguments = macros.pop('arguments', options.get('arguments', ''))
+        job = {
+            'cluster' : macros['Cluster'],
+            'process' : macros['Process'],
+            'executable' : osp.join(jdl_dir, options['executable']),
+            'arguments' : substitute_macros(arguments, macros).split(),
+            'jobdir' : osp.join(jdl_dir, 'local_{0}'.format(macros['Cluster']), str(macros['Process'])),
+            'input_files' : [
+                osp.join(jdl_dir, f.strip()) for f in options.get('transfer_input_files', '').split(',')
+                if f.strip()
+                ],
+            'environment' : dict(
+                (key, substitute_macros(value, macros))
+                for key, value in options.get('environment', {}).items()
+                ),
+            }
+        for key in [ 'output', 'error', 'log' ]:
+            if key in options:
+                job[key] = osp.join(jdl_dir, substitute_macros(options[key], macros))
+        return job
+
+    def run_job(self, job):
+        os.makedirs(job['jobdir'])
+        for input_file in job['input_files'] + [ job['executable'] ]:
+            os.symlink(input_file, osp.join(job['jobdir'], osp.basename(input_file)))
+        env = os.environ.copy()
+        env.update(job['environment'])
+        env['_CONDOR_SCRATCH_DIR'] = job['jobdir']
+        stdout = open(job.get('output', os.devnull), 'w')
+        stderr = open(job.get('error', os.devnull), 'w')
+        try:
+            returncode = subprocess.call(
+                [ 'bash', osp.basename(job['executable']) ] + job['arguments'],
+                cwd=job['jobdir'], env=env, stdout=stdout, stderr=stderr
+                )
+        finally:
+            stdout.close()
+            stderr.close()
+        job['returncode'] = returncode
+        if returncode != 0:
+            logger.error(
+                'Local job %s.%s failed with exit code %s',
+                job['cluster'], job['process'], returncode
+                )
+        return returncode
+
+
+def backend_from_string(spec):
+    """
+    Creates a backend from a string like 'condor' or 'local[:n_workers[:dry]]'
+    """
+    parts = spec.split(':')
+    if parts[0] == 'condor':
+        return CondorBackend()
+    elif parts[0] == 'local':
+        n_workers = int(parts[1]) if len(parts) > 1 and parts[1] else 4
+        run = not(len(parts) > 2 and parts[2] == 'dry')
+        return LocalBatchBackend(n_workers=n_workers, run=run)
+    raise ValueError('Unknown batch backend {0}'.format(spec))
+
+
+_backend = None
+
+def set_backend(backend):
+    """
+    Sets the batch backend used by submit_jdl. Accepts a backend instance or
+    a string like 'local:8'.
+    """
+    global _backend
+    if svj.core.utils.is_string(backend):
+        backend = backend_from_string(backend)
+    logger.info('Using batch backend %s', backend.name)
+    _backend = backend
+
+def get_backend():
+    """
+    Returns the batch backend; defaults to $SVJ_BATCH_BACKEND or condor
+    """
+    if _backend is None:
+        set_backend(os.environ.get('SVJ_BATCH_BACKEND', 'condor'))
+    return _backend
@@ -2,11 +2,27 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 import os.path as osp
-import logging, os, collections
+import logging, os, collections, string
 from time import strftime
 import svj.core
 logger = logging.getLogger('root')
 
+# Per-job file with the timing records, as seen from the .jdl and from the .sh
+SVJ_TIMING_FILE_JDL = 'svj_timing_$(Cluster)_$(Process).jsonl'
+SVJ_TIMING_FILE_SH = 'svj_timing_${CONDOR_CLUSTER_NUMBER}_${CONDOR_PROCESS_ID}.jsonl'
+# Per-job file with the output records (see svj.core.catalog.record_output), as seen from the .jdl
+SVJ_OUTPUT_RECORDS_JDL = 'svj_outputs_$(Cluster)_$(Process).jsonl'
+# Per-group hadd calls of merge jobs, from svj.core.merge.plan_tree_hadd
+MERGE_PLAN_FILE = 'merge_plan.json'
+
+
+class JobTemplate(string.Template):
+    """
+    Template for job files; placeholders look like @{name} or @name,
+    since $ is already taken by both bash and condor
+    """
+    delimiter = '@'
+
 
 class JobFileBase(object):
     """Base class for files related to condor jobs"""
@@ -16,23 +32,57 @@ class JobFileBase(object):
 
     def configure(self):
         """
-        Optionally set class variables herex
+        Optionally set class variables here; may be called more than once
         """
         pass
 
-    def parse(self):
+    def iter_lines(self):
         """
-        Should return a str with the contents to be placed in a file    
+        Should yield the lines (without newline) to be placed in a file
         """
         raise NotImplementedError('Should be subclassed')
 
+    def parse(self):
+        """
+        Returns a str with the contents to be placed in a file
+        """
+        parsed = '\n'.join(self.iter_lines())
+        logger.debug('Parsed the following %s:\n%s', self.__class__.__name__, parsed)
+        return parsed
+
     def to_file(self, file, dry=False):
         self.configure()
-        parsed = self.parse()
         logger.info('Writing to {0}'.format(file))
         if not dry:
             with open(file, 'w') as f:
-                f.write(parsed)
+                for i, line in enumerate(self.iter_lines()):
+                    if i > 0: f.write('\n')
+                    f.write(line)
+
+    def template(self):
+        """
+        Returns the contents as a JobTemplate; @{key} placeholders put in
+        options, environment variables or lines are substituted per file
+        """
+        self.configure()
+        return JobTemplate(self.parse())
+
+    def to_files(self, files_and_substitutions, dry=False):
+        """
+        Writes many variations of this file from a single rendering, e.g. one
+        .sh and .jdl per point of a parameter scan. Takes an iterable of
+        (file, dict of placeholder substitutions). Placeholders without a
+        substitution are left as they are.
+        """
+        template = self.template()
+        n_files = 0
+        for file, substitutions in files_and_substitutions:
+            if not dry:
+                with open(file, 'w') as f:
+                    f.write(template.safe_substitute(substitutions))
+            n_files += 1
+        logger.info('Wrote %s files from one %s template', n_files, self.__class__.__name__)
+        return n_files
 
 
 class JDLBase(JobFileBase):
@@ -55,26 +105,24 @@ class JDLBase(JobFileBase):
         self.queue = 'queue'
         self.environment['SVJ_BATCH_MODE'] = 'lpc'
         self.transfer_input_files = []
+        self.request_cpus = 1
 
     def configure(self):
         self.options['executable'] = osp.basename(self.sh_file)
+        if self.request_cpus > 1:
+            self.options['request_cpus'] = self.request_cpus
+        else:
+            self.options.pop('request_cpus', None)
 
-    def parse(self):
-        jdl = []
-        for key, value in self.options.iteritems():
+    def iter_lines(self):
+        for key, value in self.options.items():
             if key == 'environment':
-                jdl.append(
-                    'environment = "{0}"'.format(
-                        ' '.join(
-                            [ '{0}=\'{1}\''.format(key, value) for key, value in self.environment.iteritems() ]
-                            )
-                        ))
+                yield 'environment = "{0}"'.format(' '.join(
+                    '{0}=\'{1}\''.format(var, var_value) for var, var_value in self.environment.items()
+                    ))
             else:
-                jdl.append('{0} = {1}'.format(key, value))
-        jdl.append(self.queue)
-        jdl = '\n'.join(jdl)
-        logger.info('Parsed the following jdl file:\n{0}'.format(jdl))
-        return jdl
+                yield '{0} = {1}'.format(key, value)
+        yield self.queue
 
 
 class JDLPythonFile(JDLBase):
@@ -111,6 +159,8 @@ class JDLProduction(JDLPythonFile):
     def __init__(self, sh_file, python_file, n_jobs):
         super(JDLProduction, self).__init__(sh_file, python_file)
         self.n_jobs = n_jobs
+        self.n_payloads = 1
+        self.timing = True
 
     def configure(self):
         super(JDLProduction, self).configure()
@@ -118,11 +168,47 @@ class JDLProduction(JDLPythonFile):
         self.options['should_transfer_files'] = 'YES'  # May not be needed if staging out to SE!
         self.options['when_to_transfer_output'] = 'ON_EXIT'
         self.options['transfer_output_files'] = 'output'  # Should match with what is defined in svj.genprod.SVJ_OUTPUT_DIR
-        # Queue one job per seed
-        seeds = [ str(self.starting_seed + i) for i in range(self.n_jobs) ]
+        if self.timing:
+            self.options['transfer_output_files'] += ',' + SVJ_TIMING_FILE_JDL
+        # Only the transferred files reach the submit node, so write the output records in output
+        self.environment.setdefault('SVJ_OUTPUT_RECORDS', 'output/' + SVJ_OUTPUT_RECORDS_JDL)
+        self.check_transferred(self.environment['SVJ_OUTPUT_RECORDS'])
+        # Queue one job per seed; packed jobs use seeds seed, seed+1, ..., seed+n_payloads-1
+        seeds = [ str(self.starting_seed + i*self.n_payloads) for i in range(self.n_jobs) ]
         self.queue = 'queue 1 arguments in {0}'.format(', '.join(seeds))
 
 
+    def check_transferred(self, path):
+        """
+        Raises a ValueError if the file path, relative to the job's cwd, is not
+        in (a directory in) transfer_output_files
+        """
+        transferred = [ f.strip().rstrip('/') for f in self.options['transfer_output_files'].split(',') ]
+        if not any(path == f or path.startswith(f + '/') for f in transferred):
+            raise ValueError(
+                '{0} is not transferred back; transfer_output_files = {1}'
+                .format(path, self.options['transfer_output_files'])
+                )
+
+
+class JDLMerge(JDLBase):
+    """
+    JDL file for merge jobs; job i merges group i of MERGE_PLAN_FILE
+    """
+    def __init__(self, sh_file, n_groups):
+        super(JDLMerge, self).__init__(sh_file)
+        self.n_groups = n_groups
+        self.transfer_input_files.append(MERGE_PLAN_FILE)
+
+    def configure(self):
+        super(JDLMerge, self).configure()
+        self.options['transfer_input_files'] = ','.join(self.transfer_input_files)
+        self.options['on_exit_hold'] = '(ExitBySignal == True) || (ExitCode != 0)'
+        self.options['output'] = 'merge_$(Cluster)_$(Process).stdout'
+        self.options['error']  = 'merge_$(Cluster)_$(Process).stderr'
+        self.options['log']    = 'merge_$(Cluster)_$(Process).log'
+        self.queue = 'queue {0}'.format(self.n_groups)
+
 
 class SHBase(JobFileBase):
     """docstring for SHBase"""
@@ -130,15 +216,20 @@ class SHBase(JobFileBase):
         super(SHBase, self).__init__()
         self.lines = []
 
-    def parse(self):
-        parsed = '\n'.join(self.lines)
-        logger.info('Parsed the following sh file:\n{0}'.format(parsed))
-        return parsed
+    def configure(self):
+        # Lines are rebuilt from scratch, so configuring twice does not repeat them
+        self.lines = []
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+    def echo(self, text):
+        self.lines.append('echo "{0}"'.format(text))
 
 class SHClean(SHBase):
     """docstring for SHClean"""
-    def __init__(self):
-        super(SHClean, self).__init__()
+    def configure(self):
+        super(SHClean, self).configure()
         self.lines.extend([
             'rm *.stdout    > /dev/null 2>& 1',
             'rm *.stderr    > /dev/null 2>& 1',
@@ -154,12 +245,157 @@ class SHPython(SHBase):
         super(SHPython, self).__init__()
         self.python_file = python_file
         self.code_tarballs = []
+        # Number of payloads (seeds/chunks) to run per job, and how many to run at the same time
+        self.n_payloads = 1
+        self.n_parallel = 1
+        # Optional shell command that is run after each successful payload
+        self.payload_stageout = None
+        # Optional node-local directory to cache extracted code tarballs in
+        self.tarball_cache_dir = None
+        # Whether to write per-phase timing records (see svj.core.timing)
+        self.timing = True
+        # Optional profiler to run the python file in: 'cprofile' or 'pyspy'
+        self.profile = None
+        # Optional archive with all inputs, transferred by condor or fetched from input_bundle_url
+        self.input_bundle = None
+        self.input_bundle_url = None
+        self.input_bundle_checksum = None
+        # Attempts and timeout in seconds per attempt for fetching the input bundle
+        self.fetch_attempts = 5
+        self.fetch_timeout = 1800
 
     def add_code_tarball(self, code_tarball):
         self.code_tarballs.append(code_tarball)
 
-    def echo(self, text):
-        self.lines.append('echo "{0}"'.format(text))
+    def timing_functions(self):
+        """
+        Shell functions to record one JSON line per job phase (wall time, cpu time
+        and peak RSS) into SVJ_TIMING_FILE. A phase runs from svj_phase_begin until
+        the next svj_phase_begin, svj_phase_end or the exit of the script.
+        Peak RSS is only known for commands run through svj_measure, and only if
+        /usr/bin/time is available on the worker.
+        """
+        return [
+            'export SVJ_TIMING_FILE="{0}"'.format(SVJ_TIMING_FILE_SH),
+            'svj_cpu_seconds() {',
+            '    # Sets svj_cpu to the summed user and sys cpu time of this shell and its',
+            '    # children; times must run in the current shell, not in a $(...) subshell',
+            '    local times_file=.svj_times_${BASHPID:-$$}',
+            '    times > ${times_file}',
+            '    svj_cpu=$(awk \'{ for (i=1; i<=NF; i++) { split($i, t, "m"); s += t[1]*60 + t[2] } } END { printf "%.3f", s }\' ${times_file})',
+            '    rm -f ${times_file}',
+            '    }',
+            'svj_measure() {',
+            '    if [ -x /usr/bin/time ]; then',
+            '        /usr/bin/time -f "%M" -o .svj_rss_${svj_phase_name}_${SVJ_PAYLOAD_INDEX} "$@"',
+            '    else',
+            '        "$@"',
+            '    fi',
+            '    }',
+            'svj_phase_end() {',
+            '    local exitcode=${1:-0}',
+            '    if [ -z "${svj_phase_name}" ]; then return 0; fi',
+            '    svj_cpu_seconds',
+            '    local wall=$(awk "BEGIN { printf \\"%.3f\\", $(date +%s.%N) - ${svj_phase_t0} }")',
+            '    local cpu=$(awk "BEGIN { printf \\"%.3f\\", ${svj_cpu} - ${svj_phase_c0} }")',
+            '    local rss_file=.svj_rss_${svj_phase_name}_${SVJ_PAYLOAD_INDEX}',
+            '    local maxrss=$(tail -n 1 ${rss_file} 2> /dev/null | grep -E "^[0-9]+$")',
+            '    rm -f ${rss_file}',
+            '    local format=\'{"phase": "%s", "payload": %s, "host": "%s", "cluster": "%s", "process": "%s", "start": %s, "wall": %s, "cpu": %s, "maxrss_kb": %s, "exitcode": %s}\\n\'',
+            '    printf "${format}" "${svj_phase_name}" "${SVJ_PAYLOAD_INDEX:-null}" "$(hostname)" \\',
+            '        "${CONDOR_CLUSTER_NUMBER}" "${CONDOR_PROCESS_ID}" "${svj_phase_t0}" \\',
+            '        "${wall}" "${cpu}" "${maxrss:-null}" "${exitcode}" >> "${SVJ_TIMING_FILE}"',
+            '    svj_phase_name=""',
+            '    }',
+            'svj_phase_begin() {',
+            '    svj_phase_end 0',
+            '    svj_phase_name=$1',
+            '    svj_phase_t0=$(date +%s.%N)',
+            '    svj_cpu_seconds',
+            '    svj_phase_c0=${svj_cpu}',
+            '    }',
+            'export -f svj_cpu_seconds svj_measure svj_phase_end svj_phase_begin',
+            'trap \'svj_phase_end $?\' EXIT',
+            ]
+
+    def phase(self, name):
+        """
+        Returns the lines to start a new timed phase, if timing is enabled
+        """
+        return [ 'svj_phase_begin {0}'.format(name) ] if self.timing else []
+
+    def measure(self, cmd):
+        """
+        Prefixes a command so that its peak RSS is recorded, if timing is enabled
+        """
+        return 'svj_measure ' + cmd if self.timing else cmd
+
+    def python_command(self):
+        """
+        Returns the command to run the python file, optionally in a profiler.
+        Profiler output goes next to the svj.core.profiling report.
+        """
+        python_file = osp.basename(self.python_file)
+        if not self.profile:
+            return 'python {0}'.format(python_file)
+        output = (
+            '${SVJ_PROFILE_DIR:-.}/svj_payload_${CONDOR_CLUSTER_NUMBER}_${CONDOR_PROCESS_ID}'
+            '${SVJ_PAYLOAD_INDEX:+_${SVJ_PAYLOAD_INDEX}}'
+            )
+        if self.profile == 'cprofile':
+            return 'python -m cProfile -o {0}.prof {1}'.format(output, python_file)
+        elif self.profile == 'pyspy':
+            # Falls back to running without profiler if py-spy is not installed
+            return (
+                '$(command -v py-spy > /dev/null && echo "py-spy record -o {0}.svg --") python {1}'
+                .format(output, python_file)
+                )
+        raise ValueError('Unknown profiler {0}'.format(self.profile))
+
+    def fetch_input_bundle(self):
+        """
+        Fetches the input bundle from input_bundle_url with xrdcp (svj.core is in
+        the bundle, so seutils is not available yet), retrying with a growing
+        delay, with a timeout per attempt, and checking the checksum if known
+        """
+        sh = [
+            'svj_fetch_input_bundle() {',
+            '    local attempt',
+            '    for attempt in $(seq 1 {0}); do'.format(self.fetch_attempts),
+            '        echo "Fetching the inputs from {0} (attempt ${{attempt}}/{1})"'
+            .format(self.input_bundle_url, self.fetch_attempts),
+            '        rm -f {0}'.format(self.input_bundle),
+            '        if timeout {0} xrdcp -s {1} {2}; then'
+            .format(self.fetch_timeout, self.input_bundle_url, self.input_bundle),
+            ]
+        if self.input_bundle_checksum:
+            sh.extend([
+                '            local checksum=$(sha1sum {0} | cut -d " " -f 1)'.format(self.input_bundle),
+                '            [ "${{checksum}}" == "{0}" ] && return 0'.format(self.input_bundle_checksum),
+                '            echo "Checksum mismatch: ${{checksum}} != {0}"'.format(self.input_bundle_checksum),
+                ])
+        else:
+            sh.append('            return 0')
+        sh.extend([
+            '        fi',
+            '        [ ${attempt} -lt ' + str(self.fetch_attempts) + ' ] && sleep $(( attempt * 30 ))',
+            '    done',
+            '    echo "Could not fetch the inputs from {0}"'.format(self.input_bundle_url),
+            '    return 1',
+            '    }',
+            'svj_fetch_input_bundle',
+            ])
+        return sh
+
+    def unpack_input_bundle(self):
+        sh = self.phase('bundle')
+        if self.input_bundle_url:
+            sh.extend(self.fetch_input_bundle())
+        sh.extend([
+            'tar xf {0}'.format(self.input_bundle),
+            'rm {0}'.format(self.input_bundle),
+            ])
+        return sh
 
     def install_code_tarballs(self):
         def code_tarball_iterator(code_tarballs):
@@ -169,13 +405,49 @@ class SHPython(SHBase):
                 yield tarball, name
 
         sh = []
-        # First untar all tarballs
+        if self.tarball_cache_dir:
+            sh.append(
+                'export SVJ_TARBALL_CACHE="${{SVJ_TARBALL_CACHE:-{0}}}"'
+                .format(self.tarball_cache_dir)
+                )
+        # Extracts a tarball; if SVJ_TARBALL_CACHE is set, the tarball is extracted
+        # once per node into the cache (keyed by checksum, guarded by flock) and symlinked
+        sh.extend([
+            'svj_install_tarball() {',
+            '    local tarball=$1',
+            '    local name=$2',
+            '    if [ -n "${SVJ_TARBALL_CACHE}" ] && command -v flock > /dev/null \\',
+            '        && mkdir -p "${SVJ_TARBALL_CACHE}" 2> /dev/null; then',
+            '        local checksum=$(sha1sum ${tarball} | cut -d " " -f 1)',
+            '        local cached="${SVJ_TARBALL_CACHE}/${checksum}"',
+            '        (',
+            '            flock -x 9',
+            '            if [ ! -f "${cached}/.svj_complete" ]; then',
+            '                rm -rf "${cached}"',
+            '                mkdir -p "${cached}"',
+            '                tar xf ${tarball} -C "${cached}"',
+            '                touch "${cached}/.svj_complete"',
+            '            fi',
+            '        ) 9> "${cached}.lock"',
+            '        ln -s "${cached}" ${name}',
+            '        echo "Installed ${tarball} from node cache ${cached}"',
+            '    else',
+            '        mkdir ${name}',
+            '        tar xf ${tarball} -C ${name}',
+            '    fi',
+            '    }',
+            'svj_install_pids=""',
+            ])
+        # Untar all tarballs concurrently
         for tarball, name in code_tarball_iterator(self.code_tarballs):
             sh.extend([
-                'mkdir {0}'.format(name),
-                'tar xf {0} -C {1}'.format(tarball, name),
+                'svj_install_tarball {0} {1} &'.format(tarball, name),
+                'svj_install_pids="${svj_install_pids} $!"',
                 ])
+        # wait returns the exit status of each extraction, so set -e catches failures
+        sh.append('for svj_pid in ${svj_install_pids}; do wait ${svj_pid}; done')
         # Source the env script
+        sh.extend(self.phase('env'))
         sh.append('source svj-core/env.sh')
         # Add the package paths
         for tarball, name in code_tarball_iterator(self.code_tarballs):
@@ -185,7 +457,58 @@ class SHPython(SHBase):
                 ])
         return sh
 
+    def run_packed_payloads(self):
+        """
+        Runs self.n_payloads instances of the python file, at most self.n_parallel
+        at the same time. Every payload gets its own log and exit code file, and
+        the environment variables SVJ_PAYLOAD_INDEX, SVJ_JOB_INDEX and SVJ_SEED.
+        """
+        python_file = osp.basename(self.python_file)
+        payload_name = 'payload_${CONDOR_CLUSTER_NUMBER}_${CONDOR_PROCESS_ID}_${SVJ_PAYLOAD_INDEX}'
+        sh = [
+            'svj_run_payload() {',
+            '    export SVJ_PAYLOAD_INDEX=$1',
+            '    export SVJ_JOB_INDEX=$(( ${CONDOR_PROCESS_ID:-0} * SVJ_N_PAYLOADS + SVJ_PAYLOAD_INDEX ))',
+            '    export SVJ_SEED=$(( ${SVJ_SEED_BASE:-0} + SVJ_PAYLOAD_INDEX ))',
+            ] + [ '    ' + l for l in self.phase('payload') ] + [
+            '    {0} > {1}.log 2>&1'.format(self.measure(self.python_command()), payload_name),
+            '    local exitcode=$?',
+            '    echo ${{exitcode}} > {0}.exitcode'.format(payload_name),
+            ]
+        if self.payload_stageout:
+            sh.append('    if [ ${exitcode} -eq 0 ]; then')
+            sh.extend([ '        ' + l for l in self.phase('stageout') ])
+            sh.extend([
+                '        {0} >> {1}.log 2>&1 || exitcode=$?'
+                .format(self.measure(self.payload_stageout), payload_name),
+                '    fi',
+                ])
+        if self.timing: sh.append('    svj_phase_end ${exitcode}')
+        sh.extend([
+            '    echo "Payload ${SVJ_PAYLOAD_INDEX} finished with exit code ${exitcode}"',
+            '    return ${exitcode}',
+            '    }',
+            'export -f svj_run_payload',
+            'export SVJ_SEED_BASE=${SVJ_SEED}',
+            'export SVJ_N_PAYLOADS={0}'.format(self.n_payloads),
+            'echo "Starting {0} payloads of python {1}, {2} in parallel"'
+            .format(self.n_payloads, python_file, self.n_parallel),
+            ] + self.phase('payloads') + [
+            'set +e',
+            'seq 0 {0} | xargs -P {1} -I{{}} bash -c \'svj_run_payload {{}}\''
+            .format(self.n_payloads-1, self.n_parallel),
+            'svj_packed_exitcode=$?',
+            'set -e',
+            'for svj_payload_log in payload_*.log; do',
+            '    echo "##### ${svj_payload_log} #####"',
+            '    cat ${svj_payload_log}',
+            'done',
+            'if [ ${svj_packed_exitcode} -ne 0 ]; then exit ${svj_packed_exitcode}; fi',
+            ])
+        return sh
+
     def configure(self):
+        super(SHPython, self).configure()
         self.lines.append('#!/bin/bash')
         self.lines.append('set -e')
         self.echo('##### HOST DETAILS #####')
@@ -194,12 +517,57 @@ class SHPython(SHBase):
         self.echo('pwd:      $(pwd)')
         self.lines.append('export SVJ_SEED=$1')
         self.echo('seed:     ${SVJ_SEED}')
+        if self.timing:
+            self.lines.extend(self.timing_functions())
+        if self.profile:
+            self.lines.append('mkdir -p ${SVJ_PROFILE_DIR:-.}')
+        if self.input_bundle:
+            self.lines.extend(self.unpack_input_bundle())
         if len(self.code_tarballs) > 0:
             self.echo('Installing code tarballs')
+            self.lines.extend(self.phase('install'))
             self.lines.extend(self.install_code_tarballs())
         self.lines.append('mkdir output')
         self.echo('ls -al:')
         self.lines.append('ls -al')
-        self.echo('Starting python {0}'.format(osp.basename(self.python_file)))
-        self.lines.append('python {0}'.format(osp.basename(self.python_file)))
+        if self.n_payloads > 1:
+            self.lines.extend(self.run_packed_payloads())
+        else:
+            self.echo('Starting python {0}'.format(osp.basename(self.python_file)))
+            self.lines.extend(self.phase('payload'))
+            self.lines.append(self.measure(self.python_command()))
+        if self.timing:
+            self.lines.append('svj_phase_end 0')
+
+
+class SHMerge(SHBase):
+    """
+    Runs the hadd calls of group $CONDOR_PROCESS_ID in MERGE_PLAN_FILE (see
+    svj.core.merge.plan_tree_hadd), reading the inputs directly from the SE,
+    and copies the result to outdir
+    """
+    def __init__(self, outdir, hadd_threads=1, root_setup=None):
+        super(SHMerge, self).__init__()
+        self.outdir = outdir
+        self.hadd_threads = hadd_threads
+        self.root_setup = root_setup
 
+    def configure(self):
+        super(SHMerge, self).configure()
+        hadd = 'hadd -f' + (' -j {0}'.format(self.hadd_threads) if self.hadd_threads > 1 else '')
+        self.lines.append('#!/bin/bash')
+        self.lines.append('set -e')
+        self.echo('##### HOST DETAILS #####')
+        self.echo('hostname: $(hostname)')
+        self.echo('date:     $(date)')
+        if self.root_setup:
+            self.lines.append('source {0}'.format(self.root_setup))
+        self.lines.extend([
+            # One line per hadd call: output followed by the inputs
+            'python -c "import json, os; print(\'\\n\'.join(\' \'.join([o] + i) for o, i in json.load(open(\'{0}\'))[int(os.environ[\'CONDOR_PROCESS_ID\'])]))" > merge_steps.txt'.format(MERGE_PLAN_FILE),
+            'while read -u 3 output inputs; do',
+            '    ' + hadd + ' ${output} ${inputs}',
+            'done 3< merge_steps.txt',
+            'xrdcp -f merged.root {0}/merged_$(printf %04d ${{CONDOR_PROCESS_ID}}).root'.format(self.outdir.rstrip('/')),
+            'rm -f merged.root level*_*.root',
+            ])
@@ -3,7 +3,7 @@
 from __future__ import print_function
 
 import os.path as osp
-import logging, os, collections, shutil
+import logging, os, collections, shutil, tarfile, tempfile
 from time import strftime
 import svj.core
 logger = logging.getLogger('root')
@@ -37,6 +37,8 @@ class Submitter(object):
                 self.module_tarballs[module] = 'tarball_{0}.tar'.format(module.__name__)
             else:
                 self.module_tarballs[module] = svj.core.utils.tarball(module)
+                # Identical code gives an identical tarball; store it only once
+                svj.core.blobstore.adopt_file(self.module_tarballs[module])
 
 
 class PySubmitter(Submitter):
@@ -56,11 +58,41 @@ class PySubmitter(Submitter):
         self.seed = 1001
         self.n_jobs = 1
         self.n_events = 20
+        # Job packing: number of payloads per job and number of cpus to claim per job
+        self.n_payloads = 1
+        self.n_cpus = 1
+        self.payload_stageout = None
+        self.tarball_cache_dir = None
+        self.profile = None
+        # Event-range splitting: comma-separated input paths and target events per job
+        self.input_dataset = None
+        self.events_per_job = None
+        self.event_index_file = None
+        # Output file(s) per job for the output catalog (see svj.core.catalog); comma-separated
+        # patterns with {process}, {seed} and {payload}, e.g. root://.../out/seed{seed}.root
+        self.expected_output = None
+        # SE directory for step checkpoints (see svj.core.checkpoint)
+        self.checkpoint_dir = None
+        # Pack all job inputs into a single archive, optionally fetched from an SE directory
+        self.bundle_inputs = False
+        self.input_url = None
 
         self.preprocessing = svj.core.utils.read_preprocessing_directives(self.python_file)
         self.preprocessing_override('n_jobs', int)
         self.preprocessing_override('n_events', int)
         self.preprocessing_override('seed', int)
+        self.preprocessing_override('n_payloads', int)
+        self.preprocessing_override('n_cpus', int)
+        self.preprocessing_override('payload_stageout')
+        self.preprocessing_override('tarball_cache_dir')
+        self.preprocessing_override('profile')
+        self.preprocessing_override('input_dataset')
+        self.preprocessing_override('events_per_job', int)
+        self.preprocessing_override('event_index_file')
+        self.preprocessing_override('expected_output')
+        self.preprocessing_override('checkpoint_dir')
+        self.preprocessing_override('bundle_inputs', lambda v: v.lower() in ['1', 'true', 'yes'])
+        self.preprocessing_override('input_url')
 
         self.sh_file = osp.join(self.rundir, self.python_file_basename.replace('.py', '.sh'))
         self.jdl_file = osp.join(self.rundir, self.python_file_basename.replace('.py', '.jdl'))
@@ -87,19 +119,213 @@ class PySubmitter(Submitter):
         # Setup the rundir
         svj.core.utils.create_directory(self.rundir, must_not_exist=True, dry=dry)
         with svj.core.utils.switchdir(self.rundir, dry=dry):
-            # Copy the python file
-            svj.core.utils.copy_file(self.python_file, self.python_file_basename, dry=dry)
+            # Link the python file in (a copy shared between rundirs, see svj.core.blobstore)
+            svj.core.blobstore.link_file(self.python_file, self.python_file_basename, dry=dry)
             # Create the code tarballs
             self.create_module_tarballs(dry=dry)
             # Create also a small script to delete the output and logs
             svj.core.condor.jobfiles.SHClean().to_file('clean.sh', dry=dry)
-
+            self.check_seeds()
+            if self.input_dataset and self.events_per_job:
+                self.split_by_events(dry=dry)
+            elif self.input_dataset:
+                self.ship_event_index(dry=dry)
+            if self.expected_output:
+                self.register_expected_outputs(dry=dry)
+
+        self.sh.tarball_cache_dir = self.tarball_cache_dir
         for module, code_tarball in self.module_tarballs.items():
             # Make sure the .sh will install the code tarball
             self.sh.add_code_tarball(code_tarball)
             # Make sure the .jdl will transfer the code tarball
             self.jdl.transfer_input_files.append(code_tarball)
 
+        if self.n_payloads > 1:
+            self.pack_payloads()
+        if self.checkpoint_dir:
+            # One subdirectory per submission, shared with its resubmissions
+            self.jdl.environment['SVJ_CHECKPOINT_DIR'] = (
+                self.checkpoint_dir.rstrip('/') + '/' + osp.basename(self.rundir)
+                )
+        if self.profile:
+            self.enable_profiling()
+
+    def index_input_dataset(self):
+        """
+        Counts the events in the files of self.input_dataset (only new or
+        changed files, if self.event_index_file is set), and returns the
+        list of svj.core.eventindex.IndexEntry objects
+        """
+        paths = [ p.strip() for p in self.input_dataset.split(',') if p.strip() ]
+        return svj.core.eventindex.EventIndex(self.event_index_file).update(paths)
+
+    def split_by_events(self, dry=False):
+        """
+        Splits the files in self.input_dataset into payloads of
+        self.events_per_job events, writes the event ranges to a manifest in
+        the rundir, and sets self.n_jobs accordingly (n_payloads payloads per
+        job). Jobs find their ranges with svj.core.eventindex.read_job_manifest().
+        """
+        manifest = 'svj_manifest.json'
+        if dry:
+            logger.info('Dry mode: Would split %s by events into a manifest', self.input_dataset)
+        else:
+            jobs = svj.core.eventindex.split_by_events(
+                self.index_input_dataset(), events_per_job=self.events_per_job
+                )
+            svj.core.eventindex.write_job_manifest(jobs, manifest)
+            self.n_jobs = -(-len(jobs) // self.n_payloads)  # Ceil division
+            # JDLProduction queues its jobs from its own n_jobs
+            if hasattr(self.jdl, 'n_jobs'): self.jdl.n_jobs = self.n_jobs
+        self.jdl.transfer_input_files.append(manifest)
+        self.jdl.environment['SVJ_JOB_MANIFEST'] = manifest
+
+    def ship_event_index(self, dry=False):
+        """
+        Counts the events in self.input_dataset once at submit time, and
+        transfers the index with the jobs, so that
+        svj.core.utils.get_event_ranges_for_job does not count them in every job
+        """
+        index_file = 'svj_event_index.json'
+        if dry:
+            logger.info('Dry mode: Would index the events in %s', self.input_dataset)
+        else:
+            index = svj.core.eventindex.EventIndex(index_file)
+            for entry in self.index_input_dataset():
+                index.entries[entry.path] = entry
+            index.save()
+        self.jdl.transfer_input_files.append(index_file)
+        self.jdl.environment['SVJ_EVENT_INDEX'] = index_file
+
+    def first_seed(self):
+        return self.seed
+
+    def job_seeds(self, process):
+        """
+        Returns the seeds of the payloads of condor process `process`
+        """
+        first = self.first_seed() + process*self.n_payloads
+        return list(range(first, first + self.n_payloads))
+
+    def job_arguments(self, process):
+        """
+        Returns the queue arguments of condor process `process`: its first seed,
+        which the .sh exports as SVJ_SEED (SVJ_SEED_BASE for packed payloads)
+        """
+        return str(self.job_seeds(process)[0])
+
+    def check_seeds(self):
+        """
+        Makes sure that the seeds the jobs get from their queue arguments are
+        the expected ones, and that no two processes of the cluster share a seed
+        """
+        seen = {}
+        for process in range(self.n_jobs):
+            first = int(self.job_arguments(process))
+            seeds = list(range(first, first + self.n_payloads))
+            if seeds != self.job_seeds(process):
+                raise ValueError(
+                    'Process {0} is queued with seeds {1}, expected {2}'
+                    .format(process, seeds, self.job_seeds(process))
+                    )
+            for seed in seeds:
+                if seed in seen:
+                    raise ValueError(
+                        'Seed {0} is used by both process {1} and process {2}'
+                        .format(seed, seen[seed], process)
+                        )
+                seen[seed] = process
+
+    def register_expected_outputs(self, dry=False):
+        """
+        Fills a new output catalog in the rundir with the outputs every job
+        should produce, so that incomplete jobs can be found and resubmitted
+        """
+        patterns = [ p.strip() for p in self.expected_output.split(',') if p.strip() ]
+        def iter_jobs():
+            for process in range(self.n_jobs):
+                outputs = []
+                for payload, seed in enumerate(self.job_seeds(process)):
+                    outputs.extend(
+                        p.format(process=process, seed=seed, payload=payload) for p in patterns
+                        )
+                yield process, outputs, self.job_arguments(process)
+        if dry:
+            logger.info('Dry mode: Would register %s expected outputs per job', len(patterns))
+            return
+        catalog = svj.core.catalog.OutputCatalog(svj.core.catalog.CATALOG_FILE)
+        try:
+            catalog.register_jobs(iter_jobs())
+        finally:
+            catalog.close()
+
+    def finalize_inputs(self, dry=False):
+        """
+        Packs the local transfer_input_files into a single archive if bundle_inputs
+        or input_url is set, so that condor transfers one file per job instead of
+        one per input. With input_url (an SE directory), the archive is uploaded
+        there and fetched by the job itself, bypassing the schedd entirely.
+        Should be called in the rundir, after all inputs are added.
+        """
+        if not(self.bundle_inputs or self.input_url): return
+        local_inputs = [ f for f in self.jdl.transfer_input_files if not f.startswith('root:') ]
+        bundle = 'svj_bundle.tar'
+        if dry:
+            logger.info('Dry mode: Would bundle %s into %s', local_inputs, bundle)
+        else:
+            # Not compressed: the tarballs in it are compressed already, and extracting is faster
+            with svj.core.profiling.timer('submit.bundle_inputs'):
+                with tarfile.open(bundle, 'w') as tar:
+                    for f in local_inputs:
+                        tar.add(f, arcname=osp.basename(f))
+            logger.info(
+                'Bundled %s inputs into %s (%.1f MB)',
+                len(local_inputs), bundle, os.stat(bundle).st_size / 1024.**2
+                )
+        self.jdl.transfer_input_files = [ f for f in self.jdl.transfer_input_files if not f in local_inputs ]
+        if self.input_url:
+            # Named by checksum, so resubmissions and identical submissions reuse the upload
+            checksum = 'dry' if dry else svj.core.utils.sha1sum(bundle)
+            url = '{0}/svj_bundle_{1}.tar'.format(svj.core.seutils.format(self.input_url).rstrip('/'), checksum)
+            if dry:
+                logger.info('Dry mode: Would upload %s to %s', bundle, url)
+            elif not svj.core.seutils.is_file(url):
+                svj.core.seutils.copy_to_se(bundle, url)
+            self.sh.input_bundle_url = url
+            if not dry: self.sh.input_bundle_checksum = checksum
+        else:
+            self.jdl.transfer_input_files.insert(0, bundle)
+        self.sh.input_bundle = bundle
+
+    def enable_profiling(self):
+        """
+        Turns on svj.core.profiling in the job, and runs the python file in
+        the profiler self.profile ('cprofile', 'pyspy', or 'calls' to only
+        profile the svj.core calls)
+        """
+        logger.info('Enabling profiling (%s)', self.profile)
+        self.jdl.environment['SVJ_PROFILE'] = self.profile
+        if not self.profile in ['1', 'calls']:
+            self.sh.profile = self.profile
+        if isinstance(self.jdl, svj.core.condor.jobfiles.JDLProduction):
+            # Only the output directory is transferred back for production jobs
+            self.jdl.environment['SVJ_PROFILE_DIR'] = 'output'
+
+    def pack_payloads(self):
+        """
+        Configures the .sh and .jdl to run self.n_payloads payloads per job,
+        self.n_cpus at the same time
+        """
+        logger.info(
+            'Packing %s payloads per job, running on %s cpus',
+            self.n_payloads, self.n_cpus
+            )
+        self.sh.n_payloads = self.n_payloads
+        self.sh.n_parallel = self.n_cpus
+        self.sh.payload_stageout = self.payload_stageout
+        self.jdl.request_cpus = self.n_cpus
+        if hasattr(self.jdl, 'n_payloads'): self.jdl.n_payloads = self.n_payloads
+
 
 class PyCMSSWSubmitter(PySubmitter):
     """docstring for PyCMSSWSubmitter"""
@@ -112,6 +338,11 @@ class PyCMSSWSubmitter(PySubmitter):
         if self.cmssw_tarball is None:
             raise ValueError('Specify the CMSSW tarball either in the python file or to the submitter.')
         self.cmssw_tarball = osp.abspath(self.cmssw_tarball)
+        # cmsDriver.py arguments (';'-separated) whose configs are generated at submit time
+        self.cmsdriver = None
+        self.scram_arch = os.environ.get('SCRAM_ARCH')
+        self.preprocessing_override('cmsdriver')
+        self.preprocessing_override('scram_arch')
 
         self.jdl = svj.core.condor.jobfiles.JDLPythonFile(self.sh_file, self.python_file)
         self.sh = svj.core.condor.jobfiles.SHPython(self.python_file)
@@ -119,12 +350,17 @@ class PyCMSSWSubmitter(PySubmitter):
 
     def submit(self, dry=False):
         super(PyCMSSWSubmitter, self).submit(dry=dry)
-        if self.n_jobs > 1:
-            self.jdl.queue = 'queue {0}'.format(self.n_jobs)
+        # Queue one job per seed, like JDLProduction; packed jobs use seeds seed, ..., seed+n_payloads-1
+        self.jdl.queue = 'queue 1 arguments in {0}'.format(
+            ', '.join(self.job_arguments(process) for process in range(self.n_jobs))
+            )
         with svj.core.utils.switchdir(self.rundir, dry=dry):
-            # Copy the CMSSW tarball and make sure it's transferred
-            svj.core.utils.copy_file(self.cmssw_tarball, osp.basename(self.cmssw_tarball), dry=dry)
+            # Link the CMSSW tarball in and make sure it's transferred
+            svj.core.blobstore.link_file(self.cmssw_tarball, osp.basename(self.cmssw_tarball), dry=dry)
             self.jdl.transfer_input_files.append(osp.basename(self.cmssw_tarball))
+            if self.cmsdriver:
+                self.fill_cmsdriver_cache(dry=dry)
+            self.finalize_inputs(dry=dry)
 
             # Generate .sh and .jdl files
             self.sh.to_file(self.sh_file, dry=dry)
@@ -134,6 +370,37 @@ class PyCMSSWSubmitter(PySubmitter):
             submit_jdl(self.jdl_file, dry=dry)
 
 
+    def fill_cmsdriver_cache(self, dry=False):
+        """
+        Generates the configs for the cmsDriver.py arguments in self.cmsdriver
+        into ./cmsdriver_cache, which is transferred with the jobs, so that
+        CMSSWTarball.cmsdriver does not run cmsDriver.py in every job.
+        Should be called in the rundir.
+        """
+        args_list = [ a.strip() for a in self.cmsdriver.split(';') if a.strip() ]
+        cache_dir = 'cmsdriver_cache'
+        if dry:
+            logger.info('Dry mode: Would generate %s cmsDriver configs in %s', len(args_list), cache_dir)
+        else:
+            if self.scram_arch is None:
+                raise ValueError('Specify the scram_arch to generate the cmsDriver configs')
+            extract_dir = tempfile.mkdtemp(prefix='svj_cmsdriver_')
+            try:
+                with svj.core.profiling.timer('submit.cmsdriver_cache'):
+                    tarball = svj.core.cmssw_tarball.CMSSWTarball(
+                        self.cmssw_tarball, self.scram_arch, rundir=extract_dir
+                        )
+                    tarball.extract()
+                    for args in args_list:
+                        tarball.cmsdriver_config(args, cache_dir=cache_dir)
+            finally:
+                shutil.rmtree(extract_dir, ignore_errors=True)
+            for name in os.listdir(cache_dir):
+                if name.endswith('.lock'): os.remove(osp.join(cache_dir, name))
+            logger.info('Generated %s cmsDriver configs in %s', len(args_list), cache_dir)
+        self.jdl.transfer_input_files.append(cache_dir)
+
+
 class ProductionSubmitter(PySubmitter):
     """docstring for ProductionSubmitter"""
     def __init__(self, python_file, tarball=None, n_jobs=None):
@@ -152,14 +419,18 @@ class ProductionSubmitter(PySubmitter):
             svj.genprod.SVJ_TARBALL = self.tarball
 
 
+    def first_seed(self):
+        # The seeds are queued by JDLProduction
+        return self.jdl.starting_seed
+
     def submit(self, dry=False):
         super(ProductionSubmitter, self).submit(dry=dry)
 
         with svj.core.utils.switchdir(self.rundir, dry=dry):
-            # Generate .sh and .jdl files
-            self.sh.to_file(self.sh_file, dry=dry)
             if self.tarball:
                 self.jdl.transfer_input_files.append(self.tarball)
+            self.finalize_inputs(dry=dry)
+            self.sh.to_file(self.sh_file, dry=dry)
             self.jdl.to_file(self.jdl_file, dry=dry)
 
             # Submit the job
@@ -167,11 +438,7 @@ class ProductionSubmitter(PySubmitter):
 
 
 def submit_jdl(jdl_file, dry=False):
-    try:
-        from cjm import TodoList
-        logger.info('Found installation of cjm')
-        if not dry: TodoList().submit(jdl_file)
-    except ImportError:
-        logger.info('Submitting using plain condor_submit')
-        cmd = ['condor_submit', jdl_file]
-        svj.core.utils.run_command(jdl_file, dry=dry, shell=True)
+    """
+    Submits a .jdl file with the configured batch backend (see svj.core.condor.backends)
+    """
+    return svj.core.condor.backends.get_backend().submit(jdl_file, dry=dry)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Selection of the fastest healthy xrootd endpoint (mgm, redirector or XCache)
+for reading input files.
+
+The candidate endpoints are configured with set_endpoints, or with the
+environment variable SVJ_SE_ENDPOINTS as a comma-separated list, e.g.
+    SVJ_SE_ENDPOINTS=root://xcache.mysite.edu,root://cmsxrootd.fnal.gov,root://cmseos.fnal.gov
+All endpoints are assumed to serve the same /store namespace. Endpoints are
+probed by timing a stat of an input file (and, if probe_bytes > 0, a copy of
+it to measure throughput); the results are cached in a json file for
+SVJ_ENDPOINT_CACHE_TTL seconds (default 1 hour) in $SVJ_ENDPOINT_CACHE, by
+default /tmp/svj_endpoints_<uid>.json, so jobs on the same node do not all
+probe again. Without configured endpoints nothing is rewritten.
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, json, time, tempfile, threading
+import svj.core
+
+logger = logging.getLogger('root')
+
+DEFAULT_TTL = 3600.
+DEFAULT_PROBE_TIMEOUT = 10.
+# Node-wide, so that all jobs on a node share it; the rundir and $TMPDIR are per-job scratch in batch mode
+DEFAULT_CACHE_FILE = '/tmp/svj_endpoints_{0}.json'.format(os.getuid())
+# Typical input file size used to weigh latency against throughput
+REFERENCE_SIZE = 100 * 1024**2
+
+
+def _failed_measurement():
+    return { 'time' : time.time(), 'healthy' : False, 'latency' : None, 'throughput' : None }
+
+
+class EndpointSelector(object):
+    """
+    Keeps the measured latency and throughput of a list of endpoints, and
+    ranks the healthy ones by the expected time to read a typical file
+    """
+    def __init__(self, endpoints, cache_file=None, ttl=DEFAULT_TTL, probe_timeout=DEFAULT_PROBE_TIMEOUT):
+        super(EndpointSelector, self).__init__()
+        self.endpoints = [ e.rstrip('/') for e in endpoints ]
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.probe_timeout = probe_timeout
+        self.measurements = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if self.cache_file is None or not osp.isfile(self.cache_file): return
+        try:
+            with open(self.cache_file, 'r') as f:
+                self.measurements.update(json.load(f))
+        except ValueError:
+            logger.warning('Could not read endpoint cache %s', self.cache_file)
+
+    def save(self):
+        if self.cache_file is None: return
+        if not osp.isdir(osp.dirname(self.cache_file)): os.makedirs(osp.dirname(self.cache_file))
+        fd, tmp_file = tempfile.mkstemp(dir=osp.dirname(self.cache_file), prefix='.endpoints_')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.measurements, f)
+        os.rename(tmp_file, self.cache_file)
+
+    def is_stale(self, endpoint):
+        measurement = self.measurements.get(endpoint)
+        return measurement is None or time.time() - measurement['time'] > self.ttl
+
+    def probe(self, endpoint, lfn, probe_bytes=0):
+        """
+        Measures the latency of a stat of lfn at endpoint, and if probe_bytes > 0
+        the throughput of copying lfn (only if it is at most probe_bytes large)
+        """
+        backend = svj.core.seutils.get_backend()
+        measurement = _failed_measurement()
+        try:
+            t0 = time.time()
+            if backend.stat_type(endpoint, lfn) is None:
+                raise IOError('{0} not found'.format(lfn))
+            measurement['latency'] = time.time() - t0
+            if probe_bytes > 0:
+                fd, tmp_file = tempfile.mkstemp(prefix='svjprobe_')
+                os.close(fd)
+                try:
+                    t0 = time.time()
+                    backend.copy_from_se(endpoint, lfn, tmp_file)
+                    size = os.stat(tmp_file).st_size
+                    measurement['throughput'] = size / max(time.time() - t0, 1e-6)
+                finally:
+                    os.remove(tmp_file)
+            measurement['healthy'] = True
+        except Exception as e:
+            logger.warning('Endpoint %s failed probe with %s: %s', endpoint, lfn, e)
+        return measurement
+
+    def measure(self, lfn, probe_bytes=0, force=False):
+        """
+        Probes all endpoints without a fresh measurement concurrently.
+        Endpoints that do not answer within probe_timeout are unhealthy.
+        """
+        todo = [ e for e in self.endpoints if force or self.is_stale(e) ]
+        if not todo: return
+        logger.info('Probing %s endpoints with %s', len(todo), lfn)
+        results = {}
+        def run_probe(endpoint):
+            results[endpoint] = self.probe(endpoint, lfn, probe_bytes)
+        # Daemon threads, so that a hanging probe does not block the job
+        threads = [ threading.Thread(target=run_probe, args=(e,)) for e in todo ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        deadline = time.time() + self.probe_timeout
+        for thread in threads:
+            thread.join(max(0., deadline - time.time()))
+        with self._lock:
+            for endpoint in todo:
+                if not endpoint in results:
+                    logger.warning('Endpoint %s did not respond within %ss', endpoint, self.probe_timeout)
+                self.measurements[endpoint] = results.get(endpoint, _failed_measurement())
+        self.save()
+
+    def cost(self, endpoint):
+        """
+        Expected time in seconds to read a REFERENCE_SIZE file from endpoint
+        """
+        measurement = self.measurements[endpoint]
+        cost = measurement['latency']
+        if measurement.get('throughput'):
+            cost += REFERENCE_SIZE / measurement['throughput']
+        return cost
+
+    def ranked(self, lfn=None, probe_bytes=0):
+        """
+        Returns the healthy endpoints, fastest first, followed by the unhealthy
+        ones as a last resort. If lfn is given, stale endpoints are probed first.
+        """
+        if not(lfn is None): self.measure(lfn, probe_bytes)
+        healthy = [
+            e for e in self.endpoints
+            if self.measurements.get(e, {}).get('healthy')
+            ]
+        healthy.sort(key=self.cost)
+        return healthy + [ e for e in self.endpoints if not e in healthy ]
+
+    def mark_failed(self, endpoint):
+        with self._lock:
+            self.measurements[endpoint] = _failed_measurement()
+        self.save()
+
+    def rewrite(self, paths):
+        """
+        Points SE paths at the fastest healthy endpoint. Only paths whose mgm
+        is one of the endpoints are rewritten (no mgm means seutils.DEFAULT_MGM).
+        """
+        se_paths = [ p for p in paths if svj.core.utils._is_se_path(p) ]
+        if not se_paths: return list(paths)
+        best = self.ranked(svj.core.seutils.split_mgm(svj.core.seutils.format(se_paths[0]))[1])[0]
+        if not self.measurements[best]['healthy']:
+            logger.warning('No healthy endpoint out of %s; not rewriting paths', self.endpoints)
+            return list(paths)
+        rewritten = []
+        for path in paths:
+            if svj.core.utils._is_se_path(path):
+                mgm, lfn = svj.core.seutils.split_mgm(svj.core.seutils.format(path))
+                if mgm.rstrip('/') in self.endpoints:
+                    path = svj.core.seutils._join_mgm_lfn(best, lfn)
+            rewritten.append(path)
+        logger.info('Reading %s files through %s', len(se_paths), best)
+        return rewritten
+
+    def with_fallback(self, path, func):
+        """
+        Calls func(url) with path at the fastest endpoint; if it raises, the
+        endpoint is marked as failed and the next one is tried
+        """
+        mgm, lfn = svj.core.seutils.split_mgm(svj.core.seutils.format(path))
+        error = None
+        for endpoint in self.ranked(lfn):
+            try:
+                return func(svj.core.seutils._join_mgm_lfn(endpoint, lfn))
+            except Exception as e:
+                logger.warning('Endpoint %s failed for %s: %s; trying the next', endpoint, lfn, e)
+                self.mark_failed(endpoint)
+                error = e
+        raise error
+
+
+def get_configured_endpoints():
+    """
+    Returns the list of configured endpoints (may be empty)
+    """
+    if not(_selector is None): return _selector.endpoints
+    return [ e.strip().rstrip('/') for e in os.environ.get('SVJ_SE_ENDPOINTS', '').split(',') if e.strip() ]
+
+
+def is_configured(mgm):
+    return mgm.rstrip('/') in get_configured_endpoints()
+
+
+_selector = None
+
+def set_endpoints(endpoints, **kwargs):
+    """
+    Configures the endpoints to choose from; kwargs go to EndpointSelector
+    """
+    global _selector
+    if svj.core.utils.is_string(endpoints): endpoints = endpoints.split(',')
+    kwargs.setdefault('cache_file', os.environ.get('SVJ_ENDPOINT_CACHE', DEFAULT_CACHE_FILE))
+    kwargs.setdefault('ttl', float(os.environ.get('SVJ_ENDPOINT_CACHE_TTL', DEFAULT_TTL)))
+    _selector = EndpointSelector([ e.strip() for e in endpoints if e.strip() ], **kwargs)
+
+def get_selector():
+    """
+    Returns the EndpointSelector, or None if no endpoints are configured
+    """
+    if _selector is None and os.environ.get('SVJ_SE_ENDPOINTS', ''):
+        set_endpoints(os.environ['SVJ_SE_ENDPOINTS'])
+    return _selector
+
+
+def rewrite(paths):
+    """
+    Points SE paths at the fastest healthy configured endpoint; returns
+    the paths unchanged if no endpoints are configured
+    """
+    selector = get_selector()
+    if selector is None: return list(paths)
+    return selector.rewrite(paths)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent index of the number of events per root file, used for splitting
+jobs by events rather than by files.
+
+The entry count of the Events tree is read with uproot if it is installed,
+or else with PyROOT; both only read the file header and the TTree metadata,
+not the event data. Files are counted in parallel, and files whose size and
+mtime did not change since the last update are not opened again.
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, json, collections, threading
+from multiprocessing.pool import ThreadPool
+import svj.core
+
+logger = logging.getLogger('root')
+
+DEFAULT_TREE = 'Events'
+
+IndexEntry = collections.namedtuple('IndexEntry', ['path', 'size', 'mtime', 'n_events'])
+
+
+def count_events(path, tree=DEFAULT_TREE):
+    """
+    Returns the number of entries in `tree` of the root file `path`
+    (local or on the SE)
+    """
+    try:
+        import uproot
+        with uproot.open(path) as f:
+            t = f[tree]
+            return int(t.num_entries if hasattr(t, 'num_entries') else t.numentries)
+    except ImportError:
+        pass
+    try:
+        import ROOT
+    except ImportError:
+        raise ImportError('Counting events requires either uproot or PyROOT')
+    f = ROOT.TFile.Open(path)
+    if not f or f.IsZombie():
+        raise IOError('Could not open {0}'.format(path))
+    try:
+        t = f.Get(tree)
+        if not t:
+            raise IOError('No tree {0} in {1}'.format(tree, path))
+        return int(t.GetEntries())
+    finally:
+        f.Close()
+
+
+def _stat_se_root_files(path):
+    """
+    Returns the Entry of an SE root file, or the entries of the root files
+    directly in an SE directory (like list_root_files), from one stat and at
+    most one non-recursive listing
+    """
+    entry = svj.core.seutils.stat(path)
+    if entry is None:
+        logger.warning('%s does not exist', path)
+        return []
+    if not entry.is_dir:
+        return [entry]
+    return [
+        e for e in svj.core.seutils.list_directory_long(path)
+        if not e.is_dir and e.path.endswith('.root')
+        ]
+
+
+def stat_root_files(paths):
+    """
+    Takes a list of (local or SE) root files or directories containing root
+    files, and returns a list of (path, size, mtime) for all root files.
+    SE paths are looked up concurrently.
+    """
+    se_entries = {}
+    for path, entries, error in svj.core.seutils.iter_map(
+            _stat_se_root_files, [ p for p in paths if svj.core.utils._is_se_path(p) ]
+            ):
+        if error: raise error
+        se_entries[path] = entries
+    stats = []
+    for path in paths:
+        if svj.core.utils._is_se_path(path):
+            stats.extend(sorted((e.path, e.size, e.mtime) for e in se_entries[path]))
+        else:
+            for root_file in sorted(svj.core.utils.smart_list_root_files(path)):
+                stat = os.stat(root_file)
+                stats.append((root_file, stat.st_size, stat.st_mtime))
+    return stats
+
+
+class EventIndex(object):
+    """
+    Index of path -> (size, mtime, n_events), stored as json in index_file
+    """
+    def __init__(self, index_file=None, tree=DEFAULT_TREE, n_threads=8):
+        super(EventIndex, self).__init__()
+        self.index_file = index_file
+        self.tree = tree
+        self.n_threads = n_threads
+        self.entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if not(index_file is None) and osp.isfile(index_file):
+            self.load()
+
+    def load(self):
+        with open(self.index_file, 'r') as f:
+            data = json.load(f)
+        if data.get('tree', DEFAULT_TREE) != self.tree:
+            logger.warning(
+                'Index %s was made for tree %s, not %s; ignoring it',
+                self.index_file, data.get('tree'), self.tree
+                )
+            return
+        for path, size, mtime, n_events in data['entries']:
+            self.entries[path] = IndexEntry(path, size, mtime, n_events)
+        logger.info('Loaded %s entries from %s', len(self.entries), self.index_file)
+
+    def save(self):
+        if self.index_file is None: return
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({
+                'tree' : self.tree,
+                'entries' : [ list(entry) for entry in self.entries.values() ],
+                }, f)
+        os.rename(tmp_file, self.index_file)
+        logger.info('Saved %s entries to %s', len(self.entries), self.index_file)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def __getitem__(self, path):
+        return self.entries[path]
+
+    def n_events(self, path):
+        return self.entries[path].n_events
+
+    def _count(self, stat):
+        """
+        Counts and indexes the events of one file; returns the exception if that failed
+        """
+        path, size, mtime = stat
+        try:
+            n_events = count_events(path, self.tree)
+        except Exception as e:
+            logger.error('Could not count events in %s: %s', path, e)
+            return e
+        with self._lock:
+            self.entries[path] = IndexEntry(path, size, mtime, n_events)
+
+    def update(self, paths, save=True, skip_failed=False):
+        """
+        Indexes all root files in paths (root files or directories, local or
+        on the SE). Only new or changed files are opened.
+        Returns the list of IndexEntry objects for the root files in paths.
+        If counting the events of any file fails, raises an IOError after
+        saving the files that were counted, unless skip_failed is True, in
+        which case the failed files are left out.
+        """
+        if svj.core.utils.is_string(paths): paths = [paths]
+        stats = stat_root_files(paths)
+        todo = [
+            stat for stat in stats
+            if not(stat[0] in self.entries)
+            or self.entries[stat[0]].size != stat[1]
+            or self.entries[stat[0]].mtime != stat[2]
+            ]
+        logger.info(
+            'Indexing %s new or changed files out of %s (%s threads)',
+            len(todo), len(stats), self.n_threads
+            )
+        if todo:
+            pool = ThreadPool(max(1, min(self.n_threads, len(todo))))
+            try:
+                errors = pool.map(self._count, todo)
+            finally:
+                pool.close()
+            if save: self.save()
+            failed = [ stat[0] for stat, error in zip(todo, errors) if error ]
+            if failed:
+                if not skip_failed:
+                    raise IOError(
+                        'Could not count the events in {0} of {1} files: {2}'
+                        .format(len(failed), len(stats), ', '.join(failed))
+                        )
+                logger.warning('Leaving out %s files that could not be counted', len(failed))
+        return [ self.entries[stat[0]] for stat in stats if stat[0] in self.entries ]
+
+
+def split_by_events(entries, n_jobs=None, events_per_job=None):
+    """
+    Splits indexed files into jobs of about equal numbers of events. Small
+    files are packed together into one job, and large files are split over
+    several jobs. Specify either n_jobs or events_per_job.
+
+    Returns a list (one item per job) of lists of (path, first_event, n_events).
+    The ranges of a job are contiguous: the job starts at first_event of its
+    first file and reads all following events of the listed files.
+    """
+    entries = [ e for e in entries if e.n_events > 0 ]
+    n_total = sum(e.n_events for e in entries)
+    if n_total == 0: return []
+    if events_per_job is None:
+        if n_jobs is None:
+            raise ValueError('Specify either n_jobs or events_per_job')
+        events_per_job = -(-n_total // n_jobs)  # Ceil division
+    events_per_job = max(1, int(events_per_job))
+
+    jobs = []
+    current = []
+    n_current = 0
+    for entry in entries:
+        first_event = 0
+        while first_event < entry.n_events:
+            n_take = min(entry.n_events - first_event, events_per_job - n_current)
+            current.append((entry.path, first_event, n_take))
+            n_current += n_take
+            first_event += n_take
+            if n_current == events_per_job:
+                jobs.append(current)
+                current = []
+                n_current = 0
+    if current: jobs.append(current)
+    logger.info(
+        'Split %s events in %s files into %s jobs of up to %s events',
+        n_total, len(entries), len(jobs), events_per_job
+        )
+    return jobs
+
+
+def write_job_manifest(jobs, manifest_file):
+    """
+    Writes the per-job event ranges from split_by_events to a json manifest
+    """
+    with open(manifest_file, 'w') as f:
+        json.dump({ 'jobs' : jobs }, f)
+    logger.info('Wrote manifest for %s jobs to %s', len(jobs), manifest_file)
+
+
+def read_job_manifest(manifest_file=None, i_job=None):
+    """
+    Returns the event ranges [(path, first_event, n_events), ...] of job i_job
+    in the manifest. Defaults to $SVJ_JOB_MANIFEST and the index of the
+    current job (see svj.core.utils.get_job_index). Returns an empty list
+    for the payloads past the end of the manifest, which the last packed job
+    may have.
+    """
+    if manifest_file is None: manifest_file = os.environ['SVJ_JOB_MANIFEST']
+    if i_job is None: i_job = svj.core.utils.get_job_index()
+    with open(manifest_file, 'r') as f:
+        jobs = json.load(f)['jobs']
+    if i_job >= len(jobs):
+        logger.info('Job %s is past the %s jobs in %s; no events to process', i_job, len(jobs), manifest_file)
+        return []
+    return [ tuple(event_range) for event_range in jobs[i_job] ]
+
+
+def cmssw_source_settings(event_ranges):
+    """
+    Translates the (contiguous) event ranges of a job into the settings of a
+    cmsRun PoolSource: fileNames, skipEvents and maxEvents
+    """
+    return {
+        'fileNames' : [ path for path, first_event, n_events in event_ranges ],
+        'skipEvents' : event_ranges[0][1] if event_ranges else 0,
+        'maxEvents' : sum(n_events for path, first_event, n_events in event_ranges),
+        }
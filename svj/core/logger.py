@@ -1,3 +1,4 @@
+import os.path as osp
 import logging
 from .termcolor import colored
 
@@ -13,23 +14,33 @@ DEFAULT_LOGGER_NAME = 'root'
 DEFAULT_SUBPROCESS_LOGGER_NAME = 'subprocess'
 
 
-def setup_logger(name=DEFAULT_LOGGER_NAME):
-    handler = logging.StreamHandler()
-    handler.setFormatter(LOGGER_FORMATTER)
+def _has_svj_handler(logger):
+    """
+    Guards against adding the stream handler twice, e.g. when svj.core is
+    reloaded or the logger was already set up by another svj package
+    """
+    return any(getattr(handler, '_svj_handler', False) for handler in logger.handlers)
+
 
+def setup_logger(name=DEFAULT_LOGGER_NAME):
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
-    logger.addHandler(handler)
+    if not _has_svj_handler(logger):
+        handler = logging.StreamHandler()
+        handler.setFormatter(LOGGER_FORMATTER)
+        handler._svj_handler = True
+        logger.addHandler(handler)
     return logger
 
 
 def setup_subprocess_logger(name=DEFAULT_SUBPROCESS_LOGGER_NAME):
-    handler = logging.StreamHandler()
-    handler.setFormatter(SUBPROCESS_LOGGER_FORMATTER)
-
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
-    logger.addHandler(handler)
+    if not _has_svj_handler(logger):
+        handler = logging.StreamHandler()
+        handler.setFormatter(SUBPROCESS_LOGGER_FORMATTER)
+        handler._svj_handler = True
+        logger.addHandler(handler)
     return logger
 
 
@@ -55,11 +66,3 @@ def set_log_file(
     subprocess_file_handler = logging.FileHandler(log_file)
     subprocess_file_handler.setFormatter(SUBPROCESS_LOGGER_FORMATTER)
     subprocess_logger.addHandler(subprocess_file_handler)
-
-
-
-
-
-
-
-
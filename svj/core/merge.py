@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Merging of many small job outputs into files of a target size with hadd.
+
+Inputs are grouped by size using a recursive listing with size metadata,
+and read directly from the SE by hadd. Groups are merged in parallel, either
+locally in a thread pool or as one batch job per group. Groups with more than
+`fanin` files are merged as a tree: first into intermediate files of at most
+`fanin` inputs each, then the intermediate files into the final output.
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, tempfile, shutil, json
+from time import strftime
+from multiprocessing.pool import ThreadPool
+import svj.core
+
+logger = logging.getLogger('root')
+
+DEFAULT_TARGET_SIZE = 2 * 1024**3
+DEFAULT_FANIN = 200
+# Setup script that provides hadd in batch jobs; same ROOT as svj-core/env.sh on slc7
+DEFAULT_ROOT_SETUP = '/cvmfs/sft.cern.ch/lcg/releases/LCG_95/ROOT/6.16.00/x86_64-centos7-gcc7-opt/ROOT-env.sh'
+
+
+def list_inputs(paths):
+    """
+    Returns a list of svj.core.seutils.Entry objects for all root files in
+    paths (local or SE directories, searched recursively, or single files)
+    """
+    if svj.core.utils.is_string(paths): paths = [paths]
+    entries = []
+    for path in paths:
+        if svj.core.utils._is_se_path(path):
+            entry = svj.core.seutils.stat(path)
+            if entry is None:
+                logger.warning('%s does not exist', path)
+            elif entry.is_dir:
+                entries.extend(
+                    e for e in svj.core.seutils.list_recursive(path)
+                    if not e.is_dir and e.path.endswith('.root')
+                    )
+            else:
+                entries.append(entry)
+        else:
+            if osp.isdir(path):
+                files = []
+                for dirpath, dirnames, filenames in os.walk(path):
+                    files.extend(osp.join(dirpath, f) for f in filenames if f.endswith('.root'))
+            else:
+                files = [path]
+            for f in files:
+                stat = os.stat(f)
+                entries.append(svj.core.seutils.Entry(f, stat.st_size, stat.st_mtime, False))
+    entries.sort(key=lambda e: e.path)
+    return entries
+
+
+def plan_merge(entries, target_size=DEFAULT_TARGET_SIZE):
+    """
+    Groups entries (in order) into groups with a summed size of at most
+    target_size; a single file larger than target_size gets its own group.
+    Returns a list of lists of paths.
+    """
+    groups = []
+    current = []
+    current_size = 0
+    for entry in entries:
+        if current and current_size + entry.size > target_size:
+            groups.append(current)
+            current = []
+            current_size = 0
+        current.append(entry.path)
+        current_size += entry.size
+    if current: groups.append(current)
+    logger.info(
+        'Planned %s merged files of up to %.1f MB from %s inputs',
+        len(groups), target_size / 1024.**2, len(entries)
+        )
+    return groups
+
+
+def hadd(output, inputs, n_threads=1, dry=False):
+    """
+    Runs hadd to merge inputs (local paths or root:// urls) into output
+    """
+    cmd = [ 'hadd', '-f' ]
+    if n_threads > 1: cmd.extend([ '-j', str(n_threads) ])
+    cmd.append(output)
+    cmd.extend(inputs)
+    svj.core.utils.run_command(cmd, dry=dry)
+
+
+def plan_tree_hadd(output, inputs, fanin=DEFAULT_FANIN, workdir='.'):
+    """
+    Returns the hadd calls that merge inputs into output with at most fanin
+    inputs each, as a list of (output, inputs): intermediate files in workdir
+    are merged level by level. Both tree_hadd and the merge jobs (see
+    svj.core.condor.jobfiles.SHMerge) run these calls.
+    """
+    steps = []
+    level = 0
+    while len(inputs) > fanin:
+        intermediates = []
+        for i_chunk in range(0, len(inputs), fanin):
+            intermediate = osp.join(workdir, 'level{0}_{1}.root'.format(level, i_chunk // fanin))
+            steps.append((intermediate, inputs[i_chunk:i_chunk+fanin]))
+            intermediates.append(intermediate)
+        inputs = intermediates
+        level += 1
+    steps.append((output, inputs))
+    return steps
+
+
+def tree_hadd(output, inputs, fanin=DEFAULT_FANIN, n_threads=1, workdir=None, dry=False):
+    """
+    Merges inputs into output with at most fanin inputs per hadd call,
+    merging intermediate files level by level (see plan_tree_hadd)
+    """
+    if len(inputs) <= fanin:
+        hadd(output, inputs, n_threads=n_threads, dry=dry)
+        return
+    workdir = tempfile.mkdtemp(prefix='svjmerge_', dir=workdir)
+    try:
+        steps = plan_tree_hadd(output, inputs, fanin, workdir)
+        intermediates = set(step_output for step_output, step_inputs in steps[:-1])
+        for step_output, step_inputs in steps:
+            hadd(step_output, step_inputs, n_threads=n_threads, dry=dry)
+            # Intermediate files are no longer needed once merged
+            if not dry:
+                for f in step_inputs:
+                    if f in intermediates: os.remove(f)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def merge(
+        paths, outdir, target_size=DEFAULT_TARGET_SIZE, n_parallel=4, fanin=DEFAULT_FANIN,
+        hadd_threads=1, output_pattern='merged_{0:04d}.root', dry=False
+        ):
+    """
+    Merges all root files in paths into files of about target_size in outdir
+    (local or on the SE), running n_parallel merges at the same time.
+    Returns the list of merged files.
+    """
+    groups = plan_merge(list_inputs(paths), target_size)
+    outdir_on_se = svj.core.utils._is_se_path(outdir)
+    if outdir_on_se:
+        scratch = tempfile.mkdtemp(prefix='svjmerge_')
+    else:
+        svj.core.utils.create_directory(outdir, dry=dry)
+        scratch = outdir
+
+    def merge_group(args):
+        i_group, group = args
+        name = output_pattern.format(i_group)
+        local_output = osp.join(scratch, name)
+        tree_hadd(local_output, group, fanin=fanin, n_threads=hadd_threads, workdir=scratch, dry=dry)
+        if outdir_on_se:
+            output = osp.join(svj.core.seutils.format(outdir), name)
+            if not dry:
+                svj.core.seutils.copy_to_se(local_output, output, create_parent_directory=False)
+                os.remove(local_output)
+            return output
+        return local_output
+
+    try:
+        if outdir_on_se and not dry: svj.core.seutils.create_directory(outdir)
+        pool = ThreadPool(max(1, min(n_parallel, len(groups))))
+        try:
+            outputs = pool.map(merge_group, list(enumerate(groups)))
+        finally:
+            pool.close()
+    finally:
+        if outdir_on_se: shutil.rmtree(scratch)
+    logger.info('Merged into %s files in %s', len(outputs), outdir)
+    return outputs
+
+
+def submit_merge(
+        paths, outdir, rundir=None, target_size=DEFAULT_TARGET_SIZE,
+        fanin=DEFAULT_FANIN, hadd_threads=1, root_setup=DEFAULT_ROOT_SETUP, dry=False
+        ):
+    """
+    As merge, but runs one batch job per merged file through the configured
+    batch backend (see svj.core.condor.backends). outdir should be on the SE.
+    """
+    groups = plan_merge(list_inputs(paths), target_size)
+    if rundir is None:
+        rundir = osp.join(os.getcwd(), 'merge' + strftime('_%Y%m%d_%H%M%S'))
+    svj.core.utils.create_directory(rundir, must_not_exist=True, dry=dry)
+    with svj.core.utils.switchdir(rundir, dry=dry):
+        if not dry:
+            with open(svj.core.condor.jobfiles.MERGE_PLAN_FILE, 'w') as f:
+                json.dump([ plan_tree_hadd('merged.root', group, fanin) for group in groups ], f)
+        sh = svj.core.condor.jobfiles.SHMerge(
+            svj.core.seutils.format(outdir), hadd_threads=hadd_threads, root_setup=root_setup
+            )
+        sh.to_file('merge.sh', dry=dry)
+        jdl = svj.core.condor.jobfiles.JDLMerge('merge.sh', len(groups))
+        jdl.request_cpus = hadd_threads
+        jdl.to_file('merge.jdl', dry=dry)
+        svj.core.condor.submitters.submit_jdl('merge.jdl', dry=dry)
+    return rundir
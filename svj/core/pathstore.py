@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compact, read-only list of file paths for datasets with many files.
+
+A plain list of full paths repeats the same root://mgm//store/user/...
+directory for every file, and every entry is a separate python object.
+A PathStore keeps each directory once, and the file names front-coded in
+one buffer: every name only stores the part that differs from the previous
+name, except the first name of every block of BLOCK_SIZE names.
+
+    offsets       n+1 x uint64, start of the stored part of name i in names
+    directories   n x uint32, index of the directory of path i
+    shared        n x uint16, bytes name i shares with name i-1 (0 at block starts)
+    names         utf-8 stored parts of the names, concatenated
+
+Indexing is O(1) (at most BLOCK_SIZE names are decoded), slicing (e.g. the files of one job) returns a view on
+the same buffer without copying, and the buffer is also the file format:
+PathStore.load memory-maps a saved store, so a job reading its slice only
+touches the pages it needs instead of parsing the whole list.
+
+    store = svj.core.pathstore.PathStore(svj.core.utils.smart_list_root_files(dataset))
+    store.save('dataset.paths')
+    ...
+    rootfiles = svj.core.pathstore.PathStore.load('dataset.paths').chunk(i_job, n_jobs)
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, json, mmap, struct
+import svj.core
+
+logger = logging.getLogger('root')
+
+MAGIC = b'SVJPATH1'
+# Magic, number of paths, length of the directories json, length of the names
+HEADER = struct.Struct('<8sQQQ')
+BLOCK_SIZE = 16
+
+
+def _pad8(n):
+    return (n + 7) // 8 * 8
+
+
+def _shared_length(a, b):
+    # Binary search with slice comparisons, which is much faster than a per-byte loop
+    low, high = 0, min(len(a), len(b), 65535)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class PathStore(object):
+    """
+    Read-only sequence of paths; see the module docstring
+    """
+    def __init__(self, paths=()):
+        super(PathStore, self).__init__()
+        directory_index = {}
+        directories = []
+        offsets = [0]
+        directory_ids = []
+        shared = []
+        names = []
+        n_name_bytes = 0
+        previous = b''
+        for path in paths:
+            # The directory keeps its trailing slash, so a path is simply directory + name
+            i_slash = path.rfind('/') + 1
+            directory, name = path[:i_slash], path[i_slash:]
+            i_directory = directory_index.get(directory)
+            if i_directory is None:
+                i_directory = directory_index[directory] = len(directories)
+                directories.append(directory)
+            name = name.encode('utf-8')
+            n_shared = 0
+            if len(directory_ids) % BLOCK_SIZE:
+                n_shared = _shared_length(name, previous)
+            previous = name
+            shared.append(n_shared)
+            n_name_bytes += len(name) - n_shared
+            names.append(name[n_shared:])
+            offsets.append(n_name_bytes)
+            directory_ids.append(i_directory)
+        n = len(directory_ids)
+        directories_json = json.dumps(directories).encode('utf-8')
+        self._set_buffer(b''.join([
+            HEADER.pack(MAGIC, n, len(directories_json), n_name_bytes),
+            directories_json, b'\0' * (_pad8(len(directories_json)) - len(directories_json)),
+            struct.pack('<{0}Q'.format(n+1), *offsets),
+            struct.pack('<{0}I'.format(n), *directory_ids),
+            struct.pack('<{0}H'.format(n), *shared),
+            b'\0' * (_pad8(2*n) - 2*n),
+            b''.join(names),
+            ]))
+
+    def _set_buffer(self, buffer, start=0, stop=None):
+        magic, n, n_json, n_name_bytes = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a path store (magic {0!r})'.format(magic))
+        self._buffer = buffer
+        self._n_total = n
+        self._start = start
+        self._stop = n if stop is None else stop
+        json_start = HEADER.size
+        self.directories = json.loads(bytes(buffer[json_start:json_start+n_json]).decode('utf-8'))
+        self._offsets_start = json_start + _pad8(n_json)
+        self._directory_ids_start = self._offsets_start + 8 * (n+1)
+        self._shared_start = self._directory_ids_start + 4 * n
+        self._names_start = self._shared_start + _pad8(2 * n)
+        self._nbytes = self._names_start + n_name_bytes
+
+    @classmethod
+    def load(cls, path):
+        """
+        Opens a saved store by memory-mapping it; nothing is parsed except the directories
+        """
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        inst = cls.__new__(cls)
+        inst._set_buffer(buffer)
+        return inst
+
+    def save(self, path):
+        """
+        Writes the store (only the paths in this view) to path
+        """
+        if self._start == 0 and self._stop == self._n_total:
+            data = self._buffer[:self._nbytes]
+        else:
+            data = PathStore(iter(self))._buffer
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_file, path)
+        logger.info('Wrote %s paths to %s (%.1f MB)', len(self), path, len(data) / 1024.**2)
+
+    def _view(self, start, stop):
+        inst = self.__class__.__new__(self.__class__)
+        inst.__dict__.update(self.__dict__)
+        inst._start, inst._stop = start, stop
+        return inst
+
+    def _get(self, i):
+        # Decode the names from the start of the block up to name i
+        i_block = i - i % BLOCK_SIZE
+        offsets = struct.unpack_from(
+            '<{0}Q'.format(i - i_block + 2), self._buffer, self._offsets_start + 8*i_block
+            )
+        shared = struct.unpack_from(
+            '<{0}H'.format(i - i_block + 1), self._buffer, self._shared_start + 2*i_block
+            )
+        name = b''
+        for j in range(i - i_block + 1):
+            name = name[:shared[j]] + bytes(
+                self._buffer[self._names_start + offsets[j]:self._names_start + offsets[j+1]]
+                )
+        i_directory, = struct.unpack_from('<I', self._buffer, self._directory_ids_start + 4*i)
+        return self.directories[i_directory] + name.decode('utf-8')
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return [ self[j] for j in range(start, stop, step) ]
+            return self._view(self._start + start, self._start + max(start, stop))
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('PathStore index out of range')
+        return self._get(self._start + i)
+
+    def __iter__(self):
+        # Decode sequentially from the start of the first block, instead of per path
+        i_block = self._start - self._start % BLOCK_SIZE
+        n = self._stop - i_block
+        if n <= 0: return
+        offsets = struct.unpack_from('<{0}Q'.format(n+1), self._buffer, self._offsets_start + 8*i_block)
+        directory_ids = struct.unpack_from('<{0}I'.format(n), self._buffer, self._directory_ids_start + 4*i_block)
+        shared = struct.unpack_from('<{0}H'.format(n), self._buffer, self._shared_start + 2*i_block)
+        names_start = self._names_start
+        name = b''
+        for j in range(n):
+            name = name[:shared[j]] + bytes(self._buffer[names_start + offsets[j]:names_start + offsets[j+1]])
+            if i_block + j >= self._start:
+                yield self.directories[directory_ids[j]] + name.decode('utf-8')
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<PathStore of {0} paths in {1} directories>'.format(len(self), len(self.directories))
+
+    def __getstate__(self):
+        # Pickle only the paths in this view, in the compact form
+        if self._start == 0 and self._stop == self._n_total and not isinstance(self._buffer, mmap.mmap):
+            return bytes(self._buffer[:self._nbytes])
+        return PathStore(iter(self))._buffer
+
+    def __setstate__(self, state):
+        self._set_buffer(state)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def tolist(self):
+        return list(self)
+
+    def chunk(self, i, n_chunks):
+        """
+        The paths for job i out of n_chunks, like svj.core.utils.get_ith_chunk, as a view
+        """
+        chunk = svj.core.utils.get_ith_chunk(i, n_chunks, self)
+        return chunk if isinstance(chunk, PathStore) else self[0:0]
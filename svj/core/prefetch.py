@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Background prefetching of input files, so that copying the next files
+overlaps with processing the current one.
+
+    for local_file in svj.core.prefetch.Prefetcher(rootfiles, depth=2, budget=10*1024**3):
+        process(local_file)
+
+Files on the SE are copied into a scratch directory by background threads, at
+most `depth` files ahead of the one being processed, and only as long as the
+files on disk fit in `budget` bytes. A file is deleted as soon as the next one
+is requested. Local input files are yielded as they are.
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, shutil, tempfile
+from multiprocessing.pool import ThreadPool
+import svj.core
+
+logger = logging.getLogger('root')
+
+
+def _get_se_sizes(directory_and_pairs):
+    """
+    Returns a dict formatted path -> size for some files in one SE directory
+    """
+    directory, pairs = directory_and_pairs
+    if len(pairs) == 1:
+        entry = svj.core.seutils.stat(pairs[0][1])
+        return {} if entry is None else { entry.path : entry.size }
+    return dict(
+        (e.path, e.size) for e in svj.core.seutils.list_directory_long(directory) if not e.is_dir
+        )
+
+
+def get_sizes(paths):
+    """
+    Returns a dict path -> size in bytes, with one stat per SE file, or one
+    (non-recursive) listing per SE directory with several of the files, all
+    concurrently; paths that could not be found get size 0
+    """
+    sizes = {}
+    by_directory = {}
+    for path in paths:
+        if svj.core.utils._is_se_path(path):
+            path_formatted = svj.core.seutils.format(path)
+            by_directory.setdefault(osp.dirname(path_formatted), []).append((path, path_formatted))
+        elif osp.isfile(path):
+            sizes[path] = os.stat(path).st_size
+    for (directory, pairs), listing, error in svj.core.seutils.iter_map(
+            _get_se_sizes, by_directory.items()
+            ):
+        if error:
+            logger.warning('Could not get the sizes of the files in %s: %s', directory, error)
+            listing = {}
+        for path, path_formatted in pairs:
+            sizes[path] = listing.get(path_formatted, 0)
+    return sizes
+
+
+class Prefetcher(object):
+    """
+    Iterator over local copies of paths; see the module docstring
+    """
+    def __init__(self, paths, scratch_dir=None, depth=2, n_threads=2, budget=None, sizes=None):
+        super(Prefetcher, self).__init__()
+        self.paths = list(paths)
+        self.scratch_dir = scratch_dir
+        self.depth = depth
+        self.n_threads = n_threads
+        self.budget = budget
+        self.sizes = sizes
+        self.used = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def copy(self, path, dst):
+        """
+        Copies path to dst; through the fastest endpoint with fallback if
+        endpoints are configured (see svj.core.endpoints)
+        """
+        with svj.core.profiling.timer('prefetch.copy'):
+            selector = svj.core.endpoints.get_selector()
+            if selector is None:
+                svj.core.seutils.copy_from_se(path, dst)
+            else:
+                selector.with_fallback(path, lambda url: svj.core.seutils.copy_from_se(url, dst))
+        return dst
+
+    def __iter__(self):
+        is_remote = [ svj.core.utils._is_se_path(p) for p in self.paths ]
+        if not any(is_remote):
+            for path in self.paths: yield path
+            return
+        if self.budget and self.sizes is None:
+            self.sizes = get_sizes([ p for p, remote in zip(self.paths, is_remote) if remote ])
+        scratch_dir = tempfile.mkdtemp(
+            prefix='svjprefetch_',
+            dir=self.scratch_dir or (svj.core.RUNDIR if osp.isdir(svj.core.RUNDIR) else None)
+            )
+        pool = ThreadPool(self.n_threads)
+        pending = {}
+        self.used = 0
+
+        def size(i):
+            return self.sizes.get(self.paths[i], 0) if self.sizes else 0
+
+        def fits(i):
+            # Always allow one file, even if it exceeds the budget on its own
+            return not self.budget or not pending or self.used + size(i) <= self.budget
+
+        try:
+            i_next = 0
+            for i, path in enumerate(self.paths):
+                # Start copies up to depth files ahead, as far as the budget allows
+                while i_next < len(self.paths) and i_next <= i + self.depth:
+                    if is_remote[i_next]:
+                        if not fits(i_next): break
+                        dst = osp.join(scratch_dir, '{0}_{1}'.format(i_next, osp.basename(self.paths[i_next])))
+                        pending[i_next] = pool.apply_async(self.copy, (self.paths[i_next], dst))
+                        self.used += size(i_next)
+                    i_next += 1
+                if not is_remote[i]:
+                    yield path
+                    continue
+                with svj.core.profiling.timer('prefetch.wait'):
+                    local_path = pending[i].get()
+                try:
+                    yield local_path
+                finally:
+                    # Consumed; free the space for the next prefetches
+                    del pending[i]
+                    self.used -= size(i)
+                    if osp.isfile(local_path): os.remove(local_path)
+        finally:
+            # Do not wait for copies that are still running; their files go with the scratch dir
+            pool.close()
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def prefetch(paths, **kwargs):
+    """
+    Shortcut for Prefetcher(paths, **kwargs)
+    """
+    return Prefetcher(paths, **kwargs)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of subprocess, SE and tarball calls.
+
+Switched on by setting the environment variable SVJ_PROFILE (to anything but
+'' or '0') before svj.core is imported. When enabled, every function decorated
+with @profiled is timed and counted, and a report is written at exit to
+$SVJ_PROFILE_DIR/svj_profile_<cluster>_<process>[_<payload>].txt
+When disabled, @profiled returns the function unchanged.
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, time, threading, collections, functools, atexit
+
+logger = logging.getLogger('root')
+
+PROFILE = os.environ.get('SVJ_PROFILE', '')
+ENABLED = not(PROFILE in ['', '0'])
+
+# Maps a key to [ n_calls, n_failed, total_time, max_time ]
+_stats = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def record(key, elapsed, failed=False):
+    """
+    Adds one call of duration `elapsed` to the statistics of key
+    """
+    with _lock:
+        if not key in _stats: _stats[key] = [ 0, 0, 0., 0. ]
+        stat = _stats[key]
+        stat[0] += 1
+        if failed: stat[1] += 1
+        stat[2] += elapsed
+        stat[3] = max(stat[3], elapsed)
+
+
+class timer(object):
+    """
+    Context manager that records the time spent in the block under key
+    """
+    def __init__(self, key):
+        super(timer, self).__init__()
+        self.key = key
+
+    def __enter__(self):
+        self._t0 = time.time()
+
+    def __exit__(self, type, value, traceback):
+        if ENABLED: record(self.key, time.time() - self._t0, failed=not(type is None))
+
+
+def profiled(name=None, key=None):
+    """
+    Decorator that times and counts calls to a function.
+    `key` is an optional function taking the same arguments as the decorated
+    function, returning a string that is appended to the name (e.g. the
+    executable of a command).
+    """
+    def decorator(func):
+        if not ENABLED: return func
+        base_name = func.__name__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            full_name = base_name
+            if not(key is None):
+                try:
+                    full_name += ':' + str(key(*args, **kwargs))
+                except Exception:
+                    pass
+            t0 = time.time()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record(full_name, time.time() - t0, failed=failed)
+        return wrapper
+    return decorator
+
+
+def command_key(cmd, *args, **kwargs):
+    """
+    Key function for @profiled that returns the executable of a command
+    """
+    if isinstance(cmd, (list, tuple)): cmd = cmd[0]
+    return osp.basename(cmd.split()[0]) if cmd else cmd
+
+
+def get_report_file(ext='txt'):
+    """
+    Returns the path of the profiling report of this job (or payload)
+    """
+    name = 'svj_profile_{0}_{1}'.format(
+        os.environ.get('CONDOR_CLUSTER_NUMBER', 'local'),
+        os.environ.get('CONDOR_PROCESS_ID', os.getpid())
+        )
+    if 'SVJ_PAYLOAD_INDEX' in os.environ:
+        name += '_' + os.environ['SVJ_PAYLOAD_INDEX']
+    return osp.join(os.environ.get('SVJ_PROFILE_DIR', '.'), name + '.' + ext)
+
+
+def report():
+    """
+    Returns the collected statistics as a table, sorted by total time
+    """
+    with _lock:
+        stats = sorted(_stats.items(), key=lambda item: -item[1][2])
+    out = [ '{0:<50} {1:>8} {2:>7} {3:>12} {4:>12} {5:>12}'.format(
+        'call', 'n', 'failed', 'total (s)', 'mean (s)', 'max (s)'
+        )]
+    for key, (n_calls, n_failed, total, max_time) in stats:
+        out.append('{0:<50} {1:>8} {2:>7} {3:>12.3f} {4:>12.3f} {5:>12.3f}'.format(
+            key, n_calls, n_failed, total, total / n_calls, max_time
+            ))
+    return '\n'.join(out)
+
+
+def write_report(report_file=None):
+    """
+    Writes the profiling report to a file; does nothing if nothing was recorded
+    """
+    if len(_stats) == 0: return
+    if report_file is None: report_file = get_report_file()
+    try:
+        with open(report_file, 'w') as f:
+            f.write(report() + '\n')
+        logger.info('Wrote profiling report to %s', report_file)
+    except (IOError, OSError) as e:
+        logger.error('Could not write profiling report to %s: %s', report_file, e)
+
+
+if ENABLED:
+    atexit.register(write_report)
@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Storage element backends used by svj.core.seutils.
+
+A backend implements the SE operations on (mgm, lfn) pairs; svj.core.seutils
+takes care of splitting and formatting paths. The backend in use is chosen
+with seutils.set_backend, or with the environment variable SVJ_SE_BACKEND:
+    SVJ_SE_BACKEND=auto                       (default) pyxrootd if importable, else xrdcli
+    SVJ_SE_BACKEND=pyxrootd                   XRootD python bindings
+    SVJ_SE_BACKEND=xrdcli                     xrdfs/xrdcp commands
+    SVJ_SE_BACKEND=local:/path/to/root        local directory mirroring /store
+    SVJ_SE_BACKEND=local:/path/to/root:0.05   idem, with 50 ms latency per call
+"""
+
+import os.path as osp
+import logging, subprocess, os, shutil, time, threading, collections, functools, re, errno
+from multiprocessing.pool import ThreadPool
+import svj.core
+
+logger = logging.getLogger('root')
+
+# One entry of a recursive listing; path is an lfn for the backends, and a
+# full path with mgm as returned by svj.core.seutils.list_recursive
+Entry = collections.namedtuple('Entry', ['path', 'size', 'mtime', 'is_dir'])
+
+
+class SEBackend(object):
+    """
+    Interface of a storage element backend
+    """
+    name = 'base'
+
+    def mkdir(self, mgm, lfn):
+        """Creates a directory, including parent directories"""
+        raise NotImplementedError('Should be subclassed')
+
+    def is_directory(self, mgm, lfn):
+        raise NotImplementedError('Should be subclassed')
+
+    def is_file(self, mgm, lfn):
+        raise NotImplementedError('Should be subclassed')
+
+    def list_directory(self, mgm, lfn):
+        """Returns a list of lfns of the contents of a directory"""
+        raise NotImplementedError('Should be subclassed')
+
+    def copy_to_se(self, src, mgm, lfn):
+        """Copies a local file to the SE"""
+        raise NotImplementedError('Should be subclassed')
+
+    def copy_from_se(self, mgm, lfn, dst):
+        """Copies a file from the SE to a local path"""
+        raise NotImplementedError('Should be subclassed')
+
+    def remove(self, mgm, lfn):
+        """Removes a file"""
+        raise NotImplementedError('Should be subclassed')
+
+    def rmdir(self, mgm, lfn):
+        """Removes an empty directory"""
+        raise NotImplementedError('Should be subclassed')
+
+    def stat(self, mgm, lfn):
+        """Returns an Entry for lfn, or None if it does not exist"""
+        raise NotImplementedError('Should be subclassed')
+
+    def list_directory_long(self, mgm, lfn):
+        """
+        Returns a list of Entry objects for the direct contents of directory lfn,
+        like `ls -l`
+        """
+        raise NotImplementedError('Should be subclassed')
+
+    def list_recursive(self, mgm, lfn):
+        """
+        Returns a list of Entry objects for everything under directory lfn
+        (not including lfn itself)
+        """
+        raise NotImplementedError('Should be subclassed')
+
+    def stat_type(self, mgm, lfn):
+        """Returns 'dir', 'file', or None if the path does not exist"""
+        if self.is_directory(mgm, lfn): return 'dir'
+        if self.is_file(mgm, lfn): return 'file'
+        return None
+
+    def stat_many(self, mgm, lfns, n_threads=None):
+        """
+        Returns a dict lfn -> stat_type(lfn). Subclasses can override this
+        with something cheaper than a thread per concurrent call.
+        """
+        return dict(zip(lfns, _threaded_map(lambda lfn: self.stat_type(mgm, lfn), lfns, n_threads)))
+
+    def list_directory_many(self, mgm, lfns, n_threads=None):
+        """
+        Returns a dict lfn -> list_directory(lfn)
+        """
+        return dict(zip(lfns, _threaded_map(lambda lfn: self.list_directory(mgm, lfn), lfns, n_threads)))
+
+
+def _threaded_map(func, iterable, n_threads=None):
+    """
+    Maps func over iterable in threads; every call counts as one operation for
+    the SE limiter (see svj.core.seutils.get_limiter), which also sets the
+    number of threads if n_threads is None
+    """
+    limiter = svj.core.seutils.get_limiter()
+    if n_threads is None:
+        n_threads = limiter.maximum if limiter else 16
+    if limiter:
+        unlimited_func = func
+        def func(item):
+            with limiter.slot():
+                return unlimited_func(item)
+    iterable = list(iterable)
+    if len(iterable) <= 1 or n_threads <= 1:
+        return [ func(item) for item in iterable ]
+    pool = ThreadPool(min(n_threads, len(iterable)))
+    try:
+        return pool.map(func, iterable)
+    finally:
+        pool.close()
+
+
+def _remove_if_exists(path):
+    if osp.isfile(path): os.remove(path)
+
+
+class XrdCLIBackend(SEBackend):
+    """
+    Backend using the xrdfs and xrdcp command line tools
+    """
+    name = 'xrdcli'
+
+    def mkdir(self, mgm, lfn):
+        svj.core.utils.run_command([ 'xrdfs', mgm, 'mkdir', '-p', lfn ])
+
+    def is_directory(self, mgm, lfn):
+        cmd = [ 'xrdfs', mgm, 'stat', '-q', 'IsDir', lfn ]
+        logger.debug('cmd: %s', ' '.join(cmd))
+        try:
+            subprocess.check_call(cmd)
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.info('cmd failed, return code: %s', e.returncode)
+            return False
+
+    def is_file(self, mgm, lfn):
+        cmd = [ 'xrdfs', mgm, 'stat', '-q', 'IsReadable', lfn ]
+        try:
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+            return True
+        except subprocess.CalledProcessError as e:
+            logger.info('cmd failed, return code: %s', e.returncode)
+            return False
+
+    def list_directory(self, mgm, lfn):
+        contents = svj.core.utils.run_command([ 'xrdfs', mgm, 'ls', lfn ])
+        return [ l.strip() for l in contents if not len(l.strip()) == 0 ]
+
+    def transfer_watchdog(self, progress_file=None):
+        """
+        Watchdog for xrdcp from $SVJ_TRANSFER_WATCHDOG (see svj.core.utils.Watchdog).
+        xrdcp -s prints nothing, so only downloads, whose progress is visible
+        in the destination file, get a default stall timeout.
+        """
+        return svj.core.utils.Watchdog.from_env(
+            'SVJ_TRANSFER_WATCHDOG', default='stall=900' if progress_file else '',
+            progress_file=progress_file,
+            cleanup=None if progress_file is None else lambda: _remove_if_exists(progress_file)
+            )
+
+    def copy_to_se(self, src, mgm, lfn):
+        svj.core.utils.run_command(
+            [ 'xrdcp', '-s', src, svj.core.seutils._join_mgm_lfn(mgm, lfn) ],
+            watchdog=self.transfer_watchdog()
+            )
+
+    def copy_from_se(self, mgm, lfn, dst):
+        # xrdcp copies into a destination directory; watch the file it creates there
+        dst_file = osp.join(dst, osp.basename(lfn)) if osp.isdir(dst) else dst
+        svj.core.utils.run_command(
+            [ 'xrdcp', '-s', svj.core.seutils._join_mgm_lfn(mgm, lfn), dst ],
+            watchdog=self.transfer_watchdog(progress_file=dst_file)
+            )
+
+    def remove(self, mgm, lfn):
+        svj.core.utils.run_command([ 'xrdfs', mgm, 'rm', lfn ])
+
+    def rmdir(self, mgm, lfn):
+        svj.core.utils.run_command([ 'xrdfs', mgm, 'rmdir', lfn ])
+
+    def stat(self, mgm, lfn):
+        try:
+            output = subprocess.check_output(
+                [ 'xrdfs', mgm, 'stat', lfn ], stderr=subprocess.STDOUT
+                )
+        except subprocess.CalledProcessError:
+            return None
+        if not svj.core.utils.is_string(output): output = output.decode('utf-8', 'replace')
+        return parse_xrdfs_stat(output, lfn)
+
+    def _ls_l(self, mgm, lfn, recursive=False):
+        contents = svj.core.utils.run_command(
+            [ 'xrdfs', mgm, 'ls', '-l' ] + ([ '-R' ] if recursive else []) + [ lfn ]
+            )
+        entries = []
+        for line in contents:
+            line = line.strip()
+            if not line: continue
+            try:
+                entries.append(parse_xrdfs_ls_l_line(line))
+            except ValueError:
+                logger.warning('Could not parse xrdfs ls -l output line: %s', line)
+        return entries
+
+    def list_directory_long(self, mgm, lfn):
+        return self._ls_l(mgm, lfn)
+
+    def list_recursive(self, mgm, lfn):
+        return self._ls_l(mgm, lfn, recursive=True)
+
+
+_date_regex = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def parse_xrdfs_ls_l_line(line):
+    """
+    Parses a line of `xrdfs ls -l` output into an Entry. Handles both
+        dr-x 2019-10-23 13:01:24        4096 /store/user/foo
+    and the format that includes owner and group:
+        drwxrwxr-x user group        4096 2019-10-23 13:01:24 /store/user/foo
+    """
+    tokens = line.split()
+    path = tokens[-1]
+    is_dir = tokens[0].startswith('d')
+    i_date = None
+    for i, token in enumerate(tokens[1:-1]):
+        if _date_regex.match(token):
+            i_date = i + 1
+            break
+    if i_date is None or i_date + 1 >= len(tokens) - 1:
+        raise ValueError('No date in xrdfs ls -l line: {0}'.format(line))
+    mtime = time.mktime(time.strptime(
+        tokens[i_date] + ' ' + tokens[i_date+1], '%Y-%m-%d %H:%M:%S'
+        ))
+    if i_date + 2 < len(tokens) - 1:
+        size = tokens[i_date+2]
+    else:
+        size = tokens[i_date-1]
+    return Entry(path, int(size), mtime, is_dir)
+
+
+def parse_xrdfs_stat(output, lfn):
+    """
+    Parses the output of `xrdfs stat`, which looks like
+        Path:   /store/user/foo
+        Id:     0
+        Size:   4096
+        MTime:  2019-10-23 13:01:24
+        Flags:  51 (IsDir|IsReadable|IsWritable)
+    into an Entry
+    """
+    fields = {}
+    for line in output.split('\n'):
+        key, _, value = line.partition(':')
+        fields[key.strip()] = value.strip()
+    mtime = time.mktime(time.strptime(fields['MTime'], '%Y-%m-%d %H:%M:%S')) if fields.get('MTime') else None
+    return Entry(lfn, int(fields.get('Size', 0)), mtime, 'IsDir' in fields.get('Flags', ''))
+
+
+class PyXRootDBackend(SEBackend):
+    """
+    Backend using the XRootD python bindings. One XRootD.client.FileSystem
+    is kept per mgm, so connections are reused between calls, and the
+    *_many methods issue all requests asynchronously and wait for the
+    callbacks instead of spawning processes or threads.
+    """
+    name = 'pyxrootd'
+
+    def __init__(self, timeout=0):
+        super(PyXRootDBackend, self).__init__()
+        from XRootD import client
+        from XRootD.client.flags import MkDirFlags, StatInfoFlags
+        self.client = client
+        self.MkDirFlags = MkDirFlags
+        self.StatInfoFlags = StatInfoFlags
+        self.timeout = timeout
+        self._filesystems = {}
+        self._lock = threading.Lock()
+
+    def filesystem(self, mgm):
+        """Returns the cached FileSystem object for mgm"""
+        mgm = mgm.rstrip('/')
+        with self._lock:
+            if not mgm in self._filesystems:
+                self._filesystems[mgm] = self.client.FileSystem(mgm)
+            return self._filesystems[mgm]
+
+    def _check(self, status, what):
+        if not status.ok:
+            raise OSError('{0} failed: {1}'.format(what, status.message))
+
+    def _stat_info_to_type(self, status, info):
+        if not status.ok: return None
+        if info.flags & self.StatInfoFlags.IS_DIR: return 'dir'
+        if info.flags & self.StatInfoFlags.IS_READABLE: return 'file'
+        return None
+
+    def _is_error(self, status):
+        # A path that does not exist is a normal answer, not a server problem
+        return not status.ok and getattr(status, 'errno', 0) != 3011  # kXR_NotFound
+
+    def mkdir(self, mgm, lfn):
+        status, _ = self.filesystem(mgm).mkdir(lfn, self.MkDirFlags.MAKEPATH, timeout=self.timeout)
+        self._check(status, 'mkdir {0}'.format(lfn))
+
+    def stat_type(self, mgm, lfn):
+        status, info = self.filesystem(mgm).stat(lfn, timeout=self.timeout)
+        return self._stat_info_to_type(status, info)
+
+    def is_directory(self, mgm, lfn):
+        return self.stat_type(mgm, lfn) == 'dir'
+
+    def is_file(self, mgm, lfn):
+        return self.stat_type(mgm, lfn) == 'file'
+
+    def list_directory(self, mgm, lfn):
+        status, listing = self.filesystem(mgm).dirlist(lfn, timeout=self.timeout)
+        self._check(status, 'dirlist {0}'.format(lfn))
+        return [ osp.join(lfn, entry.name) for entry in listing ]
+
+    def _copy(self, src, dst):
+        process = self.client.CopyProcess()
+        process.add_job(src, dst)
+        self._check(process.prepare(), 'preparing copy {0} to {1}'.format(src, dst))
+        status, results = process.run()
+        self._check(status, 'copy {0} to {1}'.format(src, dst))
+        for result in results:
+            self._check(result['status'], 'copy {0} to {1}'.format(src, dst))
+
+    def copy_to_se(self, src, mgm, lfn):
+        self._copy(osp.abspath(src), svj.core.seutils._join_mgm_lfn(mgm, lfn))
+
+    def copy_from_se(self, mgm, lfn, dst):
+        self._copy(svj.core.seutils._join_mgm_lfn(mgm, lfn), osp.abspath(dst))
+
+    def remove(self, mgm, lfn):
+        status, _ = self.filesystem(mgm).rm(lfn, timeout=self.timeout)
+        self._check(status, 'rm {0}'.format(lfn))
+
+    def rmdir(self, mgm, lfn):
+        status, _ = self.filesystem(mgm).rmdir(lfn, timeout=self.timeout)
+        self._check(status, 'rmdir {0}'.format(lfn))
+
+    def stat(self, mgm, lfn):
+        status, info = self.filesystem(mgm).stat(lfn, timeout=self.timeout)
+        if not status.ok: return None
+        return Entry(lfn, info.size, info.modtime, bool(info.flags & self.StatInfoFlags.IS_DIR))
+
+    def _to_entry(self, path, statinfo):
+        return Entry(
+            path, statinfo.size, statinfo.modtime, bool(statinfo.flags & self.StatInfoFlags.IS_DIR)
+            )
+
+    def list_directory_long(self, mgm, lfn):
+        from XRootD.client.flags import DirListFlags
+        status, listing = self.filesystem(mgm).dirlist(lfn, DirListFlags.STAT, timeout=self.timeout)
+        self._check(status, 'dirlist {0}'.format(lfn))
+        return [ self._to_entry(osp.join(lfn, e.name), e.statinfo) for e in listing ]
+
+    def list_recursive(self, mgm, lfn):
+        from XRootD.client.flags import DirListFlags
+        fs = self.filesystem(mgm)
+        to_entry = self._to_entry
+        if hasattr(DirListFlags, 'RECURSIVE'):
+            # Single server-side recursive listing; entry names are relative to lfn
+            status, listing = fs.dirlist(
+                lfn, DirListFlags.STAT | DirListFlags.RECURSIVE, timeout=self.timeout
+                )
+            self._check(status, 'dirlist -R {0}'.format(lfn))
+            return [ to_entry(osp.join(lfn, e.name), e.statinfo) for e in listing ]
+        # Older XRootD: list level by level, with all directories of a level in flight at once
+        entries = []
+        level = [lfn]
+        dirlist = functools.partial(fs.dirlist, flags=DirListFlags.STAT)
+        while level:
+            results = self._async_many(
+                dirlist, level, lambda status, listing: listing if status.ok else status.message
+                )
+            next_level = []
+            for directory in level:
+                listing = results[directory]
+                if listing is None or svj.core.utils.is_string(listing):
+                    raise OSError('dirlist {0} failed: {1}'.format(directory, listing))
+                for e in listing:
+                    entry = to_entry(osp.join(directory, e.name), e.statinfo)
+                    entries.append(entry)
+                    if entry.is_dir: next_level.append(entry.path)
+            level = next_level
+        return entries
+
+    def _async_many(self, method, lfns, process_response):
+        """
+        Calls method(lfn, callback=...) for all lfns without waiting, then waits
+        until all callbacks came in. Returns a dict lfn -> process_response(status, response).
+        """
+        results = {}
+        done = threading.Condition()
+        # Requests in flight are limited by the SE limiter; a slot is freed in the callback
+        limiter = svj.core.seutils.get_limiter()
+
+        def make_callback(lfn, token):
+            def callback(status, response, hostlist):
+                if limiter: limiter.release(token, failed=self._is_error(status))
+                result = process_response(status, response)
+                with done:
+                    results[lfn] = result
+                    done.notify()
+            return callback
+
+        for lfn in lfns:
+            token = limiter.acquire() if limiter else None
+            status = method(lfn, callback=make_callback(lfn, token), timeout=self.timeout)
+            if not status.ok:
+                # The request could not even be queued; record it as failed
+                if limiter: limiter.release(token, failed=True)
+                results[lfn] = process_response(status, None)
+        with done:
+            while len(results) < len(lfns):
+                done.wait(1.)
+        return results
+
+    def stat_many(self, mgm, lfns, n_threads=None):
+        return self._async_many(self.filesystem(mgm).stat, lfns, self._stat_info_to_type)
+
+    def list_directory_many(self, mgm, lfns, n_threads=None):
+        results = self._async_many(
+            self.filesystem(mgm).dirlist, lfns,
+            lambda status, listing: [ e.name for e in listing ] if status.ok else status.message
+            )
+        for lfn, names in results.items():
+            if svj.core.utils.is_string(names):
+                raise OSError('dirlist {0} failed: {1}'.format(lfn, names))
+            results[lfn] = [ osp.join(lfn, name) for name in names ]
+        return results
+
+
+class LocalSEBackend(SEBackend):
+    """
+    Emulates a storage element with a local directory: the lfn /store/foo
+    maps to <root>/store/foo, for any mgm. Every call sleeps `latency` seconds
+    to emulate the round trip to a real SE.
+    """
+    name = 'local'
+
+    def __init__(self, root, latency=0.):
+        super(LocalSEBackend, self).__init__()
+        self.root = osp.abspath(root)
+        self.latency = float(latency)
+
+    def _path(self, lfn):
+        if self.latency > 0.: time.sleep(self.latency)
+        return osp.join(self.root, lfn.lstrip('/'))
+
+    def mkdir(self, mgm, lfn):
+        path = self._path(lfn)
+        if osp.isdir(path): return
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            # Concurrent copies into the same directory may create it first
+            if e.errno != errno.EEXIST or not osp.isdir(path): raise
+
+    def is_directory(self, mgm, lfn):
+        return osp.isdir(self._path(lfn))
+
+    def is_file(self, mgm, lfn):
+        return osp.isfile(self._path(lfn))
+
+    def list_directory(self, mgm, lfn):
+        path = self._path(lfn)
+        if not osp.isdir(path):
+            raise OSError('{0} is not a directory on the local SE'.format(lfn))
+        return [ osp.join(lfn, name) for name in sorted(os.listdir(path)) ]
+
+    def copy_to_se(self, src, mgm, lfn):
+        shutil.copyfile(src, self._path(lfn))
+
+    def copy_from_se(self, mgm, lfn, dst):
+        shutil.copyfile(self._path(lfn), dst)
+
+    def remove(self, mgm, lfn):
+        os.remove(self._path(lfn))
+
+    def rmdir(self, mgm, lfn):
+        os.rmdir(self._path(lfn))
+
+    def stat(self, mgm, lfn):
+        path = self._path(lfn)
+        if not osp.exists(path): return None
+        stat = os.stat(path)
+        return Entry(lfn, stat.st_size, stat.st_mtime, osp.isdir(path))
+
+    def list_directory_long(self, mgm, lfn):
+        path = self._path(lfn)
+        if not osp.isdir(path):
+            raise OSError('{0} is not a directory on the local SE'.format(lfn))
+        entries = []
+        for name in sorted(os.listdir(path)):
+            stat = os.stat(osp.join(path, name))
+            entries.append(Entry(
+                osp.join(lfn, name), stat.st_size, stat.st_mtime, osp.isdir(osp.join(path, name))
+                ))
+        return entries
+
+    def list_recursive(self, mgm, lfn):
+        top = self._path(lfn)
+        if not osp.isdir(top):
+            raise OSError('{0} is not a directory on the local SE'.format(lfn))
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames.sort()
+            for name in dirnames + sorted(filenames):
+                path = osp.join(dirpath, name)
+                stat = os.stat(path)
+                entries.append(Entry(
+                    '/' + osp.relpath(path, self.root), stat.st_size, stat.st_mtime,
+                    osp.isdir(path)
+                    ))
+        return entries
+
+
+def backend_from_string(spec):
+    """
+    Creates a backend from a string like 'xrdcli' or 'local:/path[:latency]'
+    """
+    name, _, options = spec.partition(':')
+    if name == 'auto':
+        try:
+            return PyXRootDBackend()
+        except ImportError:
+            logger.debug('XRootD python bindings not importable; using xrd command line tools')
+            return XrdCLIBackend()
+    elif name == 'pyxrootd':
+        return PyXRootDBackend()
+    elif name == 'xrdcli':
+        return XrdCLIBackend()
+    elif name == 'local':
+        if not options:
+            raise ValueError('Specify a root directory for the local SE backend: local:/path')
+        root, _, latency = options.partition(':')
+        return LocalSEBackend(root, latency=latency or 0.)
+    raise ValueError('Unknown SE backend {0}'.format(spec))
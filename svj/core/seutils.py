@@ -2,8 +2,11 @@
 # -*- coding: utf-8 -*-
 
 import os.path as osp
-import logging, subprocess, os, shutil, re, pprint, csv
+import logging, subprocess, os, shutil, re, pprint, csv, threading, time, contextlib, fnmatch
+from multiprocessing.pool import ThreadPool
 import svj.core
+from .profiling import profiled
+from .sebackends import Entry
 
 logger = logging.getLogger('root')
 DEFAULT_MGM = 'root://cmseos.fnal.gov'
@@ -45,8 +48,8 @@ def _safe_split_mgm(path, mgm=None):
         lfn = path
     else:
         lfn = path
-    # Some checks
-    if not mgm.rstrip('/') == DEFAULT_MGM.rstrip('/'):
+    # Some checks; endpoints configured in svj.core.endpoints are expected
+    if not mgm.rstrip('/') == DEFAULT_MGM.rstrip('/') and not svj.core.endpoints.is_configured(mgm):
         logger.warning(
             'Using mgm {0}, which is not the default mgm {1}'
             .format(mgm, DEFAULT_MGM)
@@ -65,6 +68,193 @@ def _join_mgm_lfn(mgm, lfn):
     if not mgm.endswith('/'): mgm += '/'
     return mgm + lfn
 
+class AdaptiveLimiter(object):
+    """
+    Limits the number of SE operations in flight, adapting the limit AIMD-style:
+    every successful operation raises the limit by 1/limit (so +1 per round of
+    `limit` operations), and an error, or a latency above latency_factor times
+    the lowest recent latency, halves it (at most once per round trip).
+    Latencies are tracked per kind of operation ('meta' for stat, ls, mkdir
+    and rm, 'list' for recursive listings), since a listing is expected to be
+    slower than a stat. The latency of a 'transfer' depends on the file size,
+    so transfers only lower the limit when they fail.
+    The limiter is shared by all threads that use it. If lock_dir is given,
+    operations also need one of the first `limit` slot lock files in lock_dir,
+    so processes on the same host share one budget of slots.
+    """
+    def __init__(
+            self, initial=8, minimum=1, maximum=64, latency_factor=3., backoff=.5,
+            lock_dir=None
+            ):
+        super(AdaptiveLimiter, self).__init__()
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.backoff = backoff
+        self.lock_dir = lock_dir
+        self.in_flight = 0
+        # kind -> [lowest recent latency, average latency]
+        self.latencies = {}
+        self.n_ok = 0
+        self.n_failed = 0
+        self._t_last_decrease = 0.
+        self._condition = threading.Condition()
+        if lock_dir and not osp.isdir(lock_dir):
+            try:
+                os.makedirs(lock_dir)
+            except OSError:
+                if not osp.isdir(lock_dir): raise
+
+    def _acquire_host_slot(self):
+        import fcntl
+        while True:
+            for i_slot in range(max(1, int(self.limit))):
+                f = open(osp.join(self.lock_dir, 'slot_{0}'.format(i_slot)), 'a')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return f
+                except IOError:
+                    f.close()
+            time.sleep(.02)
+
+    def acquire(self, kind='meta'):
+        """
+        Blocks until an operation may start; returns a token for release
+        """
+        with self._condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+        host_slot = self._acquire_host_slot() if self.lock_dir else None
+        return time.time(), host_slot, kind
+
+    def release(self, token, failed=False):
+        """
+        Marks the operation started with acquire as done, and adapts the limit
+        """
+        t_start, host_slot, kind = token
+        now = time.time()
+        latency = now - t_start
+        if host_slot: host_slot.close()  # Releases the flock
+        with self._condition:
+            self.in_flight -= 1
+            congested = failed
+            if failed:
+                self.n_failed += 1
+            else:
+                self.n_ok += 1
+                if kind != 'transfer':
+                    if not kind in self.latencies:
+                        self.latencies[kind] = [ latency, latency ]
+                    estimate = self.latencies[kind]
+                    # Let the baseline drift up slowly, so it follows a server that got slower
+                    estimate[0] = min(latency, estimate[0] * 1.01)
+                    estimate[1] = .8 * estimate[1] + .2 * latency
+                    congested = estimate[1] > self.latency_factor * max(estimate[0], .001)
+            if congested:
+                if now - self._t_last_decrease > latency:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._t_last_decrease = now
+                    logger.debug(
+                        'SE limiter: %s, limit down to %.1f',
+                        'failed {0}'.format(kind) if failed
+                        else '{0} latency {1:.3f}s'.format(kind, self.latencies[kind][1]),
+                        self.limit
+                        )
+            else:
+                self.limit = min(self.maximum, self.limit + 1. / self.limit)
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, kind='meta'):
+        token = self.acquire(kind)
+        try:
+            yield
+        except Exception:
+            self.release(token, failed=True)
+            raise
+        self.release(token)
+
+
+def limiter_from_string(spec):
+    """
+    Creates an AdaptiveLimiter from a string like 'initial=8,max=64,lockdir=/tmp/svj_se',
+    'fixed=16' for a constant limit, or returns None for '0' (no limit)
+    """
+    if spec.strip() == '0': return None
+    kwargs = {}
+    for item in spec.split(','):
+        if not item.strip(): continue
+        key, value = [ c.strip() for c in item.split('=', 1) ]
+        if key == 'fixed':
+            kwargs.update(initial=int(value), minimum=int(value), maximum=int(value))
+        elif key == 'initial': kwargs['initial'] = int(value)
+        elif key == 'min': kwargs['minimum'] = int(value)
+        elif key == 'max': kwargs['maximum'] = int(value)
+        elif key == 'latency_factor': kwargs['latency_factor'] = float(value)
+        elif key == 'lockdir': kwargs['lock_dir'] = value
+        else:
+            raise ValueError('Unknown limiter setting {0} in {1}'.format(key, spec))
+    return AdaptiveLimiter(**kwargs)
+
+_limiter = None
+_limiter_set = False
+
+def set_limiter(limiter):
+    """
+    Sets the limiter for concurrent SE operations. Accepts an AdaptiveLimiter,
+    a string for limiter_from_string, or None for no limit.
+    """
+    global _limiter, _limiter_set
+    if svj.core.utils.is_string(limiter): limiter = limiter_from_string(limiter)
+    _limiter = limiter
+    _limiter_set = True
+
+def get_limiter():
+    """
+    Returns the limiter shared by all SE operations in this process;
+    configured with $SVJ_SE_CONCURRENCY, by default adaptive between 1 and 64
+    """
+    if not _limiter_set:
+        set_limiter(os.environ.get('SVJ_SE_CONCURRENCY', ''))
+    return _limiter
+
+@contextlib.contextmanager
+def limited(kind='meta'):
+    """
+    Context manager around a single SE operation of kind 'meta', 'list' or 'transfer'
+    """
+    limiter = get_limiter()
+    if limiter is None:
+        yield
+    else:
+        with limiter.slot(kind):
+            yield
+
+_backend = None
+
+def set_backend(backend):
+    """
+    Sets the SE backend (see svj.core.sebackends) used by all functions in
+    this module. Accepts a backend instance or a string like 'local:/path'.
+    """
+    global _backend
+    if svj.core.utils.is_string(backend):
+        backend = svj.core.sebackends.backend_from_string(backend)
+    logger.info('Using SE backend %s', backend.name)
+    _backend = backend
+
+def get_backend():
+    """
+    Returns the SE backend; defaults to $SVJ_SE_BACKEND, or the XRootD python
+    bindings if they are importable, or else the xrd command line tools
+    """
+    if _backend is None:
+        set_backend(os.environ.get('SVJ_SE_BACKEND', 'auto'))
+    return _backend
+
+@profiled('seutils.create_directory')
 def create_directory(directory):
     """
     Creates a directory on the SE
@@ -72,48 +262,86 @@ def create_directory(directory):
     """
     mgm, directory = _safe_split_mgm(directory)
     logger.warning('Creating directory on SE: {0}'.format(_join_mgm_lfn(mgm, directory)))
-    cmd = [ 'xrdfs', mgm, 'mkdir', '-p', directory ]
-    svj.core.utils.run_command(cmd)
+    with limited():
+        get_backend().mkdir(mgm, directory)
 
+@profiled('seutils.is_directory')
 def is_directory(directory):
     """
     Returns a boolean indicating whether the directory exists
     """
     mgm, directory = _safe_split_mgm(directory)
-    cmd = [ 'xrdfs', mgm, 'stat', '-q', 'IsDir', directory ]
-    logger.debug('cmd: %s', ' '.join(cmd))
-    
-    try:
-        subprocess.check_call(cmd)
-        return True
-    except subprocess.CalledProcessError as e:
-        logger.info('cmd failed, return code: %s', e.returncode)
+    with limited():
+        status = get_backend().is_directory(mgm, directory)
+    if not status:
         logger.info('Directory {0} is not a directory'.format(_join_mgm_lfn(mgm, directory)))
-        return False
-        
+    return status
+
+@profiled('seutils.is_file')
 def is_file(file):
     """
     Returns a boolean indicating whether the directory exists
     """
     mgm, file = _safe_split_mgm(file)
-    cmd = [ 'xrdfs', mgm, 'stat', '-q', 'IsReadable', file ]
-    status = (subprocess.check_output(cmd) == 0)
+    with limited():
+        status = get_backend().is_file(mgm, file)
     if not status:
         logger.info('File {0} is not a file'.format(_join_mgm_lfn(mgm, file)))
     return status
 
+@profiled('seutils.copy_to_se')
 def copy_to_se(src, dst, create_parent_directory=True):
     """
     Copies a file `src` to the storage element
     """
     mgm, dst = _safe_split_mgm(dst)
-    dst = _join_mgm_lfn(mgm, dst)
     if create_parent_directory:
-        parent_directory = osp.dirname(dst)
+        parent_directory = osp.dirname(_join_mgm_lfn(mgm, dst))
         create_directory(parent_directory)
-    logger.warning('Copying {0} to {1}'.format(src, dst))
-    cmd = [ 'xrdcp', '-s', src, dst ]
-    svj.core.utils.run_command(cmd)
+    logger.warning('Copying {0} to {1}'.format(src, _join_mgm_lfn(mgm, dst)))
+    with limited('transfer'):
+        get_backend().copy_to_se(src, mgm, dst)
+
+@profiled('seutils.copy_from_se')
+def copy_from_se(src, dst):
+    """
+    Copies a file `src` on the storage element to the local path `dst`
+    """
+    mgm, src = _safe_split_mgm(src)
+    logger.info('Copying {0} to {1}'.format(_join_mgm_lfn(mgm, src), dst))
+    with limited('transfer'):
+        get_backend().copy_from_se(mgm, src, dst)
+
+@profiled('seutils.remove')
+def remove(file):
+    """
+    Removes a file from the storage element
+    """
+    mgm, file = _safe_split_mgm(file)
+    logger.warning('Removing {0}'.format(_join_mgm_lfn(mgm, file)))
+    with limited():
+        get_backend().remove(mgm, file)
+
+@profiled('seutils.remove_directory')
+def remove_directory(directory):
+    """
+    Removes an empty directory from the storage element
+    """
+    mgm, directory = _safe_split_mgm(directory)
+    logger.warning('Removing directory {0}'.format(_join_mgm_lfn(mgm, directory)))
+    with limited():
+        get_backend().rmdir(mgm, directory)
+
+@profiled('seutils.stat')
+def stat(path):
+    """
+    Returns an Entry (path, size, mtime, is_dir) for a path on the se,
+    or None if it does not exist
+    """
+    mgm, lfn = _safe_split_mgm(path)
+    with limited():
+        entry = get_backend().stat(mgm, lfn)
+    return None if entry is None else entry._replace(path=_join_mgm_lfn(mgm, lfn))
 
 def format(src, mgm=None):
     """
@@ -122,13 +350,96 @@ def format(src, mgm=None):
     mgm, lfn = _safe_split_mgm(src, mgm=mgm)
     return _join_mgm_lfn(mgm, lfn)
 
+@profiled('seutils.list_directory')
 def list_directory(directory):
     """
     Lists all files and directories in a directory on the se
     """
     mgm, directory = _safe_split_mgm(directory)
-    contents = svj.core.utils.run_command([ 'xrdfs', mgm, 'ls', directory ])
-    return [ format(l.strip(), mgm=mgm) for l in contents if not len(l.strip()) == 0 ]
+    with limited():
+        lfns = get_backend().list_directory(mgm, directory)
+    return [ format(lfn, mgm=mgm) for lfn in lfns ]
+
+@profiled('seutils.list_directory_long')
+def list_directory_long(directory):
+    """
+    Lists the files and directories in a directory on the se with their
+    metadata, like `ls -l`, returning Entry objects (path, size, mtime, is_dir)
+    """
+    mgm, directory = _safe_split_mgm(directory)
+    with limited():
+        entries = get_backend().list_directory_long(mgm, directory)
+    return [ entry._replace(path=format(entry.path, mgm=mgm)) for entry in entries ]
+
+def _split_many(paths):
+    """
+    Groups paths by mgm; returns a dict mgm -> list of (path, lfn)
+    """
+    by_mgm = {}
+    for path in paths:
+        mgm, lfn = _safe_split_mgm(path)
+        by_mgm.setdefault(mgm, []).append((path, lfn))
+    return by_mgm
+
+@profiled('seutils.stat_many')
+def stat_many(paths):
+    """
+    Returns a dict path -> 'dir', 'file' or None for many paths at once
+    """
+    result = {}
+    for mgm, pairs in _split_many(paths).items():
+        types = get_backend().stat_many(mgm, [ lfn for path, lfn in pairs ])
+        for path, lfn in pairs:
+            result[path] = types[lfn]
+    return result
+
+@profiled('seutils.list_directories')
+def list_directories(directories):
+    """
+    Lists many directories at once; returns a dict directory -> list of contents
+    """
+    result = {}
+    for mgm, pairs in _split_many(directories).items():
+        contents = get_backend().list_directory_many(mgm, [ lfn for path, lfn in pairs ])
+        for path, lfn in pairs:
+            result[path] = [ format(l, mgm=mgm) for l in contents[lfn] ]
+    return result
+
+@profiled('seutils.list_recursive')
+def list_recursive(directory):
+    """
+    Lists everything under a directory on the se in a single round trip,
+    returning Entry objects (path, size, mtime, is_dir)
+    """
+    mgm, directory = _safe_split_mgm(directory)
+    with limited('list'):
+        entries = get_backend().list_recursive(mgm, directory)
+    return [ entry._replace(path=format(entry.path, mgm=mgm)) for entry in entries ]
+
+def walk(directory):
+    """
+    Like os.walk, for a directory on the se. Yields tuples
+    (dirpath, directory entries, file entries), top-down, from a single
+    recursive listing.
+    """
+    top = format(directory).rstrip('/')
+    children = {}
+    for entry in list_recursive(top):
+        children.setdefault(osp.dirname(entry.path.rstrip('/')), []).append(entry)
+    stack = [top]
+    while stack:
+        dirpath = stack.pop(0)
+        entries = children.get(dirpath, [])
+        directories = [ e for e in entries if e.is_dir ]
+        files = [ e for e in entries if not e.is_dir ]
+        yield dirpath, directories, files
+        stack = [ e.path.rstrip('/') for e in directories ] + stack
+
+def du(directory):
+    """
+    Returns the total size in bytes of all files under a directory on the se
+    """
+    return sum(entry.size for entry in list_recursive(directory) if not entry.is_dir)
 
 def list_root_files(directory):
     """
@@ -138,3 +449,72 @@ def list_root_files(directory):
     root_files = [ f for f in contents if f.endswith('.root') ]
     root_files.sort()
     return root_files
+
+def is_glob(path):
+    return any(c in path for c in '*?[')
+
+@profiled('seutils.glob')
+def glob(pattern):
+    """
+    Returns the sorted paths on the se matching pattern, which may contain
+    shell wildcards in any directory level, e.g. /store/user/*/run_*/*.root.
+    Each wildcard level takes one concurrent round of listings.
+    """
+    mgm, lfn = _safe_split_mgm(pattern)
+    parts = lfn.strip('/').split('/')
+    i_first = next((i for i, part in enumerate(parts) if is_glob(part)), len(parts))
+    candidates = [ _join_mgm_lfn(mgm, '/' + '/'.join(parts[:i_first])) ]
+    for part in parts[i_first:]:
+        if not is_glob(part):
+            candidates = [ c.rstrip('/') + '/' + part for c in candidates ]
+            continue
+        types = stat_many(candidates)
+        directories = [ c for c in candidates if types[c] == 'dir' ]
+        listings = list_directories(directories) if directories else {}
+        candidates = [
+            path for directory in directories for path in listings[directory]
+            if fnmatch.fnmatchcase(osp.basename(path.rstrip('/')), part)
+            ]
+    if parts and not is_glob(parts[-1]) and candidates:
+        # Components after the last wildcard were not listed; keep the paths that exist
+        types = stat_many(candidates)
+        candidates = [ c for c in candidates if types[c] ]
+    return sorted(candidates)
+
+def expand(paths):
+    """
+    Formats paths on the se, expanding the ones with wildcards with glob
+    """
+    expanded = []
+    for path in paths:
+        if is_glob(path):
+            matches = glob(path)
+            if not matches: logger.error('No matches for %s', path)
+            expanded.extend(matches)
+        else:
+            expanded.append(format(path))
+    return expanded
+
+def iter_map(func, items, n_threads=None):
+    """
+    Calls func on all items in threads, and yields (item, result, exception)
+    as soon as each call finishes, so results can be shown as they arrive.
+    Every call in seutils counts against the SE limiter (see get_limiter),
+    which also sets the default number of threads.
+    """
+    items = list(items)
+    if not items: return
+    if n_threads is None:
+        limiter = get_limiter()
+        n_threads = limiter.maximum if limiter else 16
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+    pool = ThreadPool(max(1, min(n_threads, len(items))))
+    try:
+        for result in pool.imap_unordered(call, items):
+            yield result
+    finally:
+        pool.terminate()
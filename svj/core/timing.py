@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Aggregates the per-phase timing records written by the job scripts of
+svj.core.condor.jobfiles.SHPython (one JSON line per phase, in files
+svj_timing_<cluster>_<process>.jsonl)
+"""
+from __future__ import print_function
+
+import os.path as osp
+import logging, os, glob, json, collections
+
+logger = logging.getLogger('root')
+
+TIMING_FILE_PATTERN = 'svj_timing_*.jsonl'
+
+
+def iter_timing_files(paths, pattern=TIMING_FILE_PATTERN):
+    """
+    Yields timing files (or other files matching pattern) from a list of
+    files and/or directories (e.g. rundirs)
+    """
+    if not isinstance(paths, (list, tuple)): paths = [paths]
+    for path in paths:
+        if osp.isdir(path):
+            for timing_file in sorted(glob.glob(osp.join(path, pattern))):
+                yield timing_file
+        else:
+            yield path
+
+
+def read_timing_records(paths):
+    """
+    Reads all timing records from a list of files and/or directories
+    """
+    records = []
+    for timing_file in iter_timing_files(paths):
+        with open(timing_file, 'r') as f:
+            for i_line, line in enumerate(f):
+                line = line.strip()
+                if not line: continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning('Skipping malformed line %s in %s', i_line+1, timing_file)
+    logger.info('Read %s timing records', len(records))
+    return records
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile (0-100) of values, interpolating linearly
+    """
+    if len(values) == 0: return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100.
+    i_low = int(k)
+    i_high = min(i_low + 1, len(values) - 1)
+    return values[i_low] + (values[i_high] - values[i_low]) * (k - i_low)
+
+
+def summarize(records, n_slowest_hosts=5):
+    """
+    Summarizes timing records per phase (p50/p95/max of wall, cpu and peak RSS)
+    and ranks hosts by their mean wall time per job.
+    Returns a dict with keys 'phases' and 'slowest_hosts'.
+    """
+    by_phase = collections.OrderedDict()
+    host_wall = collections.defaultdict(float)
+    host_jobs = collections.defaultdict(set)
+    for record in records:
+        by_phase.setdefault(record['phase'], []).append(record)
+        # Only top-level phases count for the host wall time; per-payload phases
+        # overlap in time with the 'payloads' phase
+        if record.get('payload') is None:
+            host_wall[record['host']] += record['wall']
+        host_jobs[record['host']].add((record['cluster'], record['process']))
+
+    phases = collections.OrderedDict()
+    for phase, phase_records in by_phase.items():
+        summary = collections.OrderedDict()
+        summary['n'] = len(phase_records)
+        summary['n_failed'] = sum(1 for r in phase_records if r.get('exitcode', 0) != 0)
+        for key in [ 'wall', 'cpu', 'maxrss_kb' ]:
+            values = [ r[key] for r in phase_records if r.get(key) is not None ]
+            summary[key + '_p50'] = percentile(values, 50)
+            summary[key + '_p95'] = percentile(values, 95)
+            summary[key + '_max'] = max(values) if values else None
+        phases[phase] = summary
+
+    hosts = [
+        (host, host_wall[host] / len(host_jobs[host]), len(host_jobs[host]))
+        for host in host_jobs
+        ]
+    hosts.sort(key=lambda h: -h[1])
+    return {
+        'phases' : phases,
+        'slowest_hosts' : hosts[:n_slowest_hosts],
+        }
+
+
+def format_summary(summary):
+    """
+    Formats the output of summarize() as a human-readable table
+    """
+    def fmt(value):
+        return '-' if value is None else '{0:.2f}'.format(value)
+
+    out = [ '{0:<12} {1:>6} {2:>6} {3:>10} {4:>10} {5:>10} {6:>10} {7:>12}'.format(
+        'phase', 'n', 'failed', 'wall p50', 'wall p95', 'cpu p50', 'cpu p95', 'rss p95 (MB)'
+        )]
+    for phase, s in summary['phases'].items():
+        out.append('{0:<12} {1:>6} {2:>6} {3:>10} {4:>10} {5:>10} {6:>10} {7:>12}'.format(
+            phase, s['n'], s['n_failed'],
+            fmt(s['wall_p50']), fmt(s['wall_p95']),
+            fmt(s['cpu_p50']), fmt(s['cpu_p95']),
+            fmt(None if s['maxrss_kb_p95'] is None else s['maxrss_kb_p95'] / 1024.)
+            ))
+    out.append('')
+    out.append('Slowest hosts (mean wall time per job):')
+    for host, mean_wall, n_jobs in summary['slowest_hosts']:
+        out.append('  {0:<40} {1:>10}s  ({2} jobs)'.format(host, fmt(mean_wall), n_jobs))
+    return '\n'.join(out)
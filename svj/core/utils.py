@@ -3,7 +3,9 @@
 from __future__ import print_function
 
 import os.path as osp
-import logging, subprocess, os, shutil, re, pprint, csv, glob, math
+import logging, subprocess, os, shutil, re, pprint, csv, glob, math, hashlib, json, multiprocessing
+import signal, threading, time, sys
+from .profiling import profiled, command_key
 
 logger = logging.getLogger('root')
 subprocess_logger = logging.getLogger('subprocess')
@@ -28,83 +30,313 @@ class switchdir(object):
         if not self.dry: os.chdir(self._backdir)
 
 
-def run_command(cmd, env=None, dry=False, shell=False):
+class flock(object):
+    """
+    Holds an exclusive lock on lock_file, e.g. to let one of several
+    processes on a node fill a shared cache
+    """
+    def __init__(self, lock_file):
+        super(flock, self).__init__()
+        self.lock_file = lock_file
+        self._f = None
+
+    def __enter__(self):
+        import fcntl
+        self._f = open(self.lock_file, 'a')
+        fcntl.flock(self._f, fcntl.LOCK_EX)
+
+    def __exit__(self, type, value, traceback):
+        self._f.close()  # Releases the lock
+        self._f = None
+
+
+class CommandTimeout(subprocess.CalledProcessError):
+    """
+    Raised when a Watchdog killed a command; reason says which limit was hit
+    """
+    def __init__(self, returncode, cmd, reason, output=None):
+        super(CommandTimeout, self).__init__(returncode, cmd, output)
+        self.reason = reason
+
+    def __str__(self):
+        return 'Command {0!r} killed by watchdog: {1}'.format(self.cmd, self.reason)
+
+
+class Watchdog(object):
+    """
+    Limits for a running command. The command is killed (SIGTERM to its
+    process group, then SIGKILL after kill_grace seconds) when:
+    - stall_timeout: there was no output (and no growth of progress_file) for
+      this many seconds
+    - wall_timeout: it ran for longer than this many seconds
+    - min_throughput: progress_file grew by less than min_throughput bytes/s,
+      averaged over the last throughput_window seconds
+    A killed command is retried up to `retries` times, after calling
+    cleanup() if given (e.g. to remove a partially written file).
+    """
+    def __init__(
+            self, stall_timeout=None, wall_timeout=None, min_throughput=None,
+            throughput_window=120., progress_file=None, kill_grace=10., retries=0,
+            poll_interval=1., cleanup=None
+            ):
+        super(Watchdog, self).__init__()
+        self.stall_timeout = stall_timeout
+        self.wall_timeout = wall_timeout
+        self.min_throughput = min_throughput
+        self.throughput_window = throughput_window
+        self.progress_file = progress_file
+        self.kill_grace = kill_grace
+        self.retries = retries
+        self.poll_interval = poll_interval
+        self.cleanup = cleanup
+
+    _spec_keys = {
+        'stall' : ('stall_timeout', float),
+        'wall' : ('wall_timeout', float),
+        'throughput' : ('min_throughput', float),
+        'window' : ('throughput_window', float),
+        'grace' : ('kill_grace', float),
+        'retries' : ('retries', int),
+        }
+
+    @classmethod
+    def from_string(cls, spec, **kwargs):
+        """
+        Creates a Watchdog from a string like 'stall=600,wall=86400,retries=2'
+        (keys: stall, wall, throughput, window, grace, retries)
+        """
+        for item in spec.split(','):
+            if not item.strip(): continue
+            key, value = [ c.strip() for c in item.split('=', 1) ]
+            if not key in cls._spec_keys:
+                raise ValueError('Unknown watchdog setting {0} in {1}'.format(key, spec))
+            attr, type = cls._spec_keys[key]
+            kwargs.setdefault(attr, type(value))
+        return cls(**kwargs)
+
+    @classmethod
+    def from_env(cls, var='SVJ_WATCHDOG', default='', **kwargs):
+        """
+        Creates a Watchdog from the environment variable var, or returns None
+        if it is not set (and there is no default)
+        """
+        spec = os.environ.get(var, default)
+        if not spec: return None
+        return cls.from_string(spec, **kwargs)
+
+    def start(self):
+        self._t_start = time.time()
+        self._t_activity = self._t_start
+        self._progress = [ (self._t_start, self._progress_size()) ]
+
+    def _progress_size(self):
+        if self.progress_file is None: return 0
+        try:
+            return os.stat(self.progress_file).st_size
+        except OSError:
+            return 0
+
+    def activity(self):
+        """
+        Call on every line of output
+        """
+        self._t_activity = time.time()
+
+    def check(self):
+        """
+        Returns the reason to kill the command, or None if all is fine
+        """
+        now = time.time()
+        size = self._progress_size()
+        if size != self._progress[-1][1]: self._t_activity = now
+        self._progress.append((now, size))
+        # Keep only the samples needed for the throughput window
+        while len(self._progress) > 2 and now - self._progress[1][0] >= self.throughput_window:
+            self._progress.pop(0)
+        if self.wall_timeout and now - self._t_start > self.wall_timeout:
+            return 'exceeded wall time of {0}s'.format(self.wall_timeout)
+        if self.stall_timeout and now - self._t_activity > self.stall_timeout:
+            return 'no output or progress for {0}s'.format(self.stall_timeout)
+        if self.min_throughput and now - self._progress[0][0] >= self.throughput_window:
+            throughput = (size - self._progress[0][1]) / (now - self._progress[0][0])
+            if throughput < self.min_throughput:
+                return 'throughput {0:.0f} B/s below {1:.0f} B/s over {2}s'.format(
+                    throughput, self.min_throughput, self.throughput_window
+                    )
+        return None
+
+
+def new_session_kwargs(watchdog):
+    """
+    Popen keyword arguments to start the command in its own session and
+    process group, so that the watchdog can kill it and its children.
+    preexec_fn is not safe with threads, so it is only used on python 2,
+    which has no start_new_session.
+    """
+    if watchdog is None: return {}
+    if sys.version_info >= (3, 2): return { 'start_new_session' : True }
+    return { 'preexec_fn' : os.setsid }
+
+
+def kill_process_group(process, grace=10.):
+    """
+    Sends SIGTERM to the process group of process, and SIGKILL if it is
+    still running after grace seconds
+    """
+    for sig in [ signal.SIGTERM, signal.SIGKILL ]:
+        try:
+            os.killpg(process.pid, sig)
+        except OSError:
+            break  # Already gone
+        deadline = time.time() + grace
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(.1)
+        if not(process.poll() is None): break
+        logger.error('Process group %s survived SIGTERM; sending SIGKILL', process.pid)
+    process.wait()
+
+
+def _follow_output(process, watchdog=None, output=None):
+    """
+    Logs the output of process line by line (appending it to output if it
+    is a list) and waits for it to finish, enforcing the watchdog.
+    Returns the reason the watchdog killed the process, or None.
+    """
+    def read():
+        while True:
+            line = process.stdout.readline()
+            if not line: break
+            if not is_string(line): line = line.decode('utf-8', 'replace')
+            subprocess_logger.info(line.rstrip('\n'))
+            if not(output is None): output.append(line)
+            if not(watchdog is None): watchdog.activity()
+
+    if watchdog is None:
+        read()
+        process.stdout.close()
+        process.wait()
+        return None
+
+    watchdog.start()
+    reader = threading.Thread(target=read)
+    reader.daemon = True
+    reader.start()
+    reason = None
+    while reader.is_alive() or process.poll() is None:
+        reader.join(watchdog.poll_interval)
+        reason = watchdog.check()
+        if reason:
+            logger.error('Watchdog: killing process %s, %s', process.pid, reason)
+            kill_process_group(process, watchdog.kill_grace)
+            # Descendants that escaped the process group may keep the pipe open
+            reader.join(watchdog.kill_grace)
+            break
+    process.stdout.close()
+    process.wait()
+    return reason
+
+
+def _run_with_retries(run, cmd, watchdog):
+    """
+    Calls run(), retrying up to watchdog.retries times when the watchdog
+    killed the command
+    """
+    n_attempts = 1 + (watchdog.retries if watchdog else 0)
+    for i_attempt in range(n_attempts):
+        try:
+            return run()
+        except CommandTimeout as e:
+            if watchdog.cleanup: watchdog.cleanup()
+            if i_attempt + 1 == n_attempts: raise
+            logger.error('%s; retrying (%s/%s)', e, i_attempt + 1, n_attempts - 1)
+
+
+@profiled(key=command_key)
+def run_command(cmd, env=None, dry=False, shell=False, watchdog=None):
+    """
+    Runs a command and returns its output as a list of lines. Raises
+    subprocess.CalledProcessError on a nonzero exit status, or CommandTimeout
+    if the Watchdog (defaults to Watchdog.from_env()) killed the command.
+    """
     logger.warning('Issuing command: {0}'.format(' '.join(cmd)))
     if dry: return
+    if watchdog is None: watchdog = Watchdog.from_env()
 
     if shell:
         cmd = ' '.join(cmd)
 
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        env=env,
-        universal_newlines=True,
-        shell=shell
-        )
-
-    output = []
-    for stdout_line in iter(process.stdout.readline, ""):
-        subprocess_logger.info(stdout_line.rstrip('\n'))
-        output.append(stdout_line)
-    process.stdout.close()
-    process.wait()
-    returncode = process.returncode
+    def run():
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            universal_newlines=True,
+            shell=shell,
+            **new_session_kwargs(watchdog)
+            )
+        output = []
+        reason = _follow_output(process, watchdog, output)
+        if reason:
+            raise CommandTimeout(process.returncode, cmd, reason, ''.join(output))
+        returncode = process.returncode
+        if returncode == 0:
+            logger.info('Command exited with status 0 - all good')
+        else:
+            logger.error('Exit status {0} for command: {1}'.format(returncode, cmd))
+            raise subprocess.CalledProcessError(returncode, cmd, ''.join(output))
+        return output
 
-    if returncode == 0:
-        logger.info('Command exited with status 0 - all good')
-    else:
-        logger.error('Exit status {0} for command: {1}'.format(returncode, cmd))
-        raise subprocess.CalledProcessError(cmd, returncode)
-    return output
+    return _run_with_retries(run, cmd, watchdog)
 
 
-def run_multiple_commands(cmds, env=None, dry=False):
+@profiled()
+def run_multiple_commands(cmds, env=None, dry=False, watchdog=None):
+    """
+    Runs cmds in one bash session, stopping at the first error.
+    See run_command for the watchdog.
+    """
     logger.info('Sending cmds:\n{0}'.format(pprint.pformat(cmds)))
     if dry:
         logger.info('Dry mode - not running command')
         return
+    if watchdog is None: watchdog = Watchdog.from_env()
+
+    def run():
+        process = subprocess.Popen(
+            'bash',
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            # universal_newlines=True,
+            close_fds=True,
+            **new_session_kwargs(watchdog)
+            )
 
-    process = subprocess.Popen(
-        'bash',
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        env=env,
-        # universal_newlines=True,
-        bufsize=1,
-        close_fds=True
-        )
-
-    # Break on first error (stdin will still be written but execution will be stopped)
-    process.stdin.write('set -e\n')
-    process.stdin.flush()
-
-    for cmd in cmds:
-        if not(type(cmd) is str):
-            cmd = ' '.join(cmd)
-        if not(cmd.endswith('\n')):
-            cmd += '\n'
-        # logger.warning('Sending cmd \'{0}\''.format(cmd.replace('\n', '\\n')))
-        process.stdin.write(cmd)
-        process.stdin.flush()
-    process.stdin.close()
-
-    process.stdout.flush()
-    for line in iter(process.stdout.readline, ""):
-        if len(line) == 0: break
-        # print(colored('[subprocess] ', 'red') + line, end='')
-        subprocess_logger.info(line.rstrip('\n'))
+        # Break on first error (stdin will still be written but execution will be stopped)
+        stdin = [ 'set -e\n' ]
+        for cmd in cmds:
+            if not(type(cmd) is str):
+                cmd = ' '.join(cmd)
+            if not(cmd.endswith('\n')):
+                cmd += '\n'
+            stdin.append(cmd)
+        stdin = ''.join(stdin)
+        process.stdin.write(stdin if isinstance(stdin, bytes) else stdin.encode())
+        process.stdin.close()
+
+        reason = _follow_output(process, watchdog)
+        if reason:
+            raise CommandTimeout(process.returncode, cmds, reason)
+        returncode = process.returncode
+
+        if (returncode == 0):
+            logger.info('Command exited with status 0 - all good')
+        else:
+            raise subprocess.CalledProcessError(returncode, cmds)
 
-    process.stdout.close()
-    process.wait()
-    returncode = process.returncode
-
-    if (returncode == 0):
-        logger.info('Command exited with status 0 - all good')
-    else:
-        raise subprocess.CalledProcessError(cmd, returncode)
+    _run_with_retries(run, cmds, watchdog)
 
 
 def create_directory(dir, force=False, dry=False, must_not_exist=False):
@@ -181,6 +413,7 @@ def decomment(open_file):
         if line: yield line
 
 
+@profiled()
 def setup_cmssw(workdir, version, arch):
     """
     Generic function to set up CMSSW in workdir
@@ -196,39 +429,145 @@ def setup_cmssw(workdir, version, arch):
         'source /cvmfs/cms.cern.ch/cmsset_default.sh',
         'export SCRAM_ARCH={0}'.format(arch),
         'cmsrel {0}'.format(version),
-        'cd {0}/src'.format(version),
-        'cmsenv',
-        'scram b',
         ]
     run_multiple_commands(cmds)
+    compile_cmssw_src(osp.join(workdir, version, 'src'), arch, clean_env=False)
     logger.info('Done setting up {0} {1} in {2}'.format(version, arch, workdir))
 
 
-def compile_cmssw_src(cmssw_src, arch, clean_env=True):
+# Build status record, stored in CMSSW_BASE
+CMSSW_BUILD_STATUS_FILE = '.svj_build_status.json'
+
+
+def sha1sum(path, blocksize=1024**2):
+    """
+    Returns the sha1 hex digest of a file
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def fingerprint_cmssw_src(cmssw_src, previous=None):
+    """
+    Returns a dict relpath -> [size, mtime, sha1] of all files in cmssw_src
+    (hidden files and directories such as .git are skipped). Files whose size
+    and mtime match the entry in the previous fingerprint are not rehashed.
+    """
+    previous = {} if previous is None else previous
+    fingerprint = {}
+    n_hashed = 0
+    for dirpath, dirnames, filenames in os.walk(cmssw_src):
+        dirnames[:] = [ d for d in dirnames if not d.startswith('.') ]
+        for filename in filenames:
+            if filename.startswith('.'): continue
+            path = osp.join(dirpath, filename)
+            relpath = osp.relpath(path, cmssw_src)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # Broken symlink
+            entry = previous.get(relpath)
+            if entry and entry[0] == st.st_size and entry[1] == st.st_mtime:
+                fingerprint[relpath] = entry
+            else:
+                fingerprint[relpath] = [ st.st_size, st.st_mtime, sha1sum(path) ]
+                n_hashed += 1
+    logger.debug('Fingerprinted %s files in %s, hashed %s', len(fingerprint), cmssw_src, n_hashed)
+    return fingerprint
+
+
+def fingerprint_digest(fingerprint):
     """
-    Generic function to (re)compile a CMSSW setup
+    Single hash of a fingerprint, based on file names and contents only, so
+    that touching a file without changing it does not trigger a rebuild
+    """
+    sha1 = hashlib.sha1()
+    for relpath in sorted(fingerprint):
+        sha1.update('{0} {1}\n'.format(relpath, fingerprint[relpath][2]).encode())
+    return sha1.hexdigest()
+
+
+def read_cmssw_build_status(cmssw_base):
+    status_file = osp.join(cmssw_base, CMSSW_BUILD_STATUS_FILE)
+    if not osp.isfile(status_file): return {}
+    try:
+        with open(status_file, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        logger.warning('Could not read %s; rebuilding', status_file)
+        return {}
+
+
+def write_cmssw_build_status(cmssw_base, status):
+    status_file = osp.join(cmssw_base, CMSSW_BUILD_STATUS_FILE)
+    with open(status_file + '.tmp', 'w') as f:
+        json.dump(status, f)
+    os.rename(status_file + '.tmp', status_file)
+
+
+def get_n_cores():
+    """
+    Number of cores available to this process; $SVJ_BUILD_CORES overrides it
+    """
+    if 'SVJ_BUILD_CORES' in os.environ:
+        return int(os.environ['SVJ_BUILD_CORES'])
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+@profiled()
+def compile_cmssw_src(cmssw_src, arch, clean_env=True, force=False, n_cores=None):
+    """
+    Generic function to (re)compile a CMSSW setup. The build is skipped if
+    the contents of cmssw_src did not change since the last successful build
+    with the same scram arch (see CMSSW_BUILD_STATUS_FILE), unless force=True.
+    Returns True if scram b was run.
     """
     if not osp.abspath(cmssw_src).endswith('src'):
         raise ValueError('cmssw_src {0} does not end with "src"'.format(cmssw_src))
-
-    logger.info('Compiling {0} with scram arch {1}'.format(cmssw_src, arch))
+    cmssw_base = osp.dirname(osp.abspath(cmssw_src))
+
+    status = read_cmssw_build_status(cmssw_base)
+    fingerprint = fingerprint_cmssw_src(cmssw_src, status.get('files'))
+    digest = fingerprint_digest(fingerprint)
+    if not force and status.get('digest') == digest and status.get('arch') == arch:
+        logger.info('{0} did not change since the last build; skipping scram b'.format(cmssw_src))
+        if fingerprint != status.get('files'):
+            # Only mtimes changed; store them so the files are not rehashed next time
+            status['files'] = fingerprint
+            write_cmssw_build_status(cmssw_base, status)
+        return False
+
+    if n_cores is None: n_cores = get_n_cores()
+    logger.info('Compiling {0} with scram arch {1} on {2} cores'.format(cmssw_src, arch, n_cores))
     cmds = [
         'shopt -s expand_aliases',
         'source /cvmfs/cms.cern.ch/cmsset_default.sh',
         'export SCRAM_ARCH={0}'.format(arch),
         'cd {0}'.format(cmssw_src),
         'cmsenv',
-        'scram b',
+        'scram b -j {0}'.format(n_cores),
         ]
     run_multiple_commands(cmds, env=get_clean_env() if clean_env else None)
+    write_cmssw_build_status(cmssw_base, {
+        'arch' : arch,
+        'digest' : digest,
+        'files' : fingerprint,
+        })
     logger.info('Done compiling {0} with scram arch {1}'.format(cmssw_src, arch))
+    return True
 
 
-def compile_cmssw(workdir, version, arch):
+def compile_cmssw(workdir, version, arch, force=False):
     """
     As compile_cmssw_src but takes separated arguments
     """
-    compile_cmssw_src(osp.join(workdir, version))
+    return compile_cmssw_src(osp.join(workdir, version, 'src'), arch, force=force)
 
 
 def get_clean_env():
@@ -357,7 +696,18 @@ def is_string(string):
         basestring = str
     return isinstance(string, basestring)
 
+def format_size(n_bytes):
+    """
+    Formats a number of bytes like du -h, e.g. 1.5G
+    """
+    size = float(n_bytes)
+    for unit in [ '', 'K', 'M', 'G', 'T' ]:
+        if size < 1024. or unit == 'T': break
+        size /= 1024.
+    return '{0:.0f}{1}'.format(size, unit) if unit == '' else '{0:.1f}{1}'.format(size, unit)
 
+
+@profiled()
 def tarball(module, outfile=None, dry=False):
     """
     Takes a python module or a path to a file of said module, goes to the associated
@@ -405,6 +755,7 @@ def tarball(module, outfile=None, dry=False):
         return outfile
 
 
+@profiled()
 def tarball_cmssw(cmssw_path, outdir='.', tag=None, dry=False):
     """
     :param cmssw_path: Path to CMSSW_BASE (i.e. ../src)
@@ -430,15 +781,17 @@ def tarball_cmssw(cmssw_path, outdir='.', tag=None, dry=False):
             'tar',
             '--exclude-caches-all',
             '--exclude-vcs',
+            # Excludes must come before the path for recent versions of tar
+            # '--exclude=src',  # Necessary? Probably do need src... it's anyway tiny, usually
+            '--exclude=tmp',
             '-zcvf',
             dst_abs,
             osp.basename(cmssw_path),
-            # '--exclude=src',  # Necessary? Probably do need src... it's anyway tiny, usually
-            '--exclude=tmp',
             ]
         run_command(cmd, dry=dry)
 
 
+@profiled()
 def extract_tarball(tarball, outdir='.', dry=False):
     """
     Extracts a tarball to outdir
@@ -501,6 +854,32 @@ def get_ith_chunk(i, n_chunks, all):
 
 
 
+def _is_se_path(path):
+    return path.startswith('root:') or path.startswith('/store')
+
+
+def _list_se_root_files(paths):
+    """
+    Takes a list of paths on the SE to root files or directories containing
+    root files, and returns a dict path -> list of root files.
+    All paths are queried at once, so the SE backend can do it concurrently.
+    """
+    import svj.core
+    types = svj.core.seutils.stat_many(paths)
+    directories = [ path for path in paths if types[path] == 'dir' ]
+    listings = svj.core.seutils.list_directories(directories) if directories else {}
+    result = {}
+    for path in paths:
+        if types[path] == 'dir':
+            result[path] = sorted(f for f in listings[path] if f.endswith('.root'))
+        elif types[path] == 'file':
+            result[path] = [svj.core.seutils.format(path)]
+        else:
+            logger.error('Remote path %s could not be found; skipping', path)
+            result[path] = []
+    return result
+
+
 def _smart_list_root_file_or_dir(path):
     """
     Takes a path to
@@ -508,17 +887,9 @@ def _smart_list_root_file_or_dir(path):
     - a local or remote directory containing root files
     and returns a list of root files
     """
-    import svj.core
-    if path.startswith('root:') or path.startswith('/store'):
+    if _is_se_path(path):
         # This is on SE
-        if svj.core.seutils.is_directory(path):
-            # It's a directory
-            return svj.core.seutils.list_root_files(path)
-        elif svj.core.seutils.is_file(path):
-            return [svj.core.seutils.format(path)]
-        else:
-            logger.error('Remote path %s could not be found; skipping', path)
-            return []
+        return _list_se_root_files([path])[path]
     else:
         # This is local
         if osp.isdir(path):
@@ -530,7 +901,7 @@ def _smart_list_root_file_or_dir(path):
             return []
 
 
-def smart_list_root_files(root_file_collection):
+def smart_list_root_files(root_file_collection, compact=False):
     """
 
     Takes a string or nested list of root files, or directories containing 
@@ -540,18 +911,33 @@ def smart_list_root_files(root_file_collection):
 
     :param root_file_collection: A string or list of paths to root files, or directories containing root files
     :type root_file_collection: str, list
+    :param compact: Return a svj.core.pathstore.PathStore instead of a list, for very large datasets
+    :type compact: bool
     """
     all_root_files = []
     if is_string(root_file_collection): root_file_collection = [root_file_collection]
 
+    # Query all SE paths on this level in one go
+    se_paths = [ p for p in root_file_collection if is_string(p) and _is_se_path(p) ]
+    se_root_files = _list_se_root_files(se_paths) if se_paths else {}
+
     for path in root_file_collection:
         if is_string(path):
-            all_root_files.extend(_smart_list_root_file_or_dir(path))
+            if path in se_root_files:
+                all_root_files.extend(se_root_files[path])
+            else:
+                all_root_files.extend(_smart_list_root_file_or_dir(path))
         else:
             # Call this function recursively until _smart_list_root_file_or_dir
             # can be safely called on a string
             all_root_files.extend(smart_list_root_files(path))
 
+    # Read through the fastest configured endpoint (see svj.core.endpoints)
+    import svj.core
+    if se_paths and svj.core.endpoints.get_configured_endpoints():
+        all_root_files = svj.core.endpoints.rewrite(all_root_files)
+    if compact:
+        return svj.core.pathstore.PathStore(all_root_files)
     return all_root_files
 
 
@@ -572,6 +958,16 @@ def iter_chunkify(mylist, n_chunks):
 def chunkify(mylist, n_chunks):
     return list(iter_chunkify(mylist, n_chunks))
 
+def get_job_index():
+    """
+    Returns the index of the work unit of the current job. For packed jobs
+    (multiple payloads per job) this is SVJ_JOB_INDEX, otherwise the condor
+    process id.
+    """
+    if 'SVJ_JOB_INDEX' in os.environ:
+        return int(os.environ['SVJ_JOB_INDEX'])
+    return int(os.environ.get('CONDOR_PROCESS_ID', 0))
+
 def get_rootfiles_for_job(list_of_rootfile_directories, n_jobs, i_job):
     """
     :param list_of_rootfile_directories: List of directories that contain .root files
@@ -593,3 +989,31 @@ def get_rootfiles_for_job(list_of_rootfile_directories, n_jobs, i_job):
     rootfiles_for_this_job = chunkify(rootfiles, n_sub_chunks)[i_sub_chunk]
     return directory, rootfiles_for_this_job
 
+
+def get_event_ranges_for_job(list_of_rootfile_directories, n_jobs, i_job, index_file=None):
+    """
+    As get_rootfiles_for_job, but splits by events instead of by files, using
+    an svj.core.eventindex.EventIndex stored in index_file, default
+    $SVJ_EVENT_INDEX (filled at submit time from the input_dataset directive).
+    Only files missing from the index are counted.
+    Returns a list of (rootfile, first_event, n_events) for the ith job.
+
+    :param list_of_rootfile_directories: List of directories that contain .root files
+    :type list_of_rootfile_directories: list
+    :param n_jobs: Number of jobs over which to split up the events
+    :type n_jobs: int
+    :param i_job: The ith job for which to return the event ranges
+    :type i_job: int
+    """
+    import svj.core
+    if index_file is None: index_file = os.environ.get('SVJ_EVENT_INDEX')
+    if index_file is None:
+        logger.warning(
+            'No event index; counting the events of all files. Set the input_dataset '
+            'directive to count them once at submit time.'
+            )
+    index = svj.core.eventindex.EventIndex(index_file)
+    # Jobs only read the index; many jobs writing the same file would clobber it
+    entries = index.update(list_of_rootfile_directories, save=not svj.core.BATCH_MODE)
+    jobs = svj.core.eventindex.split_by_events(entries, n_jobs=n_jobs)
+    return jobs[i_job] if i_job < len(jobs) else []